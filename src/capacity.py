@@ -0,0 +1,152 @@
+import os
+import shutil
+import logging
+import threading
+from object_store import is_object_url
+
+# 每个备份卷保留的空闲空间，避免把备份盘完全写满
+SPACE_RESERVE = 512 * 1024 * 1024
+
+
+def free_space(path):
+    """路径所在卷的可用空间（字节）
+
+    路径尚不存在时查询最近的已存在上级目录；对象存储或无法查询时返回 None（视为不限）
+    """
+    if is_object_url(path):
+        return None
+    probe = os.path.abspath(path)
+    while not os.path.exists(probe):
+        parent = os.path.dirname(probe)
+        if parent == probe:
+            return None
+        probe = parent
+    try:
+        return shutil.disk_usage(probe).free
+    except OSError:
+        return None
+
+
+def _relative(path, root):
+    """path 位于 root 之下时返回相对路径，否则返回 None"""
+    path = os.path.normcase(os.path.abspath(path))
+    root = os.path.normcase(os.path.abspath(root))
+    if path == root:
+        return ''
+    if path.startswith(root.rstrip(os.sep) + os.sep):
+        return path[len(root.rstrip(os.sep)) + 1:]
+    return None
+
+
+class SpillOver:
+    """主备份路径的溢出链：按卷跟踪剩余空间，主备份路径放不下的文件依次写入溢出路径中的相同相对位置
+
+    剩余空间在第一次使用某个卷时查询，之后每放置一个文件扣除其大小；并发复制的线程共享同一份记录
+    """
+    def __init__(self, primary_root, spill_roots, reserve=SPACE_RESERVE):
+        self.logger = logging.getLogger('CamSync')
+        self.roots = [primary_root] + [root for root in spill_roots if not is_object_url(root)]
+        self.reserve = reserve
+        self.full_roots = []       # 已写满的卷（按写满的顺序）
+        self._remaining = {}       # 卷 -> 剩余可用字节数，None 表示不限
+        self._lock = threading.Lock()
+
+    def locate(self, path):
+        """返回 (卷序号, 相对路径)，路径不在溢出链中时返回 None"""
+        for index, root in enumerate(self.roots):
+            rel = _relative(path, root)
+            if rel is not None:
+                return index, rel
+        return None
+
+    def root_of(self, path):
+        located = self.locate(path)
+        return self.roots[located[0]] if located else None
+
+    def alternatives(self, path):
+        """同一文件在溢出链其他卷中的路径，用于查找以前溢出的文件"""
+        located = self.locate(path)
+        if located is None:
+            return []
+        index, rel = located
+        return [os.path.join(root, rel) for i, root in enumerate(self.roots) if i != index]
+
+    def _remaining_space(self, root):
+        if root not in self._remaining:
+            free = free_space(root)
+            self._remaining[root] = None if free is None else max(0, free - self.reserve)
+        return self._remaining[root]
+
+    def available(self, start_index=0):
+        """从指定卷开始的溢出链总可用空间（字节），有不限容量的卷时返回 None"""
+        total = 0
+        with self._lock:
+            for root in self.roots[start_index:]:
+                if root in self.full_roots:
+                    continue
+                remaining = self._remaining_space(root)
+                if remaining is None:
+                    return None
+                total += remaining
+        return total
+
+    def place(self, path, size):
+        """为即将写入的文件选择卷并预留空间，返回实际目标路径
+
+        所有卷都放不下时返回原路径，由写入错误报告失败
+        """
+        located = self.locate(path)
+        if located is None:
+            return path
+        index, rel = located
+        with self._lock:
+            for root in self.roots[index:]:
+                if root in self.full_roots:
+                    continue
+                remaining = self._remaining_space(root)
+                if remaining is None or remaining >= size:
+                    if remaining is not None:
+                        self._remaining[root] = remaining - size
+                    return path if root == self.roots[index] else os.path.join(root, rel)
+                # 放不下这个文件的卷不标记为已满，之后较小的文件仍可写入
+        return path
+
+    def overflow(self, path, size):
+        """写入失败后重新查询卷的可用空间，空间确实不足时标记该卷已满并返回下一个卷中的路径，否则返回 None"""
+        located = self.locate(path)
+        if located is None:
+            return None
+        root = self.roots[located[0]]
+        free = free_space(root)
+        if free is None or free - self.reserve >= size:
+            return None
+        with self._lock:
+            self._mark_full(root)
+        alternative = self.place(path, size)
+        return alternative if alternative != path else None
+
+    def _mark_full(self, root):
+        if root not in self.full_roots:
+            self.full_roots.append(root)
+            self.logger.warning(f"备份卷空间不足: {root}")
+
+
+def check_capacity(dest_dirs, total_bytes, spill=None, reserve=SPACE_RESERVE):
+    """复制前检查各目标的可用空间（每个文件写入所有目标，各目标都需要 total_bytes）
+
+    主备份路径所在的溢出链按整条链的可用空间计算
+
+    Returns:
+        list: 空间不足的目标 [(目标目录, 所需字节, 可用字节), ...]
+    """
+    shortfalls = []
+    for dest_dir in dest_dirs:
+        located = spill.locate(dest_dir) if spill else None
+        if located is not None:
+            available = spill.available(located[0])
+        else:
+            free = free_space(dest_dir)
+            available = None if free is None else max(0, free - reserve)
+        if available is not None and available < total_bytes:
+            shortfalls.append((dest_dir, total_bytes, available))
+    return shortfalls
@@ -0,0 +1,560 @@
+import io
+import os
+import sys
+import stat
+import time
+import struct
+import calendar
+import threading
+from array import array
+from bisect import bisect_right
+
+# 存储卡镜像路径格式：<镜像文件路径>::<镜像内路径>，例如 D:\images\card.img::\DCIM\100CANON\IMG_0001.JPG
+# 镜像文件（dd 得到的整卡或单分区镜像）在用户态直接解析 FAT12/16/32 和 exFAT，无需挂载；
+# 文件数据按簇链合并为连续区段批量读取
+IMAGE_PATH_SEPARATOR = '::'
+
+FS_FAT12 = 'FAT12'
+FS_FAT16 = 'FAT16'
+FS_FAT32 = 'FAT32'
+FS_EXFAT = 'exFAT'
+
+# FAT 目录项属性
+ATTR_READ_ONLY = 0x01
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LONG_NAME = 0x0F
+
+# exFAT 目录项类型
+EXFAT_FILE = 0x85
+EXFAT_STREAM = 0xC0
+EXFAT_NAME = 0xC1
+
+
+class CardImageError(OSError):
+    """镜像格式无法识别或结构损坏，继承 OSError，扫描和复制流程按普通读取错误处理"""
+
+
+def is_image_path(path):
+    """判断路径是否指向存储卡镜像内部"""
+    return isinstance(path, str) and IMAGE_PATH_SEPARATOR in path
+
+
+def image_root(image_path):
+    """获取镜像根目录的路径，可以像设备根目录一样用 os.path.join 拼接"""
+    return os.path.abspath(image_path) + IMAGE_PATH_SEPARATOR
+
+
+def split_image_path(path):
+    """拆分为 (镜像文件路径, 镜像内路径（以 / 分隔，根目录为 ''）)"""
+    image_path, _, inner = path.partition(IMAGE_PATH_SEPARATOR)
+    return image_path, '/'.join(part for part in inner.replace('\\', '/').split('/') if part and part != '.')
+
+
+def _fat_timestamp(date, time_value, centiseconds=0):
+    """FAT/exFAT 本地时间转换为时间戳，无效日期返回 0"""
+    year = 1980 + (date >> 9)
+    month = (date >> 5) & 0x0F
+    day = date & 0x1F
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return 0.0
+    fields = (year, month, day, time_value >> 11, (time_value >> 5) & 0x3F, (time_value & 0x1F) * 2)
+    try:
+        return time.mktime(fields + (0, 0, -1)) + centiseconds / 100.0
+    except (OverflowError, ValueError):
+        return 0.0
+
+
+def _exfat_timestamp(value, centiseconds, utc_offset):
+    date, time_value = value >> 16, value & 0xFFFF
+    if not utc_offset & 0x80:
+        return _fat_timestamp(date, time_value, centiseconds)
+    # 记录了时区偏移（15 分钟为单位，7 位有符号数）时按 UTC 换算
+    year = 1980 + (date >> 9)
+    month = (date >> 5) & 0x0F
+    day = date & 0x1F
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return 0.0
+    offset = utc_offset & 0x7F
+    if offset & 0x40:
+        offset -= 0x80
+    fields = (year, month, day, time_value >> 11, (time_value >> 5) & 0x3F, (time_value & 0x1F) * 2)
+    return calendar.timegm(fields + (0, 0, 0)) - offset * 15 * 60 + centiseconds / 100.0
+
+
+class ImageEntry:
+    """镜像中的文件或目录，接口与 os.DirEntry 一致"""
+    __slots__ = ('name', 'path', 'size', 'mtime', 'attributes', 'first_cluster', 'contiguous', 'valid_size')
+
+    def __init__(self, name, path, size, mtime, attributes, first_cluster, contiguous=False, valid_size=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.attributes = attributes
+        self.first_cluster = first_cluster
+        self.contiguous = contiguous    # exFAT 连续存放、不使用 FAT 链的文件
+        self.valid_size = size if valid_size is None else valid_size
+
+    def is_dir(self, follow_symlinks=True):
+        return bool(self.attributes & ATTR_DIRECTORY)
+
+    def is_file(self, follow_symlinks=True):
+        return not self.is_dir()
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        if self.is_dir():
+            mode = stat.S_IFDIR | 0o755
+        else:
+            mode = stat.S_IFREG | (0o444 if self.attributes & ATTR_READ_ONLY else 0o644)
+        mtime_ns = int(self.mtime * 1000000000)
+        return os.stat_result((mode, 0, 0, 1, 0, 0, self.size, int(self.mtime), int(self.mtime), int(self.mtime),
+                               self.mtime, self.mtime, self.mtime, mtime_ns, mtime_ns, mtime_ns))
+
+
+class CardImage:
+    """FAT12/16/32 和 exFAT 镜像的只读解析器，多个线程可以同时读取"""
+    def __init__(self, image_path):
+        self.image_path = os.path.abspath(image_path)
+        self._fd = os.open(self.image_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        self._read_lock = threading.Lock()  # 没有 os.pread 的平台上保护文件位置
+        self._dir_lock = threading.Lock()
+        self._dirs = {}  # 镜像内目录路径 -> {名称: ImageEntry}
+        try:
+            self._volume_offset = self._find_volume()
+            self._parse_boot_sector(self._pread(self._volume_offset, 512))
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def close(self):
+        os.close(self._fd)
+
+    def _pread(self, offset, size):
+        if hasattr(os, 'pread'):
+            data = os.pread(self._fd, size, offset)
+        else:
+            with self._read_lock:
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                data = os.read(self._fd, size)
+        if len(data) < size:
+            raise CardImageError(f"镜像数据不完整: {self.image_path}（偏移 {offset}）")
+        return data
+
+    def _find_volume(self):
+        """整卡镜像先读取 MBR 分区表，返回文件系统所在的字节偏移"""
+        sector = self._pread(0, 512)
+        if self._looks_like_boot_sector(sector):
+            return 0
+        if sector[510:512] != b'\x55\xaa':
+            raise CardImageError(f"无法识别的镜像格式: {self.image_path}")
+        for index in range(4):
+            entry = sector[446 + index * 16:462 + index * 16]
+            partition_type = entry[4]
+            start = struct.unpack_from('<I', entry, 8)[0]
+            if partition_type == 0xEE:
+                raise CardImageError(f"不支持 GPT 分区的镜像: {self.image_path}")
+            if partition_type and start:
+                return start * 512
+        raise CardImageError(f"镜像中没有分区: {self.image_path}")
+
+    @staticmethod
+    def _looks_like_boot_sector(sector):
+        if sector[3:11] == b'EXFAT   ':
+            return True
+        bytes_per_sector = struct.unpack_from('<H', sector, 11)[0]
+        return (sector[0] in (0xEB, 0xE9) and bytes_per_sector in (512, 1024, 2048, 4096)
+                and sector[13] and not sector[13] & (sector[13] - 1))
+
+    def _parse_boot_sector(self, sector):
+        if sector[3:11] == b'EXFAT   ':
+            self.fs_type = FS_EXFAT
+            self.bytes_per_sector = 1 << sector[108]
+            self.cluster_size = self.bytes_per_sector << sector[109]
+            fat_offset, fat_length, heap_offset, self.cluster_count, self.root_cluster, serial = \
+                struct.unpack_from('<IIIIII', sector, 80)
+            self._heap_offset = self._volume_offset + heap_offset * self.bytes_per_sector
+            self.volume_serial = serial
+            fat_bytes = (self.cluster_count + 2) * 4
+            self._fat = array('I', self._pread(self._volume_offset + fat_offset * self.bytes_per_sector, fat_bytes))
+            self._end_of_chain = 0xFFFFFFF8
+            return
+
+        bytes_per_sector, sectors_per_cluster, reserved, fat_count, root_entries, total16, _, fat_size16 = \
+            struct.unpack_from('<HBHBHHBH', sector, 11)
+        total_sectors = total16 or struct.unpack_from('<I', sector, 32)[0]
+        fat_size = fat_size16 or struct.unpack_from('<I', sector, 36)[0]
+        if not bytes_per_sector or not sectors_per_cluster or not fat_size:
+            raise CardImageError(f"引导扇区损坏: {self.image_path}")
+        root_dir_sectors = (root_entries * 32 + bytes_per_sector - 1) // bytes_per_sector
+        first_data_sector = reserved + fat_count * fat_size + root_dir_sectors
+        self.cluster_count = (total_sectors - first_data_sector) // sectors_per_cluster
+        self.bytes_per_sector = bytes_per_sector
+        self.cluster_size = bytes_per_sector * sectors_per_cluster
+        self._heap_offset = self._volume_offset + first_data_sector * bytes_per_sector
+        fat_offset = self._volume_offset + reserved * bytes_per_sector
+        if self.cluster_count < 4085:
+            self.fs_type = FS_FAT12
+        elif self.cluster_count < 65525:
+            self.fs_type = FS_FAT16
+        else:
+            self.fs_type = FS_FAT32
+        fat_data = self._pread(fat_offset, fat_size * bytes_per_sector)
+        if self.fs_type == FS_FAT32:
+            self._fat = array('I', fat_data[:(self.cluster_count + 2) * 4])
+            self._end_of_chain = 0x0FFFFFF8
+            self.root_cluster = struct.unpack_from('<I', sector, 44)[0]
+            self.volume_serial = struct.unpack_from('<I', sector, 67)[0]
+            self._root_region = None
+        else:
+            if self.fs_type == FS_FAT16:
+                self._fat = array('H', fat_data[:(self.cluster_count + 2) * 2])
+                self._end_of_chain = 0xFFF8
+            else:
+                # FAT12 每个表项 12 位，展开为数组便于统一处理
+                self._fat = array('H', (self._fat12_entry(fat_data, n) for n in range(self.cluster_count + 2)))
+                self._end_of_chain = 0xFF8
+            self.root_cluster = 0
+            self.volume_serial = struct.unpack_from('<I', sector, 39)[0]
+            # FAT12/16 的根目录位于数据区之前的固定区域
+            self._root_region = (fat_offset + fat_count * fat_size * bytes_per_sector, root_dir_sectors * bytes_per_sector)
+        if sys.byteorder == 'big':
+            self._fat.byteswap()
+
+    @staticmethod
+    def _fat12_entry(fat_data, cluster):
+        offset = cluster + cluster // 2
+        value = fat_data[offset] | (fat_data[offset + 1] << 8) if offset + 1 < len(fat_data) else 0
+        return value >> 4 if cluster & 1 else value & 0x0FFF
+
+    @property
+    def volume_id(self):
+        """卷标识，与 DeviceMonitor.get_volume_id 格式一致，加前缀与插入的设备区分"""
+        return f"IMG-{self.volume_serial & 0xFFFFFFFF:08X}"
+
+    def _cluster_offset(self, cluster):
+        return self._heap_offset + (cluster - 2) * self.cluster_size
+
+    def cluster_runs(self, first_cluster, size=None, contiguous=False):
+        """将簇链合并为连续区段 [(字节偏移, 长度), ...]
+
+        Args:
+            size: 文件大小，用于计算连续存放文件的簇数并截去最后一簇多余的部分
+        """
+        if first_cluster < 2:
+            return []
+        if contiguous:
+            return [(self._cluster_offset(first_cluster), size)] if size else []
+        runs = []
+        cluster = first_cluster
+        visited = 0
+        run_start = cluster
+        run_length = 0
+        fat = self._fat
+        while 2 <= cluster < len(fat):
+            visited += 1
+            if visited > self.cluster_count:
+                raise CardImageError(f"簇链成环: {self.image_path}（起始簇 {first_cluster}）")
+            if cluster != run_start + run_length:
+                runs.append((self._cluster_offset(run_start), run_length * self.cluster_size))
+                run_start = cluster
+                run_length = 0
+            run_length += 1
+            next_cluster = fat[cluster]
+            if next_cluster >= self._end_of_chain or next_cluster < 2:
+                break
+            cluster = next_cluster
+        if run_length:
+            runs.append((self._cluster_offset(run_start), run_length * self.cluster_size))
+        if size is not None:
+            # 截去最后一簇中超出文件大小的部分
+            trimmed = []
+            remaining = size
+            for offset, length in runs:
+                if remaining <= 0:
+                    break
+                trimmed.append((offset, min(length, remaining)))
+                remaining -= length
+            runs = trimmed
+        return runs
+
+    def _read_runs(self, runs):
+        return b''.join(self._pread(offset, length) for offset, length in runs)
+
+    def listdir(self, inner_path):
+        """列出镜像内目录，返回 {名称: ImageEntry}"""
+        with self._dir_lock:
+            entries = self._dirs.get(inner_path)
+        if entries is not None:
+            return entries
+        if inner_path:
+            parent, _, name = inner_path.rpartition('/')
+            entry = self._find(parent, name)
+            if entry is None or not entry.is_dir():
+                raise FileNotFoundError(f"镜像中不存在目录: {inner_path}")
+            data = self._read_runs(self.cluster_runs(entry.first_cluster, entry.size if entry.contiguous else None,
+                                                     entry.contiguous))
+        elif self.fs_type in (FS_FAT12, FS_FAT16):
+            data = self._pread(*self._root_region)
+        else:
+            data = self._read_runs(self.cluster_runs(self.root_cluster))
+        if self.fs_type == FS_EXFAT:
+            entries = self._parse_exfat_dir(data, inner_path)
+        else:
+            entries = self._parse_fat_dir(data, inner_path)
+        with self._dir_lock:
+            self._dirs[inner_path] = entries
+        return entries
+
+    def _find(self, parent, name):
+        entries = self.listdir(parent)
+        entry = entries.get(name)
+        if entry is None:
+            # FAT 文件名不区分大小写
+            lowered = name.lower()
+            entry = next((entry for key, entry in entries.items() if key.lower() == lowered), None)
+        return entry
+
+    def lookup(self, inner_path):
+        """查找镜像内的文件或目录，根目录返回 None"""
+        if not inner_path:
+            return None
+        parent, _, name = inner_path.rpartition('/')
+        entry = self._find(parent, name)
+        if entry is None:
+            raise FileNotFoundError(f"镜像中不存在: {inner_path}")
+        return entry
+
+    def _entry_path(self, inner_path, name):
+        return self.image_path + IMAGE_PATH_SEPARATOR + os.sep + (inner_path + '/' + name if inner_path else name).replace('/', os.sep)
+
+    def _parse_fat_dir(self, data, inner_path):
+        entries = {}
+        long_name_parts = []
+        long_name_checksum = None
+        for pos in range(0, len(data) - 31, 32):
+            record = data[pos:pos + 32]
+            first = record[0]
+            if first == 0x00:
+                break
+            if first == 0xE5:
+                long_name_parts = []
+                continue
+            attributes = record[11]
+            if attributes & 0x3F == ATTR_LONG_NAME:
+                if first & 0x40:
+                    long_name_parts = []
+                    long_name_checksum = record[13]
+                long_name_parts.append(record[1:11] + record[14:26] + record[28:32])
+                continue
+            if attributes & ATTR_VOLUME_ID:
+                long_name_parts = []
+                continue
+            short_name = record[0:11]
+            name = None
+            if long_name_parts and long_name_checksum == self._short_name_checksum(short_name):
+                raw = b''.join(reversed(long_name_parts))
+                name = raw.decode('utf-16-le', 'replace').split('\x00', 1)[0].rstrip('\uffff')
+            long_name_parts = []
+            if not name:
+                name = self._short_name(short_name, record[12])
+            if name in ('.', '..'):
+                continue
+            cluster = (struct.unpack_from('<H', record, 20)[0] << 16) | struct.unpack_from('<H', record, 26)[0]
+            if self.fs_type != FS_FAT32:
+                cluster &= 0xFFFF
+            size = struct.unpack_from('<I', record, 28)[0]
+            mtime = _fat_timestamp(struct.unpack_from('<H', record, 24)[0], struct.unpack_from('<H', record, 22)[0])
+            entries[name] = ImageEntry(name, self._entry_path(inner_path, name), 0 if attributes & ATTR_DIRECTORY else size,
+                                       mtime, attributes, cluster)
+        return entries
+
+    @staticmethod
+    def _short_name_checksum(short_name):
+        checksum = 0
+        for byte in short_name:
+            checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+        return checksum
+
+    @staticmethod
+    def _short_name(short_name, case_flags):
+        raw = bytearray(short_name)
+        if raw[0] == 0x05:
+            raw[0] = 0xE5
+        base = bytes(raw[:8]).decode('cp437').rstrip(' ')
+        ext = bytes(raw[8:11]).decode('cp437').rstrip(' ')
+        # Windows NT 用保留字节标记全小写的主名和扩展名
+        if case_flags & 0x08:
+            base = base.lower()
+        if case_flags & 0x10:
+            ext = ext.lower()
+        return base + '.' + ext if ext else base
+
+    def _parse_exfat_dir(self, data, inner_path):
+        entries = {}
+        pos = 0
+        while pos + 32 <= len(data):
+            entry_type = data[pos]
+            if entry_type == 0x00:
+                break
+            if entry_type != EXFAT_FILE:
+                pos += 32
+                continue
+            secondary_count = data[pos + 1]
+            end = pos + 32 * (secondary_count + 1)
+            if secondary_count < 2 or end > len(data) or data[pos + 32] != EXFAT_STREAM:
+                pos += 32
+                continue
+            attributes = struct.unpack_from('<H', data, pos + 4)[0]
+            modified = struct.unpack_from('<I', data, pos + 12)[0]
+            mtime = _exfat_timestamp(modified, data[pos + 21], data[pos + 23])
+            stream = pos + 32
+            flags = data[stream + 1]
+            name_length = data[stream + 3]
+            valid_size = struct.unpack_from('<Q', data, stream + 8)[0]
+            first_cluster = struct.unpack_from('<I', data, stream + 20)[0]
+            size = struct.unpack_from('<Q', data, stream + 24)[0]
+            name_parts = []
+            for name_pos in range(stream + 32, end, 32):
+                if data[name_pos] == EXFAT_NAME:
+                    name_parts.append(data[name_pos + 2:name_pos + 32])
+            name = b''.join(name_parts).decode('utf-16-le', 'replace')[:name_length]
+            pos = end
+            if not name:
+                continue
+            # 目录的大小用于读取连续存放的目录内容
+            entries[name] = ImageEntry(name, self._entry_path(inner_path, name), size, mtime, attributes,
+                                       first_cluster, bool(flags & 0x02), valid_size)
+        return entries
+
+    def scandir(self, inner_path):
+        return list(self.listdir(inner_path).values())
+
+    def stat(self, inner_path):
+        entry = self.lookup(inner_path)
+        if entry is None:
+            return os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+        return entry.stat()
+
+    def open(self, inner_path):
+        entry = self.lookup(inner_path)
+        if entry is None or entry.is_dir():
+            raise IsADirectoryError(f"镜像中的目录无法作为文件读取: {inner_path}")
+        return CardImageFile(self, entry)
+
+
+class CardImageFile(io.RawIOBase):
+    """镜像中的文件，按连续区段批量读取，接口与以 buffering=0 打开的文件一致"""
+    def __init__(self, image, entry):
+        super().__init__()
+        self.name = entry.path
+        self._image = image
+        self._size = entry.size
+        valid_size = min(entry.valid_size, entry.size)
+        self._runs = image.cluster_runs(entry.first_cluster, valid_size, entry.contiguous)
+        self._run_starts = []  # 各区段在文件内的起始位置
+        position = 0
+        for _, length in self._runs:
+            self._run_starts.append(position)
+            position += length
+        self._valid_size = position
+        if self._valid_size < valid_size:
+            raise CardImageError(f"簇链比文件短，文件已损坏: {entry.path}")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError(f"无效的文件位置: {offset}")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        total = 0
+        run_index = bisect_right(self._run_starts, self._position) - 1
+        while total < len(view) and self._position < self._size:
+            if self._position >= self._valid_size:
+                # exFAT 有效数据长度之后的部分读作 0
+                n = min(len(view) - total, self._size - self._position)
+                view[total:total + n] = bytes(n)
+            else:
+                offset, length = self._runs[run_index]
+                within = self._position - self._run_starts[run_index]
+                n = min(len(view) - total, length - within)
+                view[total:total + n] = self._image._pread(offset + within, n)
+                run_index += 1
+            self._position += n
+            total += n
+        return total
+
+
+class CardImages:
+    """已打开的存储卡镜像，每个镜像文件只解析一次"""
+    def __init__(self):
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def get(self, image_path):
+        image_path = os.path.abspath(image_path)
+        with self._lock:
+            image = self._images.get(image_path)
+            if image is None:
+                image = CardImage(image_path)
+                self._images[image_path] = image
+            return image
+
+    def close(self, image_path):
+        with self._lock:
+            image = self._images.pop(os.path.abspath(image_path), None)
+        if image is not None:
+            image.close()
+
+
+# 全局存储卡镜像实例
+card_images = CardImages()
+
+
+def source_stat(path):
+    """获取源文件信息，镜像内路径从镜像的目录项中读取"""
+    if is_image_path(path):
+        image_path, inner_path = split_image_path(path)
+        return card_images.get(image_path).stat(inner_path)
+    return os.stat(path)
+
+
+def source_scandir(path):
+    """列出源目录，返回 os.DirEntry（或接口一致的 ImageEntry）列表"""
+    if is_image_path(path):
+        image_path, inner_path = split_image_path(path)
+        return card_images.get(image_path).scandir(inner_path)
+    with os.scandir(path) as it:
+        return list(it)
+
+
+def open_source(path, opener=None, buffering=0):
+    """打开源文件用于读取，默认不使用缓冲；镜像内的文件返回 CardImageFile
+
+    Args:
+        buffering: 与 open 相同，非 0 时返回带缓冲的文件，适合读取文件头部的多次小读取
+    """
+    if is_image_path(path):
+        image_path, inner_path = split_image_path(path)
+        image_file = card_images.get(image_path).open(inner_path)
+        return io.BufferedReader(image_file) if buffering else image_file
+    return open(path, 'rb', buffering=buffering, opener=opener)
@@ -0,0 +1,150 @@
+import hashlib
+from card_image import open_source
+from object_store import is_object_url
+
+# 判断源文件与目标文件是否相同：大小必须一致，修改时间允许存储卡文件系统造成的差异
+#   - FAT 的修改时间精度为 2 秒，exFAT 为 10 毫秒，不同驱动取整的方向可能不同
+#   - exFAT 的时区字段、相机的时区设置、读卡器驱动和备份文件系统对本地时间的解释不同，
+#     以及夏令时切换前后读取，同一文件的修改时间会相差整 15 分钟的倍数
+# 相差整时区偏移时无法只凭时间区分，读取两边文件的部分内容比较哈希
+
+# 修改时间的容差（秒）
+MTIME_TOLERANCE = 2.0
+# 时区偏移的步长和最大值（UTC-12 到 UTC+14）
+OFFSET_STEP = 15 * 60
+MAX_OFFSET = 26 * 3600
+# 部分内容哈希读取文件开头、中间和结尾各这么多字节
+SAMPLE_SIZE = 64 * 1024
+
+# 判断规则，记录是哪一条规则做出的决定
+RULE_EXACT = 'exact'                  # 修改时间一致
+RULE_GRANULARITY = 'granularity'      # 修改时间相差在文件系统精度内
+RULE_DEST_NEWER = 'dest_newer'        # 目标文件较新（增量备份时跳过）
+RULE_OFFSET_HASH = 'offset_hash'      # 相差整时区偏移，部分内容哈希一致
+RULE_SIZE = 'size'                    # 大小不同
+RULE_MTIME = 'mtime'                  # 修改时间的差异无法用精度或时区解释
+RULE_HASH_MISMATCH = 'hash_mismatch'  # 相差整时区偏移，但部分内容哈希不同
+RULE_UNREADABLE = 'unreadable'        # 相差整时区偏移，但无法读取文件比较内容
+RULE_LEGACY = 'legacy'                # 旧版清单条目没有指纹，仅按路径匹配
+RULE_OFFSET = 'offset'                # 相差整时区偏移，没有备份副本可比较内容（清单匹配）
+
+# 判定为同一文件、但清单中的指纹需要更新为当前修改时间的规则（否则之后每次插入都要重新比较内容）
+REFRESH_RULES = (RULE_OFFSET_HASH, RULE_OFFSET)
+
+RULE_NAMES = {
+    RULE_EXACT: '修改时间一致',
+    RULE_GRANULARITY: '时间精度内',
+    RULE_DEST_NEWER: '目标较新',
+    RULE_OFFSET_HASH: '时区偏移（内容一致）',
+    RULE_SIZE: '大小不同',
+    RULE_MTIME: '修改时间不同',
+    RULE_HASH_MISMATCH: '时区偏移（内容不同）',
+    RULE_UNREADABLE: '时区偏移（无法读取）',
+    RULE_LEGACY: '旧版清单（仅路径）',
+    RULE_OFFSET: '时区偏移（无副本）'
+}
+
+
+def is_zone_offset(diff):
+    """修改时间的差值（秒）是否为整 15 分钟倍数的时区/夏令时偏移（允许文件系统精度内的误差）"""
+    diff = abs(diff)
+    if diff < OFFSET_STEP - MTIME_TOLERANCE or diff > MAX_OFFSET + MTIME_TOLERANCE:
+        return False
+    remainder = diff % OFFSET_STEP
+    return min(remainder, OFFSET_STEP - remainder) <= MTIME_TOLERANCE
+
+
+def sampled_hash(file, size):
+    """文件开头、中间和结尾各 SAMPLE_SIZE 字节及文件大小的哈希，小文件读取全部内容"""
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    if size <= SAMPLE_SIZE * 3:
+        digest.update(file.read())
+        return digest.digest()
+    for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+        file.seek(offset)
+        digest.update(file.read(SAMPLE_SIZE))
+    return digest.digest()
+
+
+def _contents_match(src_path, dest_path, size):
+    """比较两个文件的部分内容哈希，无法读取时返回 None"""
+    if is_object_url(dest_path):
+        # 对象存储上的文件需要下载，不比较内容
+        return None
+    try:
+        with open_source(src_path, buffering=-1) as src_file:
+            src_hash = sampled_hash(src_file, size)
+        with open(dest_path, 'rb') as dest_file:
+            dest_hash = sampled_hash(dest_file, size)
+    except OSError:
+        return None
+    return src_hash == dest_hash
+
+
+def _size_mtime(stat_value):
+    if hasattr(stat_value, 'st_size'):
+        return stat_value.st_size, stat_value.st_mtime
+    return stat_value
+
+
+def compare_files(src_path, src_stat, dest_path, dest_stat, dest_newer_ok=False):
+    """判断源文件与目标文件是否相同
+
+    Args:
+        src_stat, dest_stat: (大小, 修改时间) 或 os.stat_result
+        dest_newer_ok: 为 True 时目标文件较新也视为相同（增量备份）
+
+    Returns:
+        tuple: (是否相同, 判断规则)
+    """
+    src_size, src_mtime = _size_mtime(src_stat)
+    dest_size, dest_mtime = _size_mtime(dest_stat)
+    if src_size != dest_size:
+        return False, RULE_SIZE
+    diff = src_mtime - dest_mtime
+    if diff == 0:
+        return True, RULE_EXACT
+    if abs(diff) <= MTIME_TOLERANCE:
+        return True, RULE_GRANULARITY
+    if dest_newer_ok and diff < 0:
+        return True, RULE_DEST_NEWER
+    if is_zone_offset(diff):
+        # 只凭时间无法区分时区偏移和内容被修改，比较部分内容
+        match = _contents_match(src_path, dest_path, src_size)
+        if match is None:
+            return False, RULE_UNREADABLE
+        return match, RULE_OFFSET_HASH if match else RULE_HASH_MISMATCH
+    return False, RULE_MTIME
+
+
+def match_fingerprint(src_path, src_stat, fingerprint, copy_path=None):
+    """判断存储卡上的文件是否为文件清单中记录的文件
+
+    清单指纹为 [大小, 修改时间（整数秒）]。Windows 按本地时间显示 FAT 的时间戳，夏令时切换后同一张卡上
+    所有文件的修改时间都会整体偏移，因此时间的比较与 compare_files 相同；相差整时区偏移时与备份副本
+    比较部分内容，没有可读取的副本（用户未选择复制的文件、按日期整理的目标、对象存储）时按偏移接受
+
+    Args:
+        src_stat: (大小, 修改时间) 或 os.stat_result
+        copy_path: 该文件的备份副本路径，可为 None
+
+    Returns:
+        tuple: (是否为已知文件, 判断规则)
+    """
+    if fingerprint is None:
+        return True, RULE_LEGACY
+    size, mtime = fingerprint
+    src_size, src_mtime = _size_mtime(src_stat)
+    if src_size != size:
+        return False, RULE_SIZE
+    diff = int(src_mtime) - mtime
+    if diff == 0:
+        return True, RULE_EXACT
+    if abs(diff) <= MTIME_TOLERANCE:
+        return True, RULE_GRANULARITY
+    if is_zone_offset(diff):
+        match = _contents_match(src_path, copy_path, src_size) if copy_path else None
+        if match is None:
+            return True, RULE_OFFSET
+        return match, RULE_OFFSET_HASH if match else RULE_HASH_MISMATCH
+    return False, RULE_MTIME
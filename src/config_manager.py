@@ -1,8 +1,15 @@
 import os
 import json
+import time
 import logging
 import winreg
 from datetime import datetime
+from manifest import (migrate_file_list, encode_manifests, decode_manifests,
+                      MANIFEST_LISTS, CODEC_ZLIB, CODEC_ZSTD)
+from object_store import is_object_url
+from io_trace import io_trace
+from card_image import is_image_path, split_image_path, card_images
+from capacity import SpillOver
 
 class ConfigManager:
     def __init__(self):
@@ -15,16 +22,44 @@ class ConfigManager:
         # 默认配置
         self.default_config = {
             'backup_path': os.path.join(os.path.expanduser('~'), 'Pictures', 'CamSync'),
-            'auto_start': False
+            'auto_start': False,
+            'extra_backup_paths': [],         # 附加备份路径，每个文件读取一次同时写入所有备份路径
+            'spillover_paths': [],            # 溢出备份路径，主备份路径所在卷空间不足时依次写入
+            'preallocate': True,              # 按源文件大小预分配目标文件空间
+            'durability_mode': 'batch',       # 持久化模式：none（不同步）/ file（逐文件同步）/ batch（批量同步）
+            'sync_batch_mb': 256,             # 批量同步模式下每写入多少 MB 同步一次
+            'large_file_mode': 'nocache',     # 大文件复制模式：buffered（普通）/ nocache（及时释放页面缓存）/ direct（O_DIRECT）
+            'large_file_threshold_mb': 256,   # 超过此大小的文件按大文件模式复制
+            'manifest_format': 'json',        # U盘文件清单格式：json（可读）/ compact（紧凑二进制）
+            'manifest_compression': 'zlib',   # 紧凑格式的压缩算法：zlib / zstd（需安装 zstandard）
+            'background_mode': True,          # 最小化到托盘时降低优先级，并按系统负载调整复制并发数和带宽
+            'io_trace_dir': '',               # 设置后将每次运行的 I/O 轨迹（路径已匿名）记录到此目录，用于回放分析
+            'object_store': {                 # s3:// 备份路径使用的 S3 兼容对象存储
+                'endpoint': '',
+                'access_key': '',
+                'secret_key': '',
+                'region': 'us-east-1',
+                'part_size_mb': 8,            # 分块上传的块大小
+                'max_parallel_parts': 4       # 每个文件同时上传的块数
+            }
         }
         # 加载主配置
         self.main_config = self.load_main_config()
         # 确保备份路径存在
-        os.makedirs(self.main_config['backup_path'], exist_ok=True)
+        if not is_object_url(self.main_config['backup_path']):
+            os.makedirs(self.main_config['backup_path'], exist_ok=True)
         # 日志记录器
         self.logger = logging.getLogger('CamSync')
         # U盘配置文件名
         self.USB_CONFIG_FILENAME = 'CamSyncConfig.json'
+        # U盘紧凑清单文件名
+        self.USB_MANIFEST_FILENAME = 'CamSyncManifest.bin'
+        # 导入会话缓存：设备路径 -> {'data': U盘配置数据, 'dirty': 是否有未写回的修改}
+        self._session_cache = {}
+        # 配置了轨迹目录时记录本次运行的 I/O 轨迹
+        trace_dir = self.main_config.get('io_trace_dir')
+        if trace_dir:
+            io_trace.start(os.path.join(trace_dir, f"camsync-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"))
     
     def load_main_config(self):
         """加载主配置文件"""
@@ -58,11 +93,74 @@ class ConfigManager:
     def set_backup_path(self, path):
         """设置备份路径"""
         self.main_config['backup_path'] = path
-        # 确保新的备份路径存在
-        os.makedirs(path, exist_ok=True)
+        # 确保新的备份路径存在（对象存储路径无需创建）
+        if not is_object_url(path):
+            os.makedirs(path, exist_ok=True)
         self.save_main_config()
         self.logger.info(f"备份路径已设置为: {path}")
     
+    def get_backup_paths(self, folder_config=None):
+        """获取所有备份路径，第一个为主备份路径
+        
+        文件夹配置中指定了 backup_paths 时以文件夹配置为准
+        """
+        if folder_config and folder_config.get('backup_paths'):
+            return list(folder_config['backup_paths'])
+        return [self.main_config['backup_path']] + list(self.main_config.get('extra_backup_paths', []))
+    
+    def get_extra_backup_paths(self):
+        """获取附加备份路径"""
+        return list(self.main_config.get('extra_backup_paths', []))
+    
+    def set_extra_backup_paths(self, paths):
+        """设置附加备份路径"""
+        for path in paths:
+            if not is_object_url(path):
+                os.makedirs(path, exist_ok=True)
+        self.main_config['extra_backup_paths'] = list(paths)
+        self.save_main_config()
+        self.logger.info(f"附加备份路径已设置为: {', '.join(paths) if paths else '无'}")
+    
+    def get_spillover_paths(self):
+        """获取溢出备份路径"""
+        return list(self.main_config.get('spillover_paths', []))
+    
+    def set_spillover_paths(self, paths):
+        """设置溢出备份路径（对象存储不限容量，不能作为溢出路径）"""
+        paths = [path for path in paths if not is_object_url(path)]
+        for path in paths:
+            os.makedirs(path, exist_ok=True)
+        self.main_config['spillover_paths'] = paths
+        self.save_main_config()
+        self.logger.info(f"溢出备份路径已设置为: {', '.join(paths) if paths else '无'}")
+    
+    def get_spill_over(self):
+        """获取主备份路径的溢出链，没有配置溢出路径时返回 None"""
+        paths = self.get_spillover_paths()
+        if not paths or is_object_url(self.main_config['backup_path']):
+            return None
+        return SpillOver(self.main_config['backup_path'], paths)
+    
+    def get_write_options(self):
+        """获取目标写入选项（预分配、持久化模式和大文件复制模式）"""
+        return {
+            'preallocate': self.main_config.get('preallocate', True),
+            'durability_mode': self.main_config.get('durability_mode', 'batch'),
+            'sync_batch_mb': self.main_config.get('sync_batch_mb', 256),
+            'large_file_mode': self.main_config.get('large_file_mode', 'nocache'),
+            'large_file_threshold_mb': self.main_config.get('large_file_threshold_mb', 256)
+        }
+    
+    def get_object_store_options(self):
+        """获取对象存储连接选项"""
+        return dict(self.main_config.get('object_store') or {})
+    
+    def set_object_store_options(self, options):
+        """设置对象存储连接选项"""
+        self.main_config['object_store'] = dict(options)
+        self.save_main_config()
+        self.logger.info(f"对象存储地址已设置为: {options.get('endpoint', '')}")
+    
     def get_auto_start(self):
         """获取开机自启动状态"""
         return self.main_config['auto_start']
@@ -101,46 +199,198 @@ class ConfigManager:
         except Exception as e:
             self.logger.error(f"更新开机自启动设置时发生错误: {str(e)}")
     
+    def get_io_profile(self, volume_id):
+        """获取指定卷记忆的 I/O 配置"""
+        return self.main_config.get('io_profiles', {}).get(volume_id)
+    
+    def set_io_profile(self, volume_id, profile):
+        """记忆指定卷的 I/O 配置"""
+        self.main_config.setdefault('io_profiles', {})[volume_id] = profile
+        self.save_main_config()
+        self.logger.info(f"已记忆卷 {volume_id} 的 I/O 配置")
+    
     def get_folder_config_path(self, device_path, folder_name):
         """获取文件夹配置文件路径"""
         # 配置文件保存在U盘根目录
-        return os.path.join(device_path, self.USB_CONFIG_FILENAME)
+        return os.path.join(self._usb_config_dir(device_path), self.USB_CONFIG_FILENAME)
     
-    def get_folder_config(self, device_path, folder_name):
-        """获取文件夹配置"""
-        config_path = self.get_folder_config_path(device_path, folder_name)
+    def _usb_config_dir(self, device_path):
+        """U盘配置所在的目录：设备根目录；存储卡镜像是只读的，配置按卷标识保存在本地配置目录中，
+        同一张卡的多次镜像共用一份文件清单"""
+        if not is_image_path(device_path):
+            return device_path
+        image_path, _ = split_image_path(device_path)
+        return os.path.join(self.local_config_dir, 'images', card_images.get(image_path).volume_id)
+    
+    def _load_usb_config(self, device_path):
+        """读取U盘配置，紧凑清单文件存在时合并其中的文件清单"""
+        started = time.perf_counter()
+        config_data = {}
+        config_dir = self._usb_config_dir(device_path)
+        config_path = os.path.join(config_dir, self.USB_CONFIG_FILENAME)
         if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
+        folders = config_data.setdefault('folders', {})
+        
+        # 旧版配置中的绝对路径列表迁移为相对路径清单
+        for folder_name, config in folders.items():
+            for key in MANIFEST_LISTS:
+                config[key] = migrate_file_list(config.get(key), folder_name)
+        
+        manifest_path = os.path.join(config_dir, self.USB_MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'rb') as f:
+                manifests = decode_manifests(f.read())
+            # 与 JSON 中的清单取并集，兼容旧版程序在紧凑模式下写回的 JSON 清单
+            for folder_name, lists in manifests.items():
+                if folder_name in folders:
+                    for key in MANIFEST_LISTS:
+                        folders[folder_name][key].update(lists.get(key, {}))
+        if io_trace.active:
+            io_trace.config_io('config_read', config_path, self._usb_config_size(device_path),
+                               time.perf_counter() - started)
+        return config_data
+    
+    def _write_usb_config(self, device_path, config_data):
+        """写入U盘配置，紧凑模式下文件清单单独写入二进制清单文件"""
+        started = time.perf_counter()
+        config_dir = self._usb_config_dir(device_path)
+        if config_dir != device_path:
+            os.makedirs(config_dir, exist_ok=True)
+        config_path = os.path.join(config_dir, self.USB_CONFIG_FILENAME)
+        manifest_path = os.path.join(config_dir, self.USB_MANIFEST_FILENAME)
+        
+        if self.main_config.get('manifest_format') == 'compact':
+            manifests = {}
+            settings = {key: value for key, value in config_data.items() if key != 'folders'}
+            settings['folders'] = {}
+            for folder_name, config in config_data.get('folders', {}).items():
+                manifests[folder_name] = {key: config.get(key, {}) for key in MANIFEST_LISTS}
+                settings['folders'][folder_name] = {key: value for key, value in config.items() if key not in MANIFEST_LISTS}
+            settings['manifest_file'] = self.USB_MANIFEST_FILENAME
+            
+            codec = CODEC_ZSTD if self.main_config.get('manifest_compression') == 'zstd' else CODEC_ZLIB
+            # 先写临时文件再替换，避免写入中途拔卡损坏清单
+            temp_path = manifest_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(encode_manifests(manifests, codec))
+            os.replace(temp_path, manifest_path)
+            
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, ensure_ascii=False, indent=4)
+        else:
+            config_data.pop('manifest_file', None)
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(config_data, f, ensure_ascii=False, indent=4)
+            # 切换回 JSON 格式后删除旧的紧凑清单，避免残留过期数据
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        if io_trace.active:
+            io_trace.config_io('config_write', config_path, self._usb_config_size(device_path),
+                               time.perf_counter() - started)
+    
+    def _usb_config_size(self, device_path):
+        """U盘配置文件和紧凑清单文件的总大小"""
+        size = 0
+        config_dir = self._usb_config_dir(device_path)
+        for name in (self.USB_CONFIG_FILENAME, self.USB_MANIFEST_FILENAME):
+            try:
+                size += os.path.getsize(os.path.join(config_dir, name))
+            except OSError:
+                pass
+        return size
+    
+    def read_usb_config(self, device_path):
+        """读取U盘配置，不使用也不修改会话缓存，可在后台线程中调用"""
+        return self._load_usb_config(device_path)
+    
+    def begin_session(self, device_path, config_data=None):
+        """开始导入会话，会话期间U盘配置只读取一次，修改缓存在内存中
+        
+        Args:
+            config_data: 已在后台线程中读取的U盘配置，为 None 时在此读取
+        """
+        if device_path in self._session_cache:
+            return
+        if config_data is None:
             try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config_data = json.load(f)
-                # 从配置数据中获取指定文件夹的配置
-                if folder_name in config_data.get('folders', {}):
-                    return config_data['folders'][folder_name]
-                return None
+                config_data = self._load_usb_config(device_path)
             except Exception as e:
                 self.logger.error(f"加载U盘配置文件时发生错误: {str(e)}")
+                config_data = {'folders': {}}
+        self._session_cache[device_path] = {'data': config_data, 'dirty': False}
+    
+    def in_session(self, device_path):
+        """设备是否处于导入会话中"""
+        return device_path in self._session_cache
+    
+    def flush_session(self, device_path):
+        """将会话中的修改一次性写回U盘"""
+        session = self._session_cache.get(device_path)
+        if not session or not session['dirty']:
+            return
+        try:
+            self._write_usb_config(device_path, session['data'])
+            session['dirty'] = False
+            self.logger.info(f"U盘配置已写回: {device_path}")
+        except Exception as e:
+            self.logger.error(f"保存U盘配置文件时发生错误: {str(e)}")
+    
+    def end_session(self, device_path):
+        """结束导入会话，写回修改并释放缓存"""
+        self.flush_session(device_path)
+        self._session_cache.pop(device_path, None)
+    
+    def flush_all_sessions(self):
+        """写回所有会话中的修改"""
+        for device_path in list(self._session_cache):
+            self.flush_session(device_path)
+    
+    def discard_session(self, device_path):
+        """丢弃会话缓存（设备已移除，无法再写回）"""
+        session = self._session_cache.pop(device_path, None)
+        if session and session['dirty']:
+            self.logger.warning(f"设备 {device_path} 已移除，未写回的配置修改已丢弃")
+    
+    def _get_usb_config(self, device_path):
+        """获取U盘配置，处于会话中时使用缓存"""
+        session = self._session_cache.get(device_path)
+        if session:
+            return session['data']
+        return self._load_usb_config(device_path)
+    
+    def get_folder_config(self, device_path, folder_name):
+        """获取文件夹配置"""
+        try:
+            config_data = self._get_usb_config(device_path)
+            # 从配置数据中获取指定文件夹的配置
+            if folder_name in config_data['folders']:
+                config = config_data['folders'][folder_name]
+                # 设备路径随挂载位置变化，以当前路径为准
+                config['device_path'] = device_path
+                return config
+        except Exception as e:
+            self.logger.error(f"加载U盘配置文件时发生错误: {str(e)}")
         return None
     
     def save_folder_config(self, device_path, folder_name, config):
         """保存文件夹配置到U盘"""
-        config_path = self.get_folder_config_path(device_path, folder_name)
         try:
             # 读取现有配置或创建新配置
-            config_data = {}
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config_data = json.load(f)
-            
-            # 确保folders字段存在
-            if 'folders' not in config_data:
-                config_data['folders'] = {}
+            config_data = self._get_usb_config(device_path)
             
             # 更新指定文件夹的配置
             config_data['folders'][folder_name] = config
             
+            session = self._session_cache.get(device_path)
+            if session:
+                # 会话中只标记修改，结束会话时统一写回
+                session['dirty'] = True
+                return
+            
             # 保存配置文件
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(config_data, f, ensure_ascii=False, indent=4)
+            self._write_usb_config(device_path, config_data)
             self.logger.info(f"文件夹配置已保存到U盘: {folder_name}")
         except Exception as e:
             self.logger.error(f"保存U盘配置文件时发生错误: {str(e)}")
@@ -153,11 +403,17 @@ class ConfigManager:
             'backup_strategy': 'incremental',  # 默认为增量备份
             'preview_before_copy': True,       # 默认为复制前预览
             'include_subfolders': True,        # 默认为包含子文件夹
+            'backup_paths': [],                # 备份目标，为空时使用主配置中的备份路径
+            'destination_layout': 'mirror',    # 目标目录布局：mirror（与存储卡一致）/ date（按拍摄日期）/ date_camera（按拍摄日期和相机）
+            'missing_destinations': {},        # 未能写入全部目标的文件（相对路径 -> 失败的目标路径）
+            'dir_fingerprints': {},            # 目录指纹，未变化的子目录下次插入时跳过
+            'dir_mtime_reliable': None,        # 存储卡的目录修改时间是否可靠（None 为尚未验证，验证前不跳过目录）
+            'dir_fingerprints_matcher': None,  # 保存目录指纹时匹配设置的摘要，匹配设置改变后指纹作废
             'last_backup_time': None,          # 上次备份时间
             'file_patterns': ['*'],            # 文件匹配模式
             'exclude_patterns': [],            # 排除文件模式
-            'saved_files': [],                 # 已保存的文件列表
-            'unsaved_files': []                # 未保存的文件列表
+            'saved_files': {},                 # 已保存的文件清单（相对路径 -> 指纹）
+            'unsaved_files': {}                # 未保存的文件清单（相对路径 -> 指纹）
         }
         # 保存配置
         self.save_folder_config(device_path, folder_name, config)
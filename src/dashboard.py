@@ -0,0 +1,127 @@
+import json
+import html
+import time
+from collections import deque
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWebEngineWidgets import QWebEngineView
+from load_governor import load_governor
+from throughput_history import format_duration
+
+# 仪表盘刷新间隔（毫秒），采样和渲染都按此固定频率进行，与复制的文件数无关
+DASHBOARD_INTERVAL_MS = 1000
+# 速度曲线保留的采样点数
+HISTORY_POINTS = 60
+# 保留显示的最近任务数
+MAX_JOBS = 8
+SPARKLINE_WIDTH = 180
+SPARKLINE_HEIGHT = 28
+
+
+def _format_rate(bytes_per_second):
+    return f"{bytes_per_second / (1024 * 1024):.1f} MB/s"
+
+
+def _sparkline(values):
+    """速度历史的 SVG 折线"""
+    if len(values) < 2:
+        return ''
+    peak = max(values) or 1.0
+    step = SPARKLINE_WIDTH / (HISTORY_POINTS - 1)
+    offset = (HISTORY_POINTS - len(values)) * step
+    points = ' '.join(f"{offset + i * step:.1f},{SPARKLINE_HEIGHT - 1 - value / peak * (SPARKLINE_HEIGHT - 2):.1f}"
+                      for i, value in enumerate(values))
+    return (f'<svg width="{SPARKLINE_WIDTH}" height="{SPARKLINE_HEIGHT}">'
+            f'<polyline fill="none" stroke="#4ec9b0" stroke-width="1.5" points="{points}"/></svg>')
+
+
+class _JobRow:
+    """仪表盘中一个任务的速度历史"""
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.rates = deque(maxlen=HISTORY_POINTS)
+        self.last_bytes = 0
+        self.last_time = time.monotonic()
+
+    def sample(self):
+        snapshot = self.metrics.snapshot()
+        now = time.monotonic()
+        if snapshot['running']:
+            elapsed = now - self.last_time
+            rate = (snapshot['bytes'] - self.last_bytes) / elapsed if elapsed > 0 else 0.0
+            self.rates.append(rate)
+        self.last_bytes = snapshot['bytes']
+        self.last_time = now
+        return snapshot
+
+
+class DashboardView(QWebEngineView):
+    """实时导入仪表盘：每个复制任务的速度曲线、剩余文件、队列深度、预计剩余时间和错误数
+
+    复制线程只更新 JobMetrics 计数，本视图按 DASHBOARD_INTERVAL_MS 定时读取；
+    页面只加载一次，之后通过脚本替换表格内容，标签页不可见时只采样不渲染
+    """
+    def __init__(self, css, parent=None):
+        super().__init__(parent)
+        self._rows = deque(maxlen=MAX_JOBS)
+        self._loaded = False
+        self.loadFinished.connect(self._on_load_finished)
+        self.setHtml(f"""<!DOCTYPE html><html><head><meta charset="utf-8"><style>
+        body{{{css}}}
+        table{{border-collapse:collapse;width:100%;}} th,td{{padding:4px 8px;text-align:left;border-bottom:1px solid #333;}}
+        th{{color:#569cd6;font-weight:normal;}} .stalled{{color:#f44747;font-weight:bold;}} .done{{color:#6a9955;}}
+        .failed{{color:#f44747;}} .summary{{color:#4ec9b0;margin-bottom:8px;}}
+        </style></head><body><div id='dashboard'>暂无复制任务</div></body></html>""")
+        self._timer = QTimer(self)
+        self._timer.setInterval(DASHBOARD_INTERVAL_MS)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start()
+
+    def _on_load_finished(self, ok):
+        self._loaded = ok
+
+    def add_job(self, metrics):
+        """开始跟踪一个复制任务（由 FileOperations.job_started 信号调用）"""
+        self._rows.append(_JobRow(metrics))
+
+    def refresh(self):
+        if not self._rows:
+            return
+        snapshots = [(row, row.sample()) for row in self._rows]
+        if not self._loaded or not self.isVisible():
+            return
+        self.page().runJavaScript(f"document.getElementById('dashboard').innerHTML = "
+                                  f"{json.dumps(self._render(snapshots))};")
+
+    def _render(self, snapshots):
+        running = [snapshot for _, snapshot in snapshots if snapshot['running']]
+        total_rate = sum(row.rates[-1] for row, snapshot in snapshots if snapshot['running'] and row.rates)
+        summary = f"进行中 {len(running)} 个任务，总速度 {_format_rate(total_rate)}"
+        if load_governor.background:
+            summary += f"，后台模式速度等级 {load_governor.level:.2f}"
+        parts = [f"<div class='summary'>{summary}</div><table><tr><th>任务</th><th>存储卡</th><th>速度</th>"
+                 "<th>速度曲线</th><th>文件</th><th>队列</th><th>已复制</th><th>剩余时间</th><th>错误</th><th>状态</th></tr>"]
+        for row, snapshot in reversed(snapshots):
+            rate = row.rates[-1] if row.rates else 0.0
+            if snapshot['running']:
+                if snapshot['stalled']:
+                    state = "<span class='stalled'>停滞</span>"
+                else:
+                    state = "复制中"
+                eta = snapshot['eta']
+                if eta is None and snapshot['completed_files'] and snapshot['queued']:
+                    # 没有历史速度时按已完成文件的平均耗时估算
+                    eta = snapshot['elapsed'] / snapshot['completed_files'] * snapshot['queued']
+                eta_text = format_duration(eta) if eta is not None else '-'
+            else:
+                state = "<span class='done'>完成</span>" if snapshot['success'] else "<span class='failed'>失败</span>"
+                rate = snapshot['bytes'] / snapshot['elapsed'] if snapshot['elapsed'] > 0 else 0.0
+                eta_text = format_duration(snapshot['elapsed']) + ' 用时'
+            errors = snapshot['errors']
+            parts.append(
+                f"<tr><td>{html.escape(snapshot['name'])}</td><td>{html.escape(snapshot['volume_id'] or '-')}</td>"
+                f"<td>{_format_rate(rate)}</td><td>{_sparkline(list(row.rates))}</td>"
+                f"<td>{snapshot['completed_files']}/{snapshot['total_files']}</td><td>{snapshot['queued']}</td>"
+                f"<td>{snapshot['bytes'] / (1024 * 1024):.0f} MB</td><td>{eta_text}</td>"
+                f"<td{' class=failed' if errors else ''}>{errors}</td><td>{state}</td></tr>")
+        parts.append("</table>")
+        return ''.join(parts)
@@ -0,0 +1,393 @@
+import os
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from object_store import ObjectStoreClient, is_object_url, split_object_url
+
+# 网络文件系统类型（Linux /proc/mounts 中的 fstype）
+NETWORK_FS_TYPES = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p', 'afs', 'fuse.rclone'}
+# 网络路径写入缓冲区大小，减少写请求次数
+NETWORK_WRITE_BUFFER = 4 * 1024 * 1024
+
+
+def write_all(dest_file, data):
+    """写入全部数据：无缓冲的文件（buffering=0、O_DIRECT）一次 write 可能只写入一部分"""
+    view = memoryview(data)
+    while view:
+        written = dest_file.write(view)
+        if not written:
+            raise OSError(f"写入目标文件失败: {getattr(dest_file, 'name', '')}")
+        view = view[written:]
+
+
+class LocalBackend:
+    """本地磁盘目标：直接使用 os 和 shutil"""
+    is_local = True     # 可预分配、可同步到磁盘
+    pipelined = False   # 单目标时是否也在读取下一块的同时写入上一块
+    write_buffer = -1   # 打开目标文件时的缓冲区大小，-1 为默认值
+
+    def __init__(self):
+        self.logger = logging.getLogger('CamSync')
+
+    def reset(self):
+        """开始新任务时清除缓存"""
+
+    def stat(self, path):
+        """获取目标文件的 (大小, 修改时间)，不存在时返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def ensure_dir(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+    def open_writer(self, path, st=None):
+        """打开目标文件用于写入
+
+        Args:
+            st: 源文件的 stat 结果，对象存储用于记录修改时间
+        """
+        return open(path, 'wb', buffering=self.write_buffer)
+
+    def abort_writer(self, writer, path):
+        """写入失败时放弃目标文件
+
+        目标文件可能已预分配到完整大小，保留下来的残缺文件大小与源文件相同，下次增量比较时会被当作已复制，
+        因此直接删除
+        """
+        try:
+            writer.close()
+        finally:
+            self.remove_file(path)
+
+    def remove_file(self, path):
+        """删除写入失败留下的目标文件，文件不存在时忽略"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def finish_file(self, src_path, path, st=None):
+        """写入完成后保留元数据
+
+        Args:
+            st: 源文件的 stat 结果，源文件不在文件系统中（如存储卡镜像）时由调用方提供
+        """
+        if st is None:
+            shutil.copystat(src_path, path)
+            return
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.chmod(path, st.st_mode & 0o7777)
+
+    def write_file(self, path, data, st, sync_batcher=None):
+        """一次写入整个小文件，复用调用方的 stat 结果设置元数据；写入失败时删除不完整的文件"""
+        try:
+            with open(path, 'wb', buffering=0) as dest_file:
+                write_all(dest_file, data)
+                if sync_batcher:
+                    sync_batcher.sync_open_file(dest_file)
+        except OSError:
+            self.remove_file(path)
+            raise
+        # 与 shutil.copystat 相同，保留访问/修改时间和权限位
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.chmod(path, st.st_mode & 0o7777)
+
+
+class NetworkBackend(LocalBackend):
+    """高延迟网络路径：按目录批量列出文件代替逐个 stat，目录只创建一次，写入使用大缓冲区并与读取重叠"""
+    pipelined = True
+    write_buffer = NETWORK_WRITE_BUFFER
+
+    def __init__(self):
+        super().__init__()
+        self._listings = {}  # 目录 -> {文件名: (大小, 修改时间)}，目录不存在时为 None
+        self._created_dirs = set()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._listings.clear()
+            self._created_dirs.clear()
+
+    def list_dir(self, directory):
+        """列出目录中的文件，每个目录在一个任务中只请求一次"""
+        with self._lock:
+            if directory in self._listings:
+                return self._listings[directory]
+        listing = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        listing[entry.name] = (st.st_size, st.st_mtime)
+        except FileNotFoundError:
+            listing = None
+        except OSError as e:
+            self.logger.warning(f"列出目标目录失败: {directory}, 错误: {str(e)}")
+            listing = None
+        with self._lock:
+            self._listings[directory] = listing
+        return listing
+
+    def stat(self, path):
+        listing = self.list_dir(os.path.dirname(path))
+        if listing is None:
+            return None
+        return listing.get(os.path.basename(path))
+
+    def ensure_dir(self, directory):
+        with self._lock:
+            if directory in self._created_dirs:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._created_dirs.add(directory)
+
+
+class ObjectWriter:
+    """对象存储写入器：小文件在关闭时一次上传，大文件按分块并行上传（multipart）"""
+    def __init__(self, backend, bucket, key, metadata):
+        self.backend = backend
+        self.bucket = bucket
+        self.key = key
+        self.metadata = metadata
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._futures = []
+        # 限制同时上传的分块数，避免大文件占用过多内存
+        self._slots = threading.Semaphore(backend.max_parallel_parts)
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.backend.part_size:
+            self._submit_part(bytes(self._buffer[:self.backend.part_size]))
+            del self._buffer[:self.backend.part_size]
+        return len(data)
+
+    def _submit_part(self, data):
+        client = self.backend.client
+        if self._upload_id is None:
+            self._upload_id = client.create_multipart_upload(self.bucket, self.key, self.metadata)
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        try:
+            future = self.backend.executor.submit(self._upload_part, part_number, data)
+        except Exception:
+            self._slots.release()
+            raise
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, data):
+        try:
+            return self.backend.client.upload_part(self.bucket, self.key, self._upload_id, part_number, data)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """上传剩余数据并完成上传，失败时放弃已上传的分块"""
+        if self._closed:
+            return
+        self._closed = True
+        client = self.backend.client
+        try:
+            if self._upload_id is None:
+                client.put_object(self.bucket, self.key, self._buffer, self.metadata)
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                etags = [future.result() for future in self._futures]
+                client.complete_multipart_upload(self.bucket, self.key, self._upload_id, etags)
+        except Exception:
+            self._abort_upload()
+            raise
+        finally:
+            self._buffer = bytearray()
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = bytearray()
+        self._abort_upload()
+
+    def _abort_upload(self):
+        if self._upload_id is None:
+            return
+        for future in self._futures:
+            future.cancel()
+        try:
+            self.backend.client.abort_multipart_upload(self.bucket, self.key, self._upload_id)
+        except OSError as e:
+            self.backend.logger.warning(f"放弃分块上传失败: {self.key}, 错误: {str(e)}")
+
+
+class ObjectStoreBackend:
+    """S3 兼容对象存储目标：按前缀批量列出对象，大文件并行分块上传"""
+    is_local = False
+    pipelined = False
+
+    def __init__(self, bucket, client, part_size=8 * 1024 * 1024, max_parallel_parts=4, executor=None):
+        self.logger = logging.getLogger('CamSync')
+        self.bucket = bucket
+        self.client = client
+        # S3 要求除最后一块外每块至少 5 MB
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.max_parallel_parts = max(1, max_parallel_parts)
+        self.executor = executor
+        self._listings = {}  # 前缀 -> {名称: (大小, 修改时间)}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._listings.clear()
+
+    def _key(self, path):
+        return split_object_url(path)[1]
+
+    def list_dir(self, directory):
+        prefix = self._key(directory)
+        prefix = prefix + '/' if prefix else ''
+        with self._lock:
+            if prefix in self._listings:
+                return self._listings[prefix]
+        try:
+            listing = self.client.list_objects(self.bucket, prefix)
+        except OSError as e:
+            self.logger.warning(f"列出对象存储前缀失败: {directory}, 错误: {str(e)}")
+            listing = {}
+        with self._lock:
+            self._listings[prefix] = listing
+        return listing
+
+    def stat(self, path):
+        key = self._key(path)
+        directory, _, name = key.rpartition('/')
+        return self.list_dir(f"s3://{self.bucket}/{directory}").get(name)
+
+    def ensure_dir(self, directory):
+        # 对象存储没有目录
+        pass
+
+    def open_writer(self, path, st=None):
+        metadata = {'mtime': f"{st.st_mtime:.3f}"} if st else {}
+        return ObjectWriter(self, self.bucket, self._key(path), metadata)
+
+    def abort_writer(self, writer, path):
+        writer.abort()
+
+    def remove_file(self, path):
+        # 对象在上传完成时才出现，写入失败不会留下不完整的对象
+        pass
+
+    def finish_file(self, src_path, path, st=None):
+        # 修改时间已作为对象元数据上传
+        pass
+
+    def write_file(self, path, data, st, sync_batcher=None):
+        self.client.put_object(self.bucket, self._key(path), data, {'mtime': f"{st.st_mtime:.3f}"})
+
+
+def _network_mounts():
+    """读取 Linux 上的网络文件系统挂载点"""
+    mounts = []
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and fields[2] in NETWORK_FS_TYPES:
+                    mounts.append(fields[1].replace('\\040', ' '))
+    except OSError:
+        pass
+    return mounts
+
+
+class DestinationBackends:
+    """根据目标路径选择后端：s3:// 路径使用对象存储，网络驱动器和 UNC 路径使用网络后端，其余使用本地后端"""
+    def __init__(self):
+        self.logger = logging.getLogger('CamSync')
+        self.local = LocalBackend()
+        self.network = NetworkBackend()
+        self._object_store_options = None
+        self._object_backends = {}   # 存储桶 -> ObjectStoreBackend
+        self._network_roots = {}     # 盘符或挂载点 -> 是否为网络路径
+        self._mounts = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, object_store_options):
+        """设置对象存储连接选项（endpoint、access_key、secret_key、region、part_size_mb、max_parallel_parts）"""
+        with self._lock:
+            if object_store_options == self._object_store_options:
+                return
+            self._object_store_options = dict(object_store_options or {})
+            self._object_backends.clear()
+
+    def begin_job(self):
+        """开始新的复制任务：目标目录内容可能已被其他程序修改，清除列表缓存"""
+        with self._lock:
+            self._mounts = None
+            self._network_roots.clear()
+            backends = list(self._object_backends.values())
+        self.network.reset()
+        for backend in backends:
+            backend.reset()
+
+    def for_path(self, path):
+        if is_object_url(path):
+            return self._object_backend(split_object_url(path)[0])
+        if self.is_network_path(path):
+            return self.network
+        return self.local
+
+    def _object_backend(self, bucket):
+        with self._lock:
+            backend = self._object_backends.get(bucket)
+            if backend is None:
+                options = self._object_store_options or {}
+                if not options.get('endpoint'):
+                    raise OSError("未配置对象存储地址（object_store.endpoint）")
+                max_parallel_parts = options.get('max_parallel_parts', 4)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=max(8, max_parallel_parts * 2))
+                client = ObjectStoreClient(options['endpoint'], options.get('access_key', ''),
+                                           options.get('secret_key', ''), options.get('region', 'us-east-1'))
+                backend = ObjectStoreBackend(bucket, client, options.get('part_size_mb', 8) * 1024 * 1024,
+                                             max_parallel_parts, self._executor)
+                self._object_backends[bucket] = backend
+            return backend
+
+    def is_network_path(self, path):
+        """判断路径是否位于网络驱动器上，按盘符或挂载点缓存结果"""
+        if path.startswith('\\\\') or path.startswith('//'):
+            return True
+        if os.name == 'nt':
+            root = os.path.splitdrive(os.path.abspath(path))[0].upper()
+            with self._lock:
+                if root in self._network_roots:
+                    return self._network_roots[root]
+            try:
+                import win32con
+                import win32file
+                remote = win32file.GetDriveType(root + '\\') == win32con.DRIVE_REMOTE
+            except Exception:
+                remote = False
+            with self._lock:
+                self._network_roots[root] = remote
+            return remote
+        with self._lock:
+            if self._mounts is None:
+                self._mounts = _network_mounts()
+            mounts = self._mounts
+        path = os.path.abspath(path)
+        return any(path == mount or path.startswith(mount.rstrip('/') + '/') for mount in mounts)
+
+
+# 全局目标后端实例
+destination_backends = DestinationBackends()
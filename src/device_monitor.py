@@ -1,15 +1,16 @@
-import os
 import time
 import logging
-import os
 import win32api
 import win32file
 import win32con
 from PyQt6.QtCore import QThread, pyqtSignal
+from folder_stats import folder_stats
+from card_image import is_image_path, split_image_path, source_scandir, card_images
 
 class DeviceMonitor(QThread):
     # 信号定义
     device_detected = pyqtSignal(tuple)  # (device_path, device_name)
+    device_removed = pyqtSignal(str)     # device_path
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -42,6 +43,8 @@ class DeviceMonitor(QThread):
                     if not any(drive_path == d[0] for d in drives):
                         self.monitored_devices.remove(drive_path)
                         self.logger.info(f"设备已移除: {drive_path}")
+                        # 发送设备移除信号
+                        self.device_removed.emit(drive_path)
                 
                 # 短暂休眠，避免CPU占用过高
                 time.sleep(2)
@@ -90,20 +93,30 @@ class DeviceMonitor(QThread):
         
         return drives
     
+    def get_volume_id(self, device_path):
+        """获取卷标识（卷序列号），无法读取时返回 None"""
+        try:
+            if is_image_path(device_path):
+                return card_images.get(split_image_path(device_path)[0]).volume_id
+            volume_info = win32api.GetVolumeInformation(device_path)
+            return f"{volume_info[1] & 0xFFFFFFFF:08X}"
+        except Exception as e:
+            self.logger.error(f"读取设备 {device_path} 的卷信息时发生错误: {str(e)}")
+            return None
+    
     def check_target_folders(self, device_path):
         """检查设备上是否存在目标文件夹"""
         found_folders = []
         
         try:
-            # 列出设备根目录下的所有项目
-            items = os.listdir(device_path)
+            # 列出设备根目录下的所有项目（存储卡镜像从镜像的根目录读取）
+            items = {entry.name: entry for entry in source_scandir(device_path)}
             
             # 检查每个目标文件夹是否存在
             for folder in self.target_folders:
                 if folder in items:
-                    folder_path = os.path.join(device_path, folder)
                     # 确保是文件夹
-                    if os.path.isdir(folder_path):
+                    if items[folder].is_dir():
                         found_folders.append(folder)
                         self.logger.info(f"在设备 {device_path} 上找到文件夹: {folder}")
         except Exception as e:
@@ -113,20 +126,4 @@ class DeviceMonitor(QThread):
     
     def get_folder_info(self, folder_path):
         """获取文件夹信息，包括文件数量和总大小"""
-        file_count = 0
-        total_size = 0
-        
-        try:
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        file_count += 1
-                        total_size += os.path.getsize(file_path)
-                    except:
-                        # 忽略无法访问的文件
-                        continue
-        except Exception as e:
-            self.logger.error(f"获取文件夹 {folder_path} 信息时发生错误: {str(e)}")
-        
-        return file_count, total_size
\ No newline at end of file
+        return folder_stats.get_folder_stats(folder_path)
\ No newline at end of file
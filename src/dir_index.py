@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import threading
+
+# U盘配置中的目录指纹（dir_fingerprints）格式：
+#   {相对于文件夹的目录路径（以 / 分隔，根目录为 ''）: {
+#       'count': 目录项数, 'mtime': 目录修改时间（纳秒）, 'max_mtime': 文件最新修改时间（纳秒）, 'dirs': 子目录数}}
+# 下次插入时只有目录修改时间变化的目录才会重新列出；含子目录的目录和相机正在写入的目录总是重新列出
+# dir_fingerprints_matcher 为保存指纹时文件匹配设置的摘要，匹配设置改变后（例如放宽了包含模式）指纹作废
+
+
+class DirectoryIndex:
+    """按目录指纹跳过未变化的子目录
+
+    只有目录中所有文件都已记入清单后才保存该目录的指纹，复制失败或尚未复制的文件
+    所在的目录下次仍会重新列出
+    """
+    def __init__(self, folder_path, fingerprints=None, reliable=None, matcher_digest=None):
+        self.folder_path = folder_path
+        self.previous = fingerprints or {}
+        # 存储卡的目录修改时间是否可靠：None 为尚未验证，True 为已见过目录内容变化时修改时间随之变化，
+        # False 为发现内容变化而修改时间未变；只有上次插入前已验证可靠时才跳过目录
+        self.reliable = reliable
+        self._skip = reliable is True
+        self.matcher_digest = matcher_digest
+        self.current = {}
+        self.skipped = 0
+        self._pending = {}  # 目录 -> 尚未记入清单的新文件
+        self._lock = threading.Lock()
+        # 相机正在写入的目录（最新文件所在目录），其修改时间可能不随新文件更新，总是重新列出
+        leaves = [rel_dir for rel_dir, fp in self.previous.items() if not fp.get('dirs')]
+        self._active = max(leaves, key=lambda rel_dir: self.previous[rel_dir]['max_mtime']) if leaves else None
+
+    @classmethod
+    def from_config(cls, folder_path, config):
+        """根据文件夹配置创建目录索引"""
+        digest = matcher_digest(config)
+        fingerprints = config.get('dir_fingerprints')
+        if config.get('dir_fingerprints_matcher') != digest:
+            # 指纹按旧的匹配设置记录，未变化的目录中也可能有新匹配的文件
+            fingerprints = None
+        return cls(folder_path, fingerprints, config.get('dir_mtime_reliable'), digest)
+
+    def should_scan(self, rel_dir, dir_stat):
+        """判断是否需要列出子目录，未变化的目录沿用上次的指纹"""
+        fp = self.previous.get(rel_dir)
+        if not self._skip or fp is None or fp.get('dirs') or rel_dir == self._active:
+            return True
+        if dir_stat.st_mtime_ns != fp['mtime']:
+            return True
+        with self._lock:
+            self.current[rel_dir] = fp
+            self.skipped += 1
+        return False
+
+    def record(self, rel_dir, dir_stat, file_entries, dir_count):
+        """记录已列出目录的指纹
+
+        Args:
+            file_entries: 目录中文件的 os.DirEntry 列表
+            dir_count: 子目录数
+        """
+        max_mtime = 0
+        for entry in file_entries:
+            try:
+                max_mtime = max(max_mtime, entry.stat().st_mtime_ns)
+            except OSError:
+                pass
+        fp = {'count': len(file_entries) + dir_count, 'mtime': dir_stat.st_mtime_ns,
+              'max_mtime': max_mtime, 'dirs': dir_count}
+        old = self.previous.get(rel_dir)
+        with self._lock:
+            if old and (old['count'], old['max_mtime']) != (fp['count'], fp['max_mtime']):
+                if old['mtime'] == fp['mtime']:
+                    # 目录内容变化而修改时间未变：该存储卡不更新目录修改时间
+                    self.reliable = False
+                elif self.reliable is None:
+                    # 内容变化时修改时间随之变化，下次插入起可以跳过未变化的目录
+                    self.reliable = True
+            self.current[rel_dir] = fp
+
+    def _rel_dir(self, src_path):
+        rel_dir = os.path.relpath(os.path.dirname(src_path), self.folder_path).replace(os.sep, '/')
+        return '' if rel_dir == '.' else rel_dir
+
+    def mark_pending(self, src_path):
+        """标记尚未记入清单的新文件"""
+        with self._lock:
+            self._pending.setdefault(self._rel_dir(src_path), set()).add(src_path)
+
+    def resolve(self, src_paths):
+        """新文件已记入清单（复制成功或标记为未保存）"""
+        with self._lock:
+            for src_path in src_paths:
+                pending = self._pending.get(self._rel_dir(src_path))
+                if pending is not None:
+                    pending.discard(src_path)
+
+    def save_to(self, config):
+        """把目录指纹和匹配设置摘要写入文件夹配置"""
+        config['dir_fingerprints'] = self.fingerprints()
+        config['dir_mtime_reliable'] = self.reliable
+        config['dir_fingerprints_matcher'] = self.matcher_digest
+
+    def fingerprints(self):
+        """获取可以保存的目录指纹（不含仍有新文件未记入清单的目录）"""
+        with self._lock:
+            return {rel_dir: fp for rel_dir, fp in self.current.items() if not self._pending.get(rel_dir)}
+
+
+def matcher_digest(config):
+    """文件夹配置中影响扫描结果的匹配设置的摘要"""
+    settings = [config.get('file_patterns', ['*']), config.get('exclude_patterns', []),
+                config.get('include_subfolders', True)]
+    return hashlib.sha1(json.dumps(settings).encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,164 @@
+import os
+import sys
+import stat
+import errno
+import ctypes
+import time
+import logging
+import threading
+
+# 持久化模式
+DURABILITY_NONE = 'none'    # 不主动同步，由操作系统决定何时写入磁盘
+DURABILITY_FILE = 'file'    # 每个文件写完后立即同步
+DURABILITY_BATCH = 'batch'  # 每写入一定数据量同步一次，任务结束时再同步剩余部分
+DURABILITY_MODES = (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_BATCH)
+
+
+def preallocate(dest_file, size):
+    """按已知大小预先分配目标文件空间，减少大文件在机械硬盘阵列上的碎片
+
+    Returns:
+        bool: 是否已预分配（文件大小已被扩展到 size）
+    """
+    if size <= 0:
+        return False
+    fd = dest_file.fileno()
+    try:
+        if sys.platform.startswith('linux'):
+            # glibc 的 posix_fallocate 在不支持 fallocate 的文件系统（如 NFSv3）上会逐块写入一个字节来模拟，
+            # 相当于把文件多写一遍；直接调用 fallocate(2)，不支持时返回 EOPNOTSUPP
+            _fallocate(fd, size)
+        elif hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            # Windows 上设置文件结尾会一次性分配连续的簇
+            os.truncate(fd, size)
+        return True
+    except OSError:
+        # 文件系统不支持预分配时按普通方式写入
+        return False
+
+
+_libc_fallocate = None
+
+
+def _fallocate(fd, size):
+    """调用 Linux 的 fallocate(2)，失败时抛出 OSError"""
+    global _libc_fallocate
+    if _libc_fallocate is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            function = getattr(libc, 'fallocate64', None) or libc.fallocate
+        except (OSError, AttributeError):
+            raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+        function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        function.restype = ctypes.c_int
+        _libc_fallocate = function
+    if _libc_fallocate(fd, 0, 0, size) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def sync_file(dest_file):
+    """将已打开文件的数据同步到磁盘"""
+    dest_file.flush()
+    os.fsync(dest_file.fileno())
+
+
+def sync_path(path):
+    """重新打开已关闭的文件并同步到磁盘"""
+    if os.name == 'posix':
+        # POSIX 上只读描述符也可以 fsync，目标文件复制了源文件的只读权限时同样能同步
+        _fsync_path(path, os.O_RDONLY)
+        return
+    # Windows 上 FlushFileBuffers 需要可写句柄，只读属性的文件临时去掉只读属性后再同步
+    try:
+        _fsync_path(path, os.O_RDWR | os.O_BINARY)
+    except PermissionError:
+        mode = os.stat(path).st_mode
+        if mode & stat.S_IWRITE:
+            raise
+        os.chmod(path, mode | stat.S_IWRITE)
+        try:
+            _fsync_path(path, os.O_RDWR | os.O_BINARY)
+        finally:
+            os.chmod(path, mode)
+
+
+def _fsync_path(path, flags):
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SyncBatcher:
+    """按持久化模式批量同步已写入的文件，并统计同步耗时"""
+    def __init__(self, mode=DURABILITY_BATCH, batch_bytes=256 * 1024 * 1024):
+        self.logger = logging.getLogger('CamSync')
+        self.mode = mode if mode in DURABILITY_MODES else DURABILITY_BATCH
+        self.batch_bytes = batch_bytes
+        self.sync_time = 0.0          # 累计同步耗时（秒）
+        self.failed = []              # 同步失败的文件 [(路径, 错误), ...]
+        self._pending = []            # 尚未同步的文件
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+
+    def sync_open_file(self, dest_file):
+        """逐文件模式下在关闭前同步文件"""
+        if self.mode != DURABILITY_FILE:
+            return
+        start = time.perf_counter()
+        sync_file(dest_file)
+        with self._lock:
+            self.sync_time += time.perf_counter() - start
+
+    def file_written(self, path, nbytes):
+        """记录写入完成的文件，批量模式下累计到阈值时同步"""
+        if self.mode != DURABILITY_BATCH:
+            return
+        with self._lock:
+            self._pending.append(path)
+            self._pending_bytes += nbytes
+            if self._pending_bytes < self.batch_bytes:
+                return
+            paths = self._pending
+            self._pending = []
+            self._pending_bytes = 0
+        self._sync_paths(paths)
+
+    def flush(self):
+        """同步所有尚未同步的文件（任务结束时调用）"""
+        with self._lock:
+            paths = self._pending
+            self._pending = []
+            self._pending_bytes = 0
+        self._sync_paths(paths)
+
+    def _sync_paths(self, paths):
+        if not paths:
+            return
+        start = time.perf_counter()
+        synced_dirs = set()
+        for path in paths:
+            try:
+                sync_path(path)
+            except OSError as e:
+                self.logger.error(f"同步文件失败: {path}, 错误: {str(e)}")
+                with self._lock:
+                    self.failed.append((path, str(e)))
+            # POSIX 上目录项也需要同步，文件才能在断电后可见
+            directory = os.path.dirname(path)
+            if os.name == 'posix' and directory not in synced_dirs:
+                synced_dirs.add(directory)
+                try:
+                    dir_fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+                except OSError:
+                    pass
+        with self._lock:
+            self.sync_time += time.perf_counter() - start
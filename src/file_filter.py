@@ -0,0 +1,81 @@
+import re
+import fnmatch
+
+
+def _compile(patterns):
+    """将多个通配符模式合并编译为一个正则表达式，没有模式时返回 None"""
+    if not patterns:
+        return None
+    # 存储卡上的 FAT/exFAT 文件系统不区分大小写
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+class FileMatcher:
+    """文件包含/排除匹配器，模式只编译一次，扫描时逐个文件匹配并跳过被排除的子目录
+
+    不含 / 的模式匹配文件名（或目录名），含 / 的模式匹配相对于文件夹的路径；
+    以 /、/* 或 /** 结尾的排除模式会排除整个目录，扫描时不再进入
+    """
+    def __init__(self, include_patterns=None, exclude_patterns=None, include_subfolders=True):
+        self.include_subfolders = include_subfolders
+        include_patterns = [p.replace('\\', '/').lstrip('/') for p in (include_patterns or ['*'])]
+        exclude_patterns = [p.replace('\\', '/').lstrip('/') for p in (exclude_patterns or [])]
+
+        # 包含模式为 * 时匹配所有文件，无需逐个匹配
+        self.match_all = '*' in include_patterns
+        self._include_name = _compile([p for p in include_patterns if '/' not in p])
+        self._include_path = _compile([p for p in include_patterns if '/' in p])
+        self._exclude_name = _compile([p for p in exclude_patterns if '/' not in p])
+        self._exclude_path = _compile([p for p in exclude_patterns if '/' in p])
+
+        # 用于排除整个目录的模式
+        dir_patterns = []
+        for pattern in exclude_patterns:
+            for suffix in ('/**', '/*', '/'):
+                if pattern.endswith(suffix):
+                    dir_patterns.append(pattern[:-len(suffix)])
+                    break
+            else:
+                dir_patterns.append(pattern)
+        self._exclude_dir_name = _compile([p for p in dir_patterns if p and '/' not in p])
+        self._exclude_dir_path = _compile([p for p in dir_patterns if '/' in p])
+
+    @classmethod
+    def from_config(cls, config):
+        """根据文件夹配置创建匹配器"""
+        return cls(
+            config.get('file_patterns', ['*']),
+            config.get('exclude_patterns', []),
+            config.get('include_subfolders', True)
+        )
+
+    def match_file(self, rel_path, name):
+        """判断文件是否需要处理
+
+        Args:
+            rel_path: 相对于文件夹的路径（以 / 分隔）
+            name: 文件名
+        """
+        if self._exclude_name and self._exclude_name.match(name):
+            return False
+        if self._exclude_path and self._exclude_path.match(rel_path):
+            return False
+        if self.match_all:
+            return True
+        return bool((self._include_name and self._include_name.match(name)) or
+                    (self._include_path and self._include_path.match(rel_path)))
+
+    def prune_dir(self, rel_dir, name):
+        """判断是否跳过整个子目录
+
+        Args:
+            rel_dir: 子目录相对于文件夹的路径（以 / 分隔）
+            name: 子目录名
+        """
+        if not self.include_subfolders:
+            return True
+        if self._exclude_dir_name and self._exclude_dir_name.match(name):
+            return True
+        if self._exclude_dir_path and self._exclude_dir_path.match(rel_dir):
+            return True
+        return False
@@ -1,194 +1,1015 @@
 import os
-import shutil
 import logging
 import time
+import threading
+import queue
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from PyQt6.QtCore import QThread, pyqtSignal
+from folder_stats import folder_stats
+from library_index import library_index
+from change_detection import compare_files, RULE_NAMES, RULE_EXACT, RULE_SIZE
+from io_trace import io_trace
+from card_image import is_image_path, open_source, source_scandir, source_stat
+from load_governor import load_governor
+from throughput_history import ThroughputHistory, ThroughputSession, EtaEstimator, format_duration
+from job_metrics import JobMetrics
+from file_table import FileTable
+from io_tuner import IOTuner, DEFAULT_PROFILE, open_sequential, advise_read_ahead
+from durability import SyncBatcher, preallocate, DURABILITY_NONE
+from destinations import destination_backends, write_all
+from object_store import OBJECT_URL_PREFIX, is_object_url, split_object_url
+from page_cache import (LARGE_FILE_BUFFERED, LARGE_FILE_DIRECT, LARGE_FILE_MODES, DIRECT_ALIGNMENT,
+                        CacheDropper, advise_sequential, align_up, aligned_buffer, open_direct,
+                        supports_direct_io, memory_footprint)
+
+# 流式复制时扫描队列的容量，队列满时扫描线程等待复制线程（背压）
+STREAM_QUEUE_SIZE = 256
+# 多目标复制时写入线程数上限
+MAX_WRITERS = 8
+# 流式复制按日期布局时每批读取元数据的文件数
+LAYOUT_BATCH_SIZE = 64
+# 小于此大小的文件按批复制，减少逐文件的打开、元数据和进度更新开销
+SMALL_FILE_THRESHOLD = 256 * 1024
+# 每批小文件的数量和总大小上限
+SMALL_BATCH_FILES = 128
+SMALL_BATCH_BYTES = 8 * 1024 * 1024
+
+def dest_path_list(dest_path):
+    """将目标路径统一为列表，多目标复制时目标路径为元组"""
+    if isinstance(dest_path, (list, tuple)):
+        return list(dest_path)
+    return [dest_path]
 
 class FileOperations(QThread):
     # 信号定义
     operation_completed = pyqtSignal(tuple)  # (success, message)
     progress_updated = pyqtSignal(tuple)     # (current, total, status)
+    job_started = pyqtSignal(object)         # JobMetrics，仪表盘按固定频率读取
+    files_copied = pyqtSignal(tuple)         # (src_dir, [src_path, ...], {src_path: [写入失败的目标, ...]},
+                                             #  {src_path: [溢出到的备份卷, ...]})
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, config_manager=None):
         super().__init__(parent)
         self.parent = parent
+        self.config_manager = config_manager
         self.logger = logging.getLogger('CamSync')
         self.is_running = False
-        self.files_to_copy = []
-        self.current_operation = None
+        # 等待执行的复制任务，每个任务自带源文件夹、卷标识等参数，复制线程依次取出执行
+        self._jobs = deque()
+        self._job_lock = threading.Lock()
+        self._draining = False  # 复制线程正在（或即将）取出任务
+        self.current_operation = None  # 正在执行的任务
+        self.volume_id = None  # 当前任务源设备的卷标识，用于记忆 I/O 配置
+        self._progress_lock = threading.Lock()
+        self.copied_files = []  # 当前任务中复制成功的源文件
+        self.partial_files = {}  # 部分目标写入失败的源文件 -> 失败的目标路径
+        self.placements = {}  # 因空间不足写入溢出路径的源文件 -> 实际写入的溢出卷
+        self._spill = None  # 当前任务主备份路径的溢出链（SpillOver）
+        self._dest_roots = []  # 当前任务的目标目录（各备份路径），用于按备份路径汇总写入失败
+        # 历史复制速度，用于预计复制时间；复制任务结束时记入本次的样本
+        self.throughput_history = None
+        if config_manager:
+            self.throughput_history = ThroughputHistory(os.path.join(config_manager.local_config_dir,
+                                                                     'throughput_history.json'))
+        self._throughput = ThroughputSession()
+        self._eta = None  # 当前任务的剩余时间估计，总文件数未知（流式复制）时为 None
+        self.skip_rules = Counter()  # 增量比较中各判断规则的次数
+        self.metrics = JobMetrics()  # 当前任务的计数器
+        self._write_executor = None
+        self._sync_batcher = None
+        self._preallocate = True
+        self._large_file_mode = LARGE_FILE_BUFFERED
+        self._large_file_threshold = 256 * 1024 * 1024
+        self._created_dirs = set()  # 当前任务中已创建的目标目录
+        self.fixed_io_profile = None  # 固定的 I/O 配置（回放轨迹时使用），设置后不再试探测量
     
-    def get_files_to_copy(self, src_dir, dest_dir, incremental=True):
+    def get_files_to_copy(self, src_dir, dest_dir, incremental=True, matcher=None, dir_index=None):
         """获取需要复制的文件列表
         
         Args:
             src_dir: 源目录
             dest_dir: 目标目录
             incremental: 是否为增量备份
+            matcher: 可选的 FileMatcher，按包含/排除模式过滤文件
+            dir_index: 可选的 DirectoryIndex，跳过目录指纹未变化的子目录
         
         Returns:
             list: 需要复制的文件路径列表 [(src_path, dest_path), ...]
         """
-        files_to_copy = []
+        return list(self.iter_files_to_copy(src_dir, dest_dir, incremental, matcher, dir_index))
+    
+    def iter_files_to_copy(self, src_dir, dest_dir, incremental=True, matcher=None, dir_index=None):
+        """逐个生成需要复制的文件，扫描到即可交给复制线程
+        
+        Args:
+            dest_dir: 目标目录，传入列表时同时复制到多个目标
+            matcher: 可选的 FileMatcher，被排除的子目录不会进入扫描
+            dir_index: 可选的 DirectoryIndex，目录指纹未变化的子目录不会被列出
         
+        Yields:
+            tuple: (src_path, dest_path)，多个目标时 dest_path 为元组
+        """
+        dest_dirs = dest_path_list(dest_dir)
+        self._prepare_backends()
+        self.skip_rules = Counter()
         try:
-            # 确保目标目录存在
-            os.makedirs(dest_dir, exist_ok=True)
-            
-            # 遍历源目录
-            for root, dirs, files in os.walk(src_dir):
-                # 计算相对路径
-                rel_path = os.path.relpath(root, src_dir)
-                # 如果是根目录，相对路径为 '.'
-                if rel_path == '.':
-                    rel_path = ''
-                
-                # 遍历文件
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    dest_path = os.path.join(dest_dir, rel_path, file)
-                    
-                    # 确保目标子目录存在
-                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            for rel_path, files in self._walk_source(src_dir, matcher, dir_index):
+                self.metrics.touch()
+                dest_roots = [os.path.join(directory, *rel_path.split('/')) if rel_path else directory
+                              for directory in dest_dirs]
+                for entry in files:
+                    # 增量比较（可能读取部分内容）期间没有数据复制，仪表盘仍视为有进展
+                    self.metrics.touch()
+                    src_path = entry.path
+                    dest_paths = [os.path.join(dest_root, entry.name) for dest_root in dest_roots]
                     
-                    # 检查是否需要复制
-                    if not incremental or not self._should_skip_file(src_path, dest_path):
-                        files_to_copy.append((src_path, dest_path))
+                    # 检查是否需要复制（所有目标都是最新时才跳过）
+                    if not incremental or not all(self._should_skip_file(src_path, dest_path) for dest_path in dest_paths):
+                        yield (src_path, dest_paths[0] if len(dest_paths) == 1 else tuple(dest_paths))
         except Exception as e:
             self.logger.error(f"获取文件列表时发生错误: {str(e)}")
-        
-        return files_to_copy
+        if self.skip_rules:
+            self.logger.info("增量比较: " + "，".join(f"{RULE_NAMES[rule]} {count}"
+                                                      for rule, count in self.skip_rules.most_common()))
     
-    def _should_skip_file(self, src_path, dest_path):
-        """判断是否应该跳过文件（用于增量备份）"""
-        # 如果目标文件不存在，需要复制
-        if not os.path.exists(dest_path):
-            return False
+    def scan_file_table(self, src_dir, dest_dir, matcher=None, dir_index=None, cancel_event=None):
+        """扫描源目录中的所有文件，返回紧凑的文件表（不进行增量过滤），可在后台线程中调用
         
-        # 比较源文件和目标文件的大小和修改时间
-        src_stat = os.stat(src_path)
-        dest_stat = os.stat(dest_path)
+        Args:
+            dest_dir: 目标目录，传入列表时同时复制到多个目标
+            matcher: 可选的 FileMatcher，被排除的子目录不会进入扫描
+            dir_index: 可选的 DirectoryIndex，目录指纹未变化的子目录不会被列出
+            cancel_event: 可选的 threading.Event，置位后在下一个目录处停止扫描
         
-        # 如果大小不同，需要复制
-        if src_stat.st_size != dest_stat.st_size:
-            return False
+        Returns:
+            FileTable: 扫描到的文件，大小和修改时间取自扫描时的 stat 结果
+        """
+        table = FileTable(src_dir, dest_dir)
+        try:
+            for rel_path, files in self._walk_source(src_dir, matcher, dir_index, cancel_event):
+                dir_id = None
+                for entry in files:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if dir_id is None:
+                        dir_id = table.add_dir(rel_path)
+                    table.append(dir_id, entry.name, st.st_size, st.st_mtime_ns)
+        except Exception as e:
+            self.logger.error(f"获取文件列表时发生错误: {str(e)}")
+        return table
+    
+    def _walk_source(self, src_dir, matcher=None, dir_index=None, cancel_event=None):
+        """自上而下深度优先遍历源目录（与 os.walk 顺序相同）
         
-        # 如果源文件更新，需要复制
-        if src_stat.st_mtime > dest_stat.st_mtime:
+        Yields:
+            tuple: (相对目录路径（以 / 分隔，根目录为 ''）, 匹配的文件 os.DirEntry 列表)
+        """
+        # 栈中为 (相对路径, 目录路径, 目录 stat)
+        stack = [('', src_dir, source_stat(src_dir))]
+        while stack:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            rel_path, root, root_stat = stack.pop()
+            list_start = time.perf_counter()
+            try:
+                entries = source_scandir(root)
+            except OSError as e:
+                self.logger.error(f"列出目录失败: {root}, 错误: {str(e)}")
+                continue
+            if io_trace.active:
+                io_trace.listed(root, len(entries), time.perf_counter() - list_start)
+            files = [entry for entry in entries if not entry.is_dir()]
+            dirs = [entry for entry in entries if entry.is_dir()]
+            rel_prefix = rel_path + '/' if rel_path else ''
+            
+            if matcher:
+                # 在进入子目录之前剪除被排除的子树
+                dirs = [entry for entry in dirs if not matcher.prune_dir(rel_prefix + entry.name, entry.name)]
+            
+            subdirs = []
+            for entry in dirs:
+                try:
+                    subdirs.append((rel_prefix + entry.name, entry.path, entry.stat()))
+                except OSError:
+                    continue
+            if dir_index:
+                # 记录本目录的指纹，并跳过指纹未变化的子目录
+                dir_index.record(rel_path, root_stat, files, len(subdirs))
+                subdirs = [subdir for subdir in subdirs if dir_index.should_scan(subdir[0], subdir[2])]
+            stack.extend(reversed(subdirs))
+            
+            if matcher:
+                files = [entry for entry in files if matcher.match_file(rel_prefix + entry.name, entry.name)]
+            yield rel_path, files
+    
+    def _should_skip_file(self, src_path, dest_path):
+        """判断是否应该跳过文件（用于增量备份）"""
+        # 如果目标文件不存在，需要复制（网络和对象存储目标按目录批量列出，不逐个请求）
+        dest_stat = self._dest_stat(dest_path)
+        if dest_stat is None and self._spill:
+            # 以前因空间不足写入溢出路径的文件
+            for alternative in self._spill.alternatives(dest_path):
+                dest_stat = self._dest_stat(alternative)
+                if dest_stat is not None:
+                    break
+        if dest_stat is None:
             return False
         
-        # 否则跳过
-        return True
+        # 比较源文件和目标文件的大小和修改时间，容忍存储卡文件系统的时间精度和时区偏移，
+        # 目标文件较新时跳过
+        skip, rule = compare_files(src_path, source_stat(src_path), dest_path, dest_stat, dest_newer_ok=True)
+        self.skip_rules[rule] += 1
+        if rule not in (RULE_EXACT, RULE_SIZE):
+            self.logger.debug(f"增量比较 {src_path} -> {dest_path}: {RULE_NAMES[rule]}，{'跳过' if skip else '复制'}")
+        return skip
+    
+    def _dest_stat(self, path):
+        """获取目标文件的 (大小, 修改时间)：备份库索引覆盖的路径中不存在的文件直接由索引回答，
+        存在的文件再 stat 一次确认（程序未运行时原地改写的文件不改变目录修改时间，启动核对发现不了）"""
+        if library_index.covers(path) and library_index.stat(path) is None:
+            return None
+        return destination_backends.for_path(path).stat(path)
     
-    def start_copy_operation(self, files_to_copy):
-        """开始文件复制操作"""
-        self.files_to_copy = files_to_copy
-        self.current_operation = 'copy'
-        if not self.isRunning():
-            self.start()
+    def start_copy_operation(self, files_to_copy, volume_id=None, src_dir=None):
+        """开始文件复制操作（正在复制其他文件夹时排队，依次执行）
+        
+        Args:
+            src_dir: 源文件夹，指定时复制结束后通过 files_copied 信号通知复制结果
+        """
+        self._enqueue({
+            'type': 'copy',
+            'files_to_copy': files_to_copy,
+            'volume_id': volume_id,
+            'src_dir': src_dir
+        })
     
-    def start_copy_operation_without_preview(self, src_dir, dest_dir, incremental=True):
-        """不预览直接开始复制操作"""
+    def start_copy_operation_without_preview(self, src_dir, dest_dir, incremental=True, volume_id=None, file_filter=None,
+                                             matcher=None, layout=None, dir_index=None):
+        """不预览直接开始复制操作，边扫描边复制
+        
+        Args:
+            file_filter: 可选的过滤函数，接收源文件路径，返回 False 时跳过该文件
+            matcher: 可选的 FileMatcher，按包含/排除模式过滤文件
+            layout: 可选的 DestinationLayout，按拍摄日期重新规划目标路径
+            dir_index: 可选的 DirectoryIndex，跳过目录指纹未变化的子目录
+        """
         self.logger.info(f"开始复制操作: {src_dir} -> {dest_dir} (增量: {incremental})")
-        self.current_operation = {
+        self._enqueue({
             'type': 'copy_without_preview',
             'src_dir': src_dir,
             'dest_dir': dest_dir,
-            'incremental': incremental
-        }
-        if not self.isRunning():
-            self.start()
+            'incremental': incremental,
+            'volume_id': volume_id,
+            'file_filter': file_filter,
+            'matcher': matcher,
+            'layout': layout,
+            'dir_index': dir_index
+        })
+    
+    def _enqueue(self, job):
+        """加入任务队列：复制线程未运行时启动，正在运行时由 run() 在当前任务结束后取出"""
+        with self._job_lock:
+            self._jobs.append(job)
+            if self._draining:
+                return
+            self._draining = True
+        # 上一次 run() 可能已取完队列但线程尚未结束，等它结束后再启动
+        self.wait()
+        self.start()
+    
+    def pending_jobs(self):
+        """排队等待执行的任务数（不含正在执行的任务）"""
+        with self._job_lock:
+            return len(self._jobs)
     
     def run(self):
-        """线程运行方法，执行文件复制操作"""
+        """线程运行方法，依次执行队列中的复制任务"""
         self.is_running = True
+        try:
+            while True:
+                with self._job_lock:
+                    if not self._jobs or not self.is_running:
+                        # 队列已空，或已请求停止（丢弃尚未开始的任务）
+                        self._jobs.clear()
+                        self._draining = False
+                        return
+                    job = self._jobs.popleft()
+                self._run_job(job)
+        finally:
+            self.current_operation = None
+            self.is_running = False
+    
+    def _run_job(self, job):
+        """执行一个复制任务，任务的参数只在复制线程中读取，排队时不会覆盖正在执行的任务"""
         success = False
         message = ""
-        
+        self.current_operation = job
+        self.volume_id = job['volume_id']
+        src_dir = job['src_dir']
+        self.metrics = JobMetrics(os.path.basename(os.path.normpath(src_dir)) if src_dir else '复制任务', self.volume_id)
         try:
-            if self.current_operation == 'copy':
-                # 执行预览后的复制操作
-                success, message = self._execute_copy_operation(self.files_to_copy)
-            elif isinstance(self.current_operation, dict) and self.current_operation['type'] == 'copy_without_preview':
+            self.job_started.emit(self.metrics)
+            # 扫描时的增量判断和复制时的空间分配共用同一条溢出链
+            self._spill = self.config_manager.get_spill_over() if self.config_manager else None
+            if job['type'] == 'copy':
+                # 执行预览后的复制操作；文件表中的选择带有扫描时的目标目录
+                table = getattr(job['files_to_copy'], 'table', None)
+                self._dest_roots = list(table.dest_dirs) if table else []
+                success, message = self._execute_copy_operation(job['files_to_copy'])
+                if src_dir:
+                    self.files_copied.emit((src_dir, list(self.copied_files), dict(self.partial_files),
+                                            dict(self.placements)))
+            elif job['type'] == 'copy_without_preview':
                 # 执行不预览的复制操作
-                src_dir = self.current_operation['src_dir']
-                dest_dir = self.current_operation['dest_dir']
-                incremental = self.current_operation['incremental']
-                
-                # 获取文件列表
-                files_to_copy = self.get_files_to_copy(src_dir, dest_dir, incremental)
-                if not files_to_copy:
-                    success = True
-                    message = "没有文件需要复制"
-                else:
-                    success, message = self._execute_copy_operation(files_to_copy)
+                self._dest_roots = dest_path_list(job['dest_dir'])
+                success, message = self._execute_streaming_copy(src_dir, job['dest_dir'], job['incremental'],
+                                                                job['file_filter'], job['matcher'], job['layout'],
+                                                                job['dir_index'])
+                # 通知已复制的文件，用于更新U盘文件清单
+                self.files_copied.emit((src_dir, list(self.copied_files), dict(self.partial_files),
+                                        dict(self.placements)))
         except Exception as e:
             success = False
             message = f"操作执行过程中发生错误: {str(e)}"
             self.logger.error(message)
         finally:
+            self.metrics.finish(success)
             # 发送操作完成信号
             self.operation_completed.emit((success, message))
-            self.is_running = False
     
     def _execute_copy_operation(self, files_to_copy):
         """执行文件复制操作的实际逻辑"""
-        total_files = len(files_to_copy)
-        copied_files = 0
+        self._total_files = len(files_to_copy)
+        self._eta = None
+        if self.throughput_history and hasattr(files_to_copy, 'sizes') and len(files_to_copy):
+            # 文件表中的选择带有扫描时的大小，按历史速度预计剩余时间
+            src_path, dest_path = next(iter(files_to_copy))
+            keys = self.throughput_history.keys_for(self.volume_id, src_path, dest_path)
+            self._eta = EtaEstimator(self.throughput_history.models(keys), files_to_copy.sizes())
+        return self._run_copy_jobs(iter(files_to_copy))
+    
+    def estimate_copy_time(self, sizes, src_path, dest_path, volume_id=None):
+        """按历史速度预计复制一组文件所需的时间（秒），复制顺序和并发数的决策也可以使用"""
+        if not self.throughput_history:
+            return None
+        keys = self.throughput_history.keys_for(volume_id, src_path, dest_path)
+        return self.throughput_history.estimate(sizes, keys)
+    
+    def _execute_streaming_copy(self, src_dir, dest_dir, incremental, file_filter=None, matcher=None, layout=None,
+                                dir_index=None):
+        """边扫描边复制：扫描线程把文件放入有界队列，复制线程立即取出复制"""
+        file_queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._total_files = 0
+        self._eta = None
+        self.metrics.queue_depth = file_queue.qsize
+        
+        def enqueue(items):
+            if layout:
+                items = layout.plan(items, save_cache=False)
+                self.metrics.touch()
+            with self._progress_lock:
+                self._total_files += len(items)
+            for item in items:
+                # 队列满时阻塞，避免扫描远远领先于复制
+                file_queue.put(item)
+        
+        def scan():
+            batch = []
+            try:
+                for item in self.iter_files_to_copy(src_dir, dest_dir, incremental, matcher, dir_index):
+                    if file_filter and not file_filter(item[0]):
+                        continue
+                    if not layout:
+                        enqueue([item])
+                        continue
+                    # 按日期布局时分批读取元数据，批量并发读取文件头部
+                    batch.append(item)
+                    if len(batch) >= LAYOUT_BATCH_SIZE:
+                        enqueue(batch)
+                        batch = []
+                enqueue(batch)
+            finally:
+                if layout:
+                    layout.cache.save()
+                file_queue.put(None)
+        
+        scanner = threading.Thread(target=scan, daemon=True)
+        scanner.start()
+        success, message = self._run_copy_jobs(iter(file_queue.get, None))
+        scanner.join()
+        if self._total_files == 0:
+            return True, "没有文件需要复制"
+        return success, message
+    
+    def _run_copy_jobs(self, items):
+        """从文件迭代器中取出文件依次复制，迭代器可以是列表，也可以是扫描队列"""
+        self._completed_files = 0
+        self.copied_files = []
+        self.partial_files = {}
+        self.placements = {}
+        self._created_dirs = set()
         failed_files = []
+        items_lock = threading.Lock()
+        
+        def next_item():
+            with items_lock:
+                return next(items, None)
         
         start_time = time.time()
+        _, cache_before = memory_footprint()
+        self._throughput = ThroughputSession(self.volume_id)
         
-        for i, (src_path, dest_path) in enumerate(files_to_copy):
-            try:
-                # 复制文件
-                shutil.copy2(src_path, dest_path)
-                copied_files += 1
-                
-                # 更新进度
-                status = f"正在复制: {os.path.basename(src_path)}"
-                self.progress_updated.emit((i + 1, total_files, status))
-                self.logger.info(f"已复制: {src_path} -> {dest_path}")
-            except Exception as e:
-                failed_files.append((src_path, str(e)))
-                self.logger.error(f"复制文件失败: {src_path} -> {dest_path}, 错误: {str(e)}")
+        # 目标写入选项：预分配空间和持久化模式
+        write_options = self._load_write_options()
+        self._preallocate = write_options['preallocate']
+        self._large_file_mode = write_options.get('large_file_mode', LARGE_FILE_BUFFERED)
+        if self._large_file_mode not in LARGE_FILE_MODES:
+            self._large_file_mode = LARGE_FILE_BUFFERED
+        self._large_file_threshold = write_options.get('large_file_threshold_mb', 256) * 1024 * 1024
+        self._sync_batcher = SyncBatcher(write_options['durability_mode'], write_options['sync_batch_mb'] * 1024 * 1024)
+        self._prepare_backends()
+        
+        exhausted = threading.Event()  # 所有文件都已取出
+        
+        def copy_items(profile, tuner=None, index=0):
+            # 小文件先放入本线程的批次，攒够一批后一起复制；试探测量在读取足够的时间或字节数、
+            # 或者取出足够多的文件后结束（只有小文件的文件夹读取的字节数很少）
+            batch = []
+            batch_bytes = 0
+            while not (tuner and tuner.is_probe_done()):
+                if load_governor.background:
+                    # 后台模式下系统繁忙时减少同时复制的线程数
+                    with self.metrics.waiting():
+                        load_governor.wait_turn(index, profile['workers'], exhausted)
+                item = next_item()
+                if item is None:
+                    exhausted.set()
+                    break
+                try:
+                    st = source_stat(item[0])
+                except OSError:
+                    st = None
+                if tuner:
+                    tuner.record_item(st.st_size if st else 0)
+                if st is None or st.st_size >= SMALL_FILE_THRESHOLD:
+                    self._copy_one(item, profile, failed_files, tuner, st)
+                    continue
+                batch.append((item, st))
+                batch_bytes += st.st_size
+                if len(batch) >= SMALL_BATCH_FILES or batch_bytes >= SMALL_BATCH_BYTES:
+                    self._copy_small_batch(batch, failed_files, tuner)
+                    batch = []
+                    batch_bytes = 0
+            if batch:
+                self._copy_small_batch(batch, failed_files, tuner)
+        
+        # 优先使用该卷记忆的 I/O 配置，没有时在任务开始阶段试探测量
+        profile = self._load_io_profile()
+        if profile is None:
+            tuner = IOTuner()
+            copy_items(DEFAULT_PROFILE, tuner)
+            profile = tuner.choose_profile()
+            if profile and load_governor.level >= 1.0:
+                # 后台限速期间测得的吞吐量偏低，不记忆
+                self._save_io_profile(profile)
+            else:
+                profile = DEFAULT_PROFILE
+        
+        def worker(index):
+            copy_items(profile, index=index)
+        
+        try:
+            if profile['workers'] > 1:
+                # 多个文件并发复制，掩盖读卡器的访问延迟
+                with ThreadPoolExecutor(max_workers=profile['workers']) as executor:
+                    for index in range(profile['workers']):
+                        executor.submit(worker, index)
+            else:
+                worker(0)
+        finally:
+            if self._write_executor:
+                self._write_executor.shutdown()
+                self._write_executor = None
+            # 任务结束时同步剩余的数据
+            with self.metrics.waiting():
+                self._sync_batcher.flush()
+        if self.throughput_history and not load_governor.background:
+            # 后台限速时的速度不代表设备的能力，不记入历史
+            self.throughput_history.commit(self._throughput)
         
+        copied_files = len(self.copied_files)
         end_time = time.time()
         elapsed_time = end_time - start_time
+        sync_time = self._sync_batcher.sync_time
+        sync_failed = self._sync_batcher.failed
+        if sync_failed:
+            self.logger.warning(f"有 {len(sync_failed)} 个文件未能同步到磁盘（模式: {self._sync_batcher.mode}），"
+                                f"同步耗时 {sync_time:.2f} 秒，总耗时 {elapsed_time:.2f} 秒")
+        elif self._sync_batcher.mode != DURABILITY_NONE:
+            self.logger.info(f"数据已同步到磁盘（模式: {self._sync_batcher.mode}），同步耗时 {sync_time:.2f} 秒，总耗时 {elapsed_time:.2f} 秒")
+        # 记录内存占用，用于比较不同大文件复制模式对页面缓存的影响
+        peak_rss, cache_after = memory_footprint()
+        footprint = f"大文件模式: {self._large_file_mode}"
+        if peak_rss is not None:
+            footprint += f"，进程峰值内存 {self.format_size(peak_rss)}"
+        if cache_before is not None and cache_after is not None:
+            footprint += f"，页面缓存 {self.format_size(cache_before)} -> {self.format_size(cache_after)}"
+        self.logger.info(footprint)
         
-        if failed_files:
-            # 有文件复制失败
-            message = f"复制完成，但有 {len(failed_files)} 个文件失败\n"
-            message += "失败的文件:\n"
-            for file_path, error in failed_files[:5]:  # 只显示前5个失败的文件
-                message += f"- {file_path}: {error}\n"
-            if len(failed_files) > 5:
-                message += f"... 还有 {len(failed_files) - 5} 个失败文件未显示"
+        if failed_files or self.partial_files or sync_failed:
+            message = ""
+            if self._spill and self._spill.full_roots:
+                # 空间不足导致的失败放在最前面，不被逐个文件的错误淹没
+                message += f"备份空间不足，已写满: {', '.join(self._spill.full_roots)}\n"
+            if self.placements:
+                message += f"{len(self.placements)} 个文件因空间不足写入了溢出路径\n"
+            if failed_files:
+                # 有文件复制失败
+                message += f"复制完成，但有 {len(failed_files)} 个文件失败\n"
+                message += "失败的文件:\n"
+                for file_path, error in failed_files[:5]:  # 只显示前5个失败的文件
+                    message += f"- {file_path}: {error}\n"
+                if len(failed_files) > 5:
+                    message += f"... 还有 {len(failed_files) - 5} 个失败文件未显示\n"
+            if self.partial_files:
+                # 按备份路径统计写入失败的文件数
+                dest_failures = Counter(self._dest_root_of(dest_path) for dest_paths in self.partial_files.values()
+                                        for dest_path in dest_paths)
+                message += f"复制完成，但有 {len(self.partial_files)} 个文件未能写入部分目标:\n"
+                for dest_root, count in dest_failures.items():
+                    message += f"- {dest_root}: {count} 个文件\n"
+            if sync_failed:
+                # 文件已写入但未确认落盘，断电后可能丢失
+                message += f"复制完成，但有 {len(sync_failed)} 个文件未能同步到磁盘:\n"
+                for file_path, error in sync_failed[:5]:
+                    message += f"- {file_path}: {error}\n"
+                if len(sync_failed) > 5:
+                    message += f"... 还有 {len(sync_failed) - 5} 个文件未显示\n"
             return False, message
         else:
             # 所有文件复制成功
             message = f"成功复制 {copied_files} 个文件，用时 {elapsed_time:.2f} 秒"
+            if self.placements:
+                message += f"，其中 {len(self.placements)} 个文件因空间不足写入了溢出路径"
+            if self._sync_batcher.mode != DURABILITY_NONE:
+                message += f"（其中同步到磁盘 {sync_time:.2f} 秒）"
             return True, message
     
+    def _dest_root_of(self, dest_path):
+        """目标路径所属的备份路径（本任务的目标目录或溢出路径），不属于任何备份路径时返回所在目录"""
+        roots = list(self._dest_roots)
+        if self._spill:
+            roots += self._spill.roots
+        matches = [root for root in roots if dest_path == root or dest_path.startswith(os.path.join(root, ''))]
+        if matches:
+            return max(matches, key=len)
+        if is_object_url(dest_path):
+            return OBJECT_URL_PREFIX + split_object_url(dest_path)[0]
+        return os.path.dirname(dest_path)
+    
+    def _copy_one(self, item, profile, failed_files, tuner=None, st=None):
+        """复制单个文件并更新进度"""
+        src_path, dest_path = item
+        concurrency = self._throughput.begin()
+        started = time.perf_counter()
+        try:
+            if st is None:
+                st = source_stat(src_path)
+            dest_path, dest_failures = self._copy_with_spill(src_path, dest_path, profile, tuner, st)
+            self._throughput.record(src_path, dest_path, [st.st_size], time.perf_counter() - started, concurrency)
+            self.copied_files.append(src_path)
+            if dest_failures:
+                # 部分目标写入失败，其余目标已写入完成
+                self.partial_files[src_path] = [failed_path for failed_path, _ in dest_failures]
+                self.metrics.add_error()
+                for failed_path, error in dest_failures:
+                    self.logger.error(f"写入目标失败: {src_path} -> {failed_path}, 错误: {error}")
+            else:
+                self.logger.info(f"已复制: {src_path} -> {dest_path}")
+        except Exception as e:
+            self._throughput.cancel()
+            failed_files.append((src_path, str(e)))
+            self.metrics.add_error()
+            self.logger.error(f"复制文件失败: {src_path} -> {dest_path}, 错误: {str(e)}")
+        
+        # 更新进度（流式复制时总数为目前已扫描到的文件数）
+        self._emit_progress(1, src_path, [st.st_size if st else 0])
+    
+    def _emit_progress(self, count, src_path, sizes):
+        """更新进度，有剩余时间估计时附在状态中"""
+        with self._progress_lock:
+            self._completed_files += count
+            completed = self._completed_files
+            total_files = self._total_files
+        status = f"正在复制: {os.path.basename(src_path)}"
+        eta = None
+        if self._eta:
+            self._eta.advance(sizes)
+            eta = self._eta.remaining()
+            status += f"（剩余约 {format_duration(eta)}）"
+        self.metrics.progress(completed, total_files, eta)
+        self.progress_updated.emit((completed, total_files, status))
+    
+    def _throttle(self, nbytes):
+        """记录读取的字节数，后台限速等待期间仪表盘不把任务判为停滞"""
+        if load_governor.background:
+            with self.metrics.waiting():
+                load_governor.throttle(nbytes)
+        self.metrics.add_bytes(nbytes)
+    
+    def _place(self, src_path, dest_path, size):
+        """按溢出链为文件的各个目标选择备份卷，返回实际目标路径（多目标时为元组）"""
+        if self._spill is None:
+            return dest_path
+        paths = [self._spill.place(path, size) for path in dest_path_list(dest_path)]
+        return paths[0] if len(paths) == 1 else tuple(paths)
+    
+    def _record_placement(self, src_path, planned, actual):
+        """记录写入溢出路径的目标，并在日志中说明"""
+        spilled = [self._spill.root_of(path) for path, planned_path in zip(dest_path_list(actual), dest_path_list(planned))
+                   if path != planned_path]
+        if spilled:
+            self.placements[src_path] = spilled
+            self.logger.info(f"备份卷空间不足，{src_path} 已写入溢出路径: {', '.join(spilled)}")
+    
+    def _copy_with_spill(self, src_path, dest_path, profile, tuner=None, st=None):
+        """复制文件，目标卷空间不足时改为写入溢出链中下一个卷的相同位置
+        
+        Returns:
+            tuple: (实际目标路径, 写入失败的目标 [(dest_path, error), ...])
+        """
+        if self._spill is None:
+            return dest_path, self._copy_file(src_path, dest_path, profile, tuner, st)
+        if st is None:
+            st = source_stat(src_path)
+        planned = dest_path
+        dest_path = self._place(src_path, dest_path, st.st_size)
+        try:
+            failures = self._copy_file(src_path, dest_path, profile, tuner, st)
+        except OSError as e:
+            failures = [(path, str(e)) for path in dest_path_list(dest_path)]
+        actual = {path: path for path in dest_path_list(dest_path)}
+        remaining = []
+        for path, error in failures:
+            # 写入失败后重新查询可用空间，确实写满时改写到下一个卷（只重试该目标，源文件再读一次）
+            failed_path = path
+            alternative = self._spill.overflow(path, st.st_size)
+            while alternative:
+                self._remove_partial(failed_path)
+                try:
+                    if not self._copy_file(src_path, alternative, profile, None, st):
+                        actual[path] = alternative
+                        break
+                except OSError as e:
+                    error = str(e)
+                failed_path = alternative
+                alternative = self._spill.overflow(alternative, st.st_size)
+            else:
+                remaining.append((path, error))
+        if len(remaining) == len(actual):
+            raise OSError(f"所有目标均写入失败: {remaining[0][1]}")
+        actual = [actual[path] for path in dest_path_list(dest_path)]
+        actual = actual[0] if len(actual) == 1 else tuple(actual)
+        self._record_placement(src_path, planned, actual)
+        return actual, remaining
+    
+    def _remove_partial(self, path):
+        """删除写入失败留下的不完整（可能已预分配到完整大小）的目标文件，
+        改写到溢出卷后主备份路径中不再留有残缺文件，增量比较也不会把它当作已复制"""
+        try:
+            destination_backends.for_path(path).remove_file(path)
+        except OSError as e:
+            self.logger.warning(f"删除不完整的目标文件失败: {path}, 错误: {str(e)}")
+    
+    def _copy_small_batch(self, batch, failed_files, tuner=None):
+        """复制一批小文件：每个文件一次读取、一次写入，复用分组时的 stat 结果设置元数据，
+        整批只记录一行日志、更新一次进度
+        
+        Args:
+            batch: [((src_path, dest_path), os.stat_result), ...]
+            tuner: 试探阶段的 IOTuner，记录每个文件的访问延迟和读取速度
+        """
+        batch_bytes = 0
+        copied_sizes = []
+        concurrency = self._throughput.begin()
+        started = time.perf_counter()
+        for (src_path, dest_path), st in batch:
+            try:
+                open_time = time.perf_counter()
+                src_file = open_source(src_path)
+                if io_trace.active:
+                    src_file = io_trace.wrap_source(src_file, src_path, st.st_size, time.perf_counter() - open_time)
+                with src_file:
+                    read_start = time.perf_counter()
+                    data = src_file.read()
+                if tuner:
+                    read_end = time.perf_counter()
+                    tuner.record_file(read_end - open_time)
+                    tuner.record_read(len(data), read_end - read_start)
+                self._throttle(len(data))
+                planned = dest_path
+                dest_path = self._place(src_path, dest_path, len(data))
+                failures = []
+                written = []
+                actual = []
+                for path in dest_path_list(dest_path):
+                    target = path
+                    while True:
+                        try:
+                            self._ensure_dir(os.path.dirname(target))
+                            backend = destination_backends.for_path(target)
+                            backend.write_file(target, data, st, self._sync_batcher)
+                            written.append((target, backend))
+                            break
+                        except OSError as e:
+                            # 备份卷写满时删除写了一半的文件，改写到溢出链中的下一个卷
+                            failed_target = target
+                            target = self._spill.overflow(target, len(data)) if self._spill else None
+                            if target is None:
+                                failures.append((path, str(e)))
+                                break
+                            self._remove_partial(failed_target)
+                    actual.append(target or path)
+                if self._spill:
+                    self._record_placement(src_path, planned, actual[0] if len(actual) == 1 else tuple(actual))
+                if not written:
+                    raise OSError(f"所有目标均写入失败: {failures[0][1]}")
+                for path, backend in written:
+                    if self._sync_batcher and backend.is_local:
+                        with self.metrics.waiting():
+                            self._sync_batcher.file_written(path, len(data))
+                self.copied_files.append(src_path)
+                batch_bytes += len(data)
+                copied_sizes.append(len(data))
+                if failures:
+                    self.partial_files[src_path] = [failed_path for failed_path, _ in failures]
+                    self.metrics.add_error()
+                    for failed_path, error in failures:
+                        self.logger.error(f"写入目标失败: {src_path} -> {failed_path}, 错误: {error}")
+                else:
+                    self.logger.debug(f"已复制: {src_path} -> {dest_path}")
+            except Exception as e:
+                failed_files.append((src_path, str(e)))
+                self.metrics.add_error()
+                self.logger.error(f"复制文件失败: {src_path} -> {dest_path}, 错误: {str(e)}")
+        
+        if copied_sizes:
+            self._throughput.record(batch[0][0][0], batch[0][0][1], copied_sizes, time.perf_counter() - started,
+                                    concurrency)
+        else:
+            self._throughput.cancel()
+        self.logger.info(f"已复制 {len(batch)} 个小文件（{self.format_size(batch_bytes)}），"
+                         f"最后一个: {batch[-1][0][0]}")
+        self._emit_progress(len(batch), batch[-1][0][0], [st.st_size for _, st in batch])
+    
+    def _copy_file(self, src_path, dest_path, profile, tuner=None, st=None):
+        """按 I/O 配置分块复制文件，并像 shutil.copy2 一样保留元数据
+        
+        多个目标时源文件只读取一次，每个数据块同时写入所有目标，
+        单个目标写入失败不影响其余目标
+        
+        Args:
+            st: 源文件的 stat 结果，没有时重新获取
+        
+        Returns:
+            list: 写入失败的目标 [(dest_path, error), ...]
+        """
+        buffer_size = profile['buffer_size']
+        read_ahead = profile['read_ahead']
+        if st is None:
+            st = source_stat(src_path)
+        # 存储卡镜像中的文件由 card_image 按簇读取，没有文件描述符，不能使用 O_DIRECT 和预读提示
+        image_src = is_image_path(src_path)
+        
+        # 大文件按配置的模式绕过页面缓存或及时释放，避免挤掉其他程序的缓存
+        large_mode = self._large_file_mode if st.st_size >= self._large_file_threshold else LARGE_FILE_BUFFERED
+        
+        failures = []
+        dest_files = []
+        backends = {}
+        direct_dests = set()  # 以 O_DIRECT 打开的目标
+        for path in dest_path_list(dest_path):
+            try:
+                self._ensure_dir(os.path.dirname(path))
+                backends[path] = destination_backends.for_path(path)
+                dest_file = None
+                if large_mode == LARGE_FILE_DIRECT and backends[path].is_local:
+                    dest_file = self._open_direct(path, 'wb')
+                if dest_file is None:
+                    dest_file = backends[path].open_writer(path, st)
+                else:
+                    direct_dests.add(path)
+                dest_files.append((path, dest_file))
+            except OSError as e:
+                failures.append((path, str(e)))
+        if not dest_files:
+            raise OSError(f"所有目标均无法写入: {failures[0][1]}")
+        
+        def discard(path, dest_file):
+            dest_files.remove((path, dest_file))
+            try:
+                backends[path].abort_writer(dest_file, path)
+            except OSError:
+                pass
+        
+        src_file = self._open_direct(src_path, 'rb') if large_mode == LARGE_FILE_DIRECT and not image_src else None
+        direct_src = src_file is not None
+        
+        # 多目标或网络目标时使用双缓冲：写入上一块的同时读取下一块
+        pipelined = len(dest_files) > 1 or any(backends[path].pipelined for path, _ in dest_files)
+        if direct_src or direct_dests:
+            # O_DIRECT 需要按页对齐的缓冲区
+            buffers = [aligned_buffer(buffer_size) for _ in range(2 if pipelined else 1)]
+        else:
+            buffers = [bytearray(buffer_size) for _ in range(2 if pipelined else 1)]
+        pending = []
+        
+        def wait_pending():
+            for path, dest_file, future in pending:
+                try:
+                    future.result()
+                except OSError as e:
+                    failures.append((path, str(e)))
+                    discard(path, dest_file)
+            pending.clear()
+        
+        completed = False
+        try:
+            open_time = time.perf_counter()
+            if src_file is None:
+                src_file = open_source(src_path, open_sequential)
+            if io_trace.active:
+                # 记录 I/O 轨迹，回放时在此注入模拟设备的延迟
+                src_file = io_trace.wrap_source(src_file, src_path, st.st_size, time.perf_counter() - open_time)
+            with src_file:
+                fd = None if image_src else src_file.fileno()
+                # 按源文件大小预分配目标空间
+                size = st.st_size if image_src else os.fstat(fd).st_size
+                # 每个目标分别记录是否已预分配，预分配失败的目标按普通方式写入
+                preallocated = set()
+                if self._preallocate:
+                    preallocated = {path for path, dest_file in dest_files
+                                    if backends[path].is_local and preallocate(dest_file, size)}
+                # 不使用 O_DIRECT 的大文件：顺序读取，并按窗口释放已读写部分的页面缓存
+                src_dropper = None
+                dest_droppers = []
+                if large_mode != LARGE_FILE_BUFFERED:
+                    if fd is not None and not direct_src:
+                        advise_sequential(fd)
+                        src_dropper = CacheDropper(fd, lag=0)
+                    dest_droppers = [CacheDropper(dest_file.fileno()) for path, dest_file in dest_files
+                                     if backends[path].is_local and path not in direct_dests]
+                offset = 0
+                next_hint = 0
+                index = 0
+                while True:
+                    # 预读窗口消耗过半时提示系统继续预读
+                    if read_ahead and fd is not None and not direct_src and offset >= next_hint:
+                        advise_read_ahead(fd, offset, read_ahead)
+                        next_hint = offset + read_ahead // 2
+                    buffer = buffers[index % len(buffers)]
+                    read_start = time.perf_counter()
+                    n = src_file.readinto(buffer)
+                    self._throttle(n)
+                    if tuner:
+                        read_end = time.perf_counter()
+                        if offset == 0:
+                            tuner.record_file(read_end - open_time)
+                        tuner.record_read(n, read_end - read_start)
+                    wait_pending()
+                    for dropper in dest_droppers:
+                        dropper.advance(offset)
+                    if not n:
+                        break
+                    if not dest_files:
+                        break
+                    chunk = memoryview(buffer)[:n]
+                    padded = chunk
+                    if direct_dests and n % DIRECT_ALIGNMENT:
+                        # O_DIRECT 目标的最后一块补零到对齐长度写入，完成后截断到实际大小
+                        aligned = align_up(n)
+                        buffer[n:aligned] = bytes(aligned - n)
+                        padded = memoryview(buffer)[:aligned]
+                    if len(buffers) == 1:
+                        path, dest_file = dest_files[0]
+                        write_all(dest_file, padded if path in direct_dests else chunk)
+                    else:
+                        executor = self._get_write_executor()
+                        for path, dest_file in dest_files:
+                            data = padded if path in direct_dests else chunk
+                            pending.append((path, dest_file, executor.submit(write_all, dest_file, data)))
+                    offset += n
+                    index += 1
+                    if src_dropper:
+                        src_dropper.advance(offset)
+                wait_pending()
+                if src_dropper:
+                    src_dropper.finish()
+            
+            for path, dest_file in list(dest_files):
+                if not backends[path].is_local:
+                    continue
+                try:
+                    # 复制过程中源文件变小时截去多分配的部分，O_DIRECT 目标截去补齐的部分
+                    if (path in preallocated and offset != size) or (path in direct_dests and offset % DIRECT_ALIGNMENT):
+                        dest_file.truncate(offset)
+                    if self._sync_batcher:
+                        with self.metrics.waiting():
+                            self._sync_batcher.sync_open_file(dest_file)
+                except OSError as e:
+                    failures.append((path, str(e)))
+                    discard(path, dest_file)
+            for dropper in dest_droppers:
+                dropper.finish()
+            completed = True
+        finally:
+            wait_pending()
+            if not completed:
+                # 读取源文件失败时放弃所有目标，未完成的对象存储上传不会留下不完整的对象
+                for path, dest_file in list(dest_files):
+                    discard(path, dest_file)
+            # 关闭时会写出缓冲区中剩余的数据，失败的目标同样记为写入失败
+            for path, dest_file in list(dest_files):
+                try:
+                    dest_file.close()
+                except OSError as e:
+                    # 写出缓冲区时磁盘已满等，文件内容不完整
+                    failures.append((path, str(e)))
+                    dest_files.remove((path, dest_file))
+                    self._remove_partial(path)
+        
+        if not dest_files:
+            raise OSError(f"所有目标均写入失败: {failures[0][1]}")
+        for path, _ in dest_files:
+            backends[path].finish_file(src_path, path, st if image_src else None)
+            if self._sync_batcher and backends[path].is_local:
+                with self.metrics.waiting():
+                    self._sync_batcher.file_written(path, offset)
+        return failures
+    
+    def _open_direct(self, path, mode):
+        """以 O_DIRECT 方式打开文件，平台或文件系统不支持时返回 None（退回普通方式）"""
+        if not supports_direct_io():
+            return None
+        try:
+            return open(path, mode, buffering=0, opener=open_direct)
+        except OSError as e:
+            self.logger.debug(f"无法以 O_DIRECT 方式打开 {path}: {str(e)}")
+            return None
+    
+    def _ensure_dir(self, directory):
+        """确保目标目录存在，每个任务中每个目录只创建一次"""
+        if directory in self._created_dirs:
+            return
+        destination_backends.for_path(directory).ensure_dir(directory)
+        with self._progress_lock:
+            self._created_dirs.add(directory)
+    
+    def _prepare_backends(self):
+        """按当前配置准备目标后端，并清除上一个任务的目录列表缓存"""
+        if self.config_manager:
+            destination_backends.configure(self.config_manager.get_object_store_options())
+        destination_backends.begin_job()
+    
+    def _load_write_options(self):
+        """获取目标写入选项"""
+        if self.config_manager:
+            return self.config_manager.get_write_options()
+        return {'preallocate': True, 'durability_mode': DURABILITY_NONE, 'sync_batch_mb': 256,
+                'large_file_mode': LARGE_FILE_BUFFERED, 'large_file_threshold_mb': 256}
+    
+    def _get_write_executor(self):
+        """获取多目标写入线程池，每个复制任务共用一个"""
+        with self._progress_lock:
+            if self._write_executor is None:
+                self._write_executor = ThreadPoolExecutor(max_workers=MAX_WRITERS)
+            return self._write_executor
+    
+    def _load_io_profile(self):
+        """获取当前源设备记忆的 I/O 配置"""
+        if self.fixed_io_profile:
+            return dict(self.fixed_io_profile)
+        if self.config_manager and self.volume_id:
+            return self.config_manager.get_io_profile(self.volume_id)
+        return None
+    
+    def _save_io_profile(self, profile):
+        """记忆当前源设备的 I/O 配置"""
+        if self.config_manager and self.volume_id:
+            self.config_manager.set_io_profile(self.volume_id, profile)
+    
     def stop_operation(self):
-        """停止当前操作"""
+        """停止复制：当前任务结束后不再执行排队的任务"""
         self.is_running = False
         self.wait()
     
     def calculate_folder_size(self, folder_path):
         """计算文件夹大小"""
-        total_size = 0
-        try:
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        total_size += os.path.getsize(file_path)
-                    except:
-                        continue
-        except Exception as e:
-            self.logger.error(f"计算文件夹大小错误: {str(e)}")
-        return total_size
+        return folder_stats.get_folder_stats(folder_path)[1]
     
     def format_size(self, size_bytes):
         """格式化文件大小"""
@@ -203,6 +1024,7 @@ class FileOperations(QThread):
             'only_in_source': [],    # 仅在源目录中存在的文件
             'only_in_dest': [],      # 仅在目标目录中存在的文件
             'different_files': [],   # 两边都有但内容不同的文件
+            'rules': {},             # 两边都有的文件 -> 做出判断的规则（见 change_detection）
             'total_size_diff': 0     # 总大小差异
         }
         
@@ -215,14 +1037,20 @@ class FileOperations(QThread):
                 source_files.add(rel_path)
                 source_size += os.path.getsize(os.path.join(root, file))
         
-        # 收集目标目录中的所有文件路径
-        dest_files = set()
-        dest_size = 0
-        for root, _, files in os.walk(dest_dir):
-            for file in files:
-                rel_path = os.path.relpath(os.path.join(root, file), dest_dir)
-                dest_files.add(rel_path)
-                dest_size += os.path.getsize(os.path.join(root, file))
+        # 收集目标目录中的所有文件 {相对路径: (大小, 修改时间)}，备份库索引覆盖时无需遍历
+        if library_index.covers(dest_dir):
+            dest_entries = library_index.files_under(dest_dir)
+        else:
+            dest_entries = {}
+            for root, _, files in os.walk(dest_dir):
+                for file in files:
+                    try:
+                        st = os.stat(os.path.join(root, file))
+                    except OSError:
+                        continue
+                    dest_entries[os.path.relpath(os.path.join(root, file), dest_dir)] = (st.st_size, st.st_mtime)
+        dest_files = set(dest_entries)
+        dest_size = sum(size for size, _ in dest_entries.values())
         
         # 计算差异
         diff_info['only_in_source'] = list(source_files - dest_files)
@@ -232,13 +1060,13 @@ class FileOperations(QThread):
         common_files = source_files & dest_files
         for rel_path in common_files:
             src_path = os.path.join(src_dir, rel_path)
-            dest_path = os.path.join(dest_dir, rel_path)
+            dest_file_size, dest_mtime = dest_entries[rel_path]
             
             try:
-                src_stat = os.stat(src_path)
-                dest_stat = os.stat(dest_path)
-                
-                if src_stat.st_size != dest_stat.st_size or src_stat.st_mtime != dest_stat.st_mtime:
+                same, rule = compare_files(src_path, os.stat(src_path), os.path.join(dest_dir, rel_path),
+                                           (dest_file_size, dest_mtime))
+                diff_info['rules'][rel_path] = rule
+                if not same:
                     diff_info['different_files'].append(rel_path)
             except:
                 continue
@@ -0,0 +1,166 @@
+import os
+import sys
+from array import array
+from collections import Counter
+from itertools import compress
+from change_detection import match_fingerprint, REFRESH_RULES
+
+# 文件标志位
+FLAG_NEW = 1        # 不在文件清单中（或上次未能写入全部目标）的新文件
+FLAG_SELECTED = 2   # 用户在确认对话框中选中的文件
+
+
+def _flag_table(flag, without=0):
+    """生成 bytes.translate 用的转换表：标志位全部置位且不含 without 的值映射为 1，其余为 0"""
+    return bytes(1 if (value & flag) == flag and not (value & without) else 0 for value in range(256))
+
+
+class FileTable:
+    """扫描结果的紧凑表示
+
+    目录前缀只存一份，文件名、大小、修改时间和标志按列存储在数组中；
+    完整的源路径和目标路径只在需要时拼接，几十万个文件时内存占用远小于路径元组列表
+    """
+    def __init__(self, src_dir, dest_dir):
+        self.src_dir = src_dir
+        # 目标目录，多目标复制时为列表
+        self.dest_dirs = list(dest_dir) if isinstance(dest_dir, (list, tuple)) else [dest_dir]
+        self.dirs = []            # 相对于源目录的目录路径（以 / 分隔，根目录为 ''）
+        self.dir_ids = array('I')
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('q')  # 修改时间（纳秒）
+        self.flags = bytearray()
+        self.dest_overrides = {}  # 行号 -> 按拍摄日期重新规划的目标路径
+        self._src_roots = []      # 目录 ID -> 源目录完整路径
+        self._dest_roots = []     # 目录 ID -> 各目标目录完整路径
+        self.match_rules = Counter()  # 与文件清单比较时各判断规则的次数
+        # 按时区偏移判定为已知文件的当前指纹 {'saved_files'/'unsaved_files': {键: 指纹}}，保存配置时写回清单
+        self.refreshed = {'saved_files': {}, 'unsaved_files': {}}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_dir(self, rel_dir):
+        """登记目录，返回目录 ID"""
+        self.dirs.append(rel_dir)
+        parts = rel_dir.split('/') if rel_dir else []
+        self._src_roots.append(os.path.join(self.src_dir, *parts))
+        self._dest_roots.append(tuple(os.path.join(directory, *parts) for directory in self.dest_dirs))
+        return len(self.dirs) - 1
+
+    def append(self, dir_id, name, size, mtime_ns):
+        self.dir_ids.append(dir_id)
+        self.names.append(name)
+        self.sizes.append(size)
+        self.mtimes.append(mtime_ns)
+        self.flags.append(0)
+
+    def key(self, row):
+        """文件在清单中的键（相对于源目录的路径），与 manifest.file_key 一致"""
+        rel_dir = self.dirs[self.dir_ids[row]]
+        return rel_dir + '/' + self.names[row] if rel_dir else self.names[row]
+
+    def src_path(self, row):
+        return os.path.join(self._src_roots[self.dir_ids[row]], self.names[row])
+
+    def dest_path(self, row):
+        """目标路径，多目标复制时为元组"""
+        if row in self.dest_overrides:
+            return self.dest_overrides[row]
+        dest_paths = tuple(os.path.join(dest_root, self.names[row]) for dest_root in self._dest_roots[self.dir_ids[row]])
+        return dest_paths[0] if len(dest_paths) == 1 else dest_paths
+
+    def fingerprint(self, row):
+        """文件指纹 [大小, 修改时间（整数秒）]，与 manifest.file_fingerprint 一致，无需再次 stat"""
+        return [self.sizes[row], self.mtimes[row] // 1000000000]
+
+    def rows(self, flag, without=0):
+        """获取标志位全部置位且不含 without 的行号"""
+        return array('I', compress(range(len(self.flags)), self.flags.translate(_flag_table(flag, without))))
+
+    def set_flag(self, rows, flag):
+        flags = self.flags
+        for row in rows:
+            flags[row] |= flag
+
+    def clear_flag(self, flag):
+        """清除所有行的标志位"""
+        self.flags = self.flags.translate(bytes(value & ~flag for value in range(256)))
+
+    def mark_new(self, saved_files, unsaved_files, missing_destinations=None):
+        """与文件清单比较，标记新文件（键相同且指纹一致才算已知文件，允许时间精度和时区偏移的差异）
+
+        Returns:
+            array: 新文件的行号
+        """
+        missing_destinations = missing_destinations or {}
+        for row in range(len(self.names)):
+            key = self.key(row)
+            if key not in missing_destinations and (self._is_known(saved_files, key, row, 'saved_files') or
+                                                    self._is_known(unsaved_files, key, row, 'unsaved_files')):
+                continue
+            self.flags[row] |= FLAG_NEW
+        return self.rows(FLAG_NEW)
+
+    def _is_known(self, manifest, key, row, list_name):
+        """与 manifest.is_known 一致，使用扫描时记录的大小和修改时间；已保存的文件与镜像目标中的副本比较内容"""
+        if key not in manifest:
+            return False
+        copy_path = None
+        if list_name == 'saved_files':
+            copy_path = os.path.join(self._dest_roots[self.dir_ids[row]][0], self.names[row])
+        known, rule = match_fingerprint(self.src_path(row), (self.sizes[row], self.mtimes[row] / 1e9),
+                                        manifest[key], copy_path)
+        self.match_rules[rule] += 1
+        if known and rule in REFRESH_RULES:
+            self.refreshed[list_name][key] = self.fingerprint(row)
+        return known
+
+    def manifest_entries(self, rows):
+        """为一组行生成清单条目，与 manifest.build_entries 一致"""
+        return {self.key(row): self.fingerprint(row) for row in rows}
+
+    def total_size(self, rows):
+        sizes = self.sizes
+        return sum(sizes[row] for row in rows)
+
+    def plan_destinations(self, layout, rows):
+        """按 DestinationLayout 重新规划一组行的目标路径"""
+        planned = layout.plan(list(self.select(rows)))
+        for row, (_, dest_path) in zip(rows, planned):
+            if dest_path != self.dest_path(row):
+                self.dest_overrides[row] = dest_path
+
+    def select(self, rows):
+        """获取一组行的 (源路径, 目标路径) 序列，路径在遍历时才拼接"""
+        return FileSelection(self, rows)
+
+    def memory_usage(self):
+        """估算表占用的内存（字节）"""
+        columns = (self.dir_ids, self.sizes, self.mtimes)
+        total = sum(sys.getsizeof(column) for column in columns) + sys.getsizeof(self.flags)
+        total += sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names)
+        total += sum(sys.getsizeof(path) for path in self.dirs + self._src_roots)
+        total += sum(sys.getsizeof(path) for roots in self._dest_roots for path in roots)
+        return total
+
+
+class FileSelection:
+    """文件表中一组行的视图，可以像 [(src_path, dest_path), ...] 一样求长度和遍历"""
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def sizes(self):
+        """各文件扫描时的大小，与遍历顺序一致"""
+        sizes = self.table.sizes
+        return [sizes[row] for row in self.rows]
+
+    def __iter__(self):
+        table = self.table
+        for row in self.rows:
+            yield table.src_path(row), table.dest_path(row)
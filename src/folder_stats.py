@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from card_image import source_scandir, source_stat
+from library_index import library_index
+
+class FolderStats:
+    """文件夹统计服务，并发扫描子目录并按目录标识缓存结果"""
+    def __init__(self, max_workers=4):
+        self.logger = logging.getLogger('CamSync')
+        self.max_workers = max_workers
+        # 目录路径 -> (目录标识, 直接文件数, 直接文件大小, 子目录列表)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _dir_identity(self, dir_path):
+        """获取目录标识（设备号、inode、修改时间）
+
+        增删文件会更新目录修改时间；原地改写文件大小不会，相机存储卡上可忽略这种情况
+        """
+        st = source_stat(dir_path)
+        return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    def _scan_dir(self, dir_path):
+        """统计单个目录的直接内容，标识未变化时直接返回缓存"""
+        identity = self._dir_identity(dir_path)
+        with self._lock:
+            cached = self._cache.get(dir_path)
+        if cached and cached[0] == identity:
+            return cached[1], cached[2], cached[3]
+
+        file_count = 0
+        total_size = 0
+        subdirs = []
+        for entry in source_scandir(dir_path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    # scandir 在 Windows 上的 stat 结果来自目录列表，无需额外系统调用
+                    file_count += 1
+                    total_size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                # 忽略无法访问的文件
+                continue
+
+        with self._lock:
+            self._cache[dir_path] = (identity, file_count, total_size, subdirs)
+        return file_count, total_size, subdirs
+
+    def _scan_tree(self, dir_path):
+        """统计一个子树的文件数量和总大小"""
+        file_count = 0
+        total_size = 0
+        stack = [dir_path]
+        while stack:
+            path = stack.pop()
+            try:
+                count, size, subdirs = self._scan_dir(path)
+            except OSError as e:
+                self.logger.warning(f"无法访问目录 {path}: {str(e)}")
+                continue
+            file_count += count
+            total_size += size
+            stack.extend(subdirs)
+        return file_count, total_size
+
+    def get_folder_stats(self, folder_path):
+        """获取文件夹统计信息
+
+        Args:
+            folder_path: 文件夹路径
+
+        Returns:
+            tuple: (文件数量, 总大小)
+        """
+        folder_path = os.path.abspath(folder_path)
+        if library_index.covers(folder_path):
+            # 备份库中的文件夹由索引增量维护，无需扫描
+            return library_index.folder_stats(folder_path)
+        try:
+            file_count, total_size, subdirs = self._scan_dir(folder_path)
+        except OSError as e:
+            self.logger.error(f"获取文件夹 {folder_path} 信息时发生错误: {str(e)}")
+            return 0, 0
+
+        if subdirs:
+            # 各子树并发扫描，慢速存储卡上可以重叠目录读取的等待时间
+            workers = min(self.max_workers, len(subdirs))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for count, size in executor.map(self._scan_tree, subdirs):
+                    file_count += count
+                    total_size += size
+
+        return file_count, total_size
+
+    def invalidate(self, folder_path=None):
+        """清除缓存，未指定路径时清除全部"""
+        with self._lock:
+            if folder_path is None:
+                self._cache.clear()
+                return
+            prefix = os.path.join(os.path.abspath(folder_path), '')
+            for path in list(self._cache):
+                if path == prefix[:-1] or path.startswith(prefix):
+                    del self._cache[path]
+
+# 创建全局文件夹统计实例
+folder_stats = FolderStats()
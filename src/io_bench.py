@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+
+from io_trace import io_trace
+from io_tuner import DEFAULT_PROFILE
+from page_cache import memory_footprint
+from file_operations import FileOperations
+
+# 复制基准工具：按随机种子生成合成的源目录（同一组参数每次生成相同的目录结构、大小和内容），
+# 用当前的扫描和复制代码跑一遍，输出文件/秒、MB/s、峰值内存、页面缓存增量和文件表每个文件占用的字节数
+#   python io_bench.py [--profile camera|small|large] [--files N] [--seed N] [--repeat N]
+#                      [--workers N] [--buffer-kb N] [--read-ahead-kb N] [--json 结果文件] [--trace 轨迹文件]
+# 加上 --trace 时把本次运行记录成 I/O 轨迹，可以交给 io_replay.py 按记录的延迟回放对比
+
+# 各文件类型的 (子目录, 扩展名, 最小 KB, 最大 KB, 权重)
+PROFILES = {
+    # 相机存储卡：照片、RAW、视频，加上大量缩略图和附属小文件
+    'camera': [
+        ('DCIM/{group}CANON', '.JPG', 4 * 1024, 12 * 1024, 40),
+        ('DCIM/{group}CANON', '.CR3', 20 * 1024, 40 * 1024, 20),
+        ('DCIM/{group}CANON', '.MP4', 100 * 1024, 400 * 1024, 2),
+        ('DCIM/{group}CANON', '.THM', 8, 64, 20),
+        ('PRIVATE/M4ROOT/CLIP', '.XML', 1, 4, 18),
+    ],
+    # 大量小文件：考察调度和每个文件的固定开销
+    'small': [
+        ('DATA/{group}', '.DAT', 1, 64, 1),
+    ],
+    # 少量大文件：考察缓冲区和流水线
+    'large': [
+        ('DCIM/{group}CLIP', '.MP4', 200 * 1024, 800 * 1024, 1),
+    ],
+}
+DEFAULT_FILES = {'camera': 100, 'small': 20000, 'large': 10}
+FILES_PER_DIR = 999
+BLOCK_SIZE = 1024 * 1024
+
+
+def build_source_tree(root, profile, count, seed):
+    """按随机种子生成源目录，返回 [(相对路径, 大小), ...]"""
+    rng = random.Random(seed)
+    kinds = PROFILES[profile]
+    weights = [kind[4] for kind in kinds]
+    # 内容取自同一块随机数据的不同偏移，不可压缩且可复现
+    block = rng.getrandbits(BLOCK_SIZE * 8).to_bytes(BLOCK_SIZE, 'little')
+    files = []
+    for index in range(count):
+        subdir, ext, min_kb, max_kb, _ = rng.choices(kinds, weights)[0]
+        size = rng.randint(min_kb * 1024, max_kb * 1024)
+        group = 100 + index // FILES_PER_DIR
+        rel_path = f"{subdir.format(group=group)}/F{index:06d}{ext}"
+        full_path = os.path.join(root, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        offset = rng.randrange(BLOCK_SIZE)
+        with open(full_path, 'wb') as f:
+            remaining = size
+            while remaining:
+                chunk = block[offset:offset + remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        files.append((rel_path, size))
+    return files
+
+
+def bench(profile_name, count, seed, profile=None, repeat=1, trace_path=None, work_dir=None):
+    """生成源目录并扫描、复制 repeat 遍，返回结果摘要 dict"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix='camsync-bench-')
+    src_root = os.path.join(work_dir, 'source')
+    dest_root = os.path.join(work_dir, 'dest')
+    try:
+        files = build_source_tree(src_root, profile_name, count, seed)
+        total_bytes = sum(size for _, size in files)
+        file_operations = FileOperations()
+        file_operations.fixed_io_profile = profile
+        if trace_path:
+            io_trace.start(trace_path)
+        runs = []
+        try:
+            for _ in range(repeat):
+                shutil.rmtree(dest_root, ignore_errors=True)
+                scan_start = time.perf_counter()
+                file_table = file_operations.scan_file_table(src_root, dest_root)
+                scan_time = time.perf_counter() - scan_start
+                _, cached_before = memory_footprint()
+                copy_start = time.perf_counter()
+                success, message = file_operations._execute_copy_operation(
+                    file_table.select(range(len(file_table))))
+                copy_time = time.perf_counter() - copy_start
+                peak_rss, cached_after = memory_footprint()
+                runs.append({
+                    'scan_time': scan_time,
+                    'copy_time': copy_time,
+                    'files_per_sec': len(files) / copy_time if copy_time else 0.0,
+                    'mb_per_sec': total_bytes / (1024 * 1024) / copy_time if copy_time else 0.0,
+                    'peak_rss': peak_rss,
+                    'cache_delta': (cached_after - cached_before
+                                    if cached_before is not None and cached_after is not None else None),
+                    'table_bytes_per_file': file_table.memory_usage() / len(file_table) if len(file_table) else 0.0,
+                    'success': success,
+                    'message': message
+                })
+                if not success:
+                    break
+        finally:
+            if trace_path:
+                io_trace.stop()
+        return {
+            'profile': profile_name,
+            'seed': seed,
+            'files': len(files),
+            'bytes': total_bytes,
+            'io_profile': profile,
+            'runs': runs,
+            'success': all(run['success'] for run in runs)
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _format_mb(value):
+    return '未知' if value is None else f"{value / (1024 * 1024):.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用合成的源目录测量 CamSync 扫描和复制的速度与内存')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='camera', help='源目录的文件组成')
+    parser.add_argument('--files', type=int, help='文件数，不指定时按文件组成取默认值')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子，相同的种子生成相同的源目录')
+    parser.add_argument('--repeat', type=int, default=1, help='重复复制的次数，输出各次结果和中位数')
+    parser.add_argument('--workers', type=int, help='复制并发数，不指定时自动试探测量')
+    parser.add_argument('--buffer-kb', type=int, help='复制缓冲区大小（KB）')
+    parser.add_argument('--read-ahead-kb', type=int, help='预读大小（KB）')
+    parser.add_argument('--json', help='把结果写入 JSON 文件，便于比较修改前后的结果')
+    parser.add_argument('--trace', help='把本次运行记录成 I/O 轨迹文件，可用 io_replay.py 回放')
+    args = parser.parse_args(argv)
+
+    profile = None
+    if args.workers or args.buffer_kb or args.read_ahead_kb:
+        profile = dict(DEFAULT_PROFILE)
+        if args.workers:
+            profile['workers'] = args.workers
+        if args.buffer_kb:
+            profile['buffer_size'] = args.buffer_kb * 1024
+        if args.read_ahead_kb:
+            profile['read_ahead'] = args.read_ahead_kb * 1024
+
+    logging.basicConfig(level=logging.WARNING)
+    count = args.files or DEFAULT_FILES[args.profile]
+    result = bench(args.profile, count, args.seed, profile, max(1, args.repeat), args.trace)
+    print(f"源目录: {args.profile}，种子 {args.seed}，文件 {result['files']} 个，共 {_format_mb(result['bytes'])}")
+    for index, run in enumerate(result['runs'], 1):
+        print(f"第 {index} 次: 扫描 {run['scan_time']:.2f} 秒，复制 {run['copy_time']:.2f} 秒"
+              f"（{run['files_per_sec']:.0f} 文件/秒，{run['mb_per_sec']:.1f} MB/s）")
+        print(f"  峰值内存 {_format_mb(run['peak_rss'])}，页面缓存增量 {_format_mb(run['cache_delta'])}，"
+              f"文件表每个文件 {run['table_bytes_per_file']:.0f} 字节")
+        if not run['success']:
+            print(run['message'])
+    if len(result['runs']) > 1:
+        print(f"中位数: {statistics.median(run['files_per_sec'] for run in result['runs']):.0f} 文件/秒，"
+              f"{statistics.median(run['mb_per_sec'] for run in result['runs']):.1f} MB/s")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
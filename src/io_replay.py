@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+from io_trace import io_trace, load_trace, SimulatedDevice
+from io_tuner import DEFAULT_PROFILE
+from file_operations import FileOperations
+
+# 轨迹回放工具：按轨迹重建源目录（稀疏文件，大小与记录一致），挂上按记录延迟模拟的源设备，
+# 再用当前的扫描和复制代码跑一遍，比较调度和复制引擎修改前后的耗时
+#   python io_replay.py <轨迹文件> [--workers N] [--buffer-kb N] [--read-ahead-kb N] [--speed N]
+
+
+def build_source_tree(records, root):
+    """按轨迹中打开过的文件重建源目录，返回按记录顺序排列的文件列表 [(相对路径, 大小), ...]"""
+    files = {}
+    for record in records:
+        if record['op'] == 'open' and record['path'] not in files:
+            files[record['path']] = record['size']
+    for path, size in files.items():
+        full_path = os.path.join(root, *path.split('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.truncate(size)
+    return list(files.items())
+
+
+def recorded_span(records, ops):
+    """轨迹中指定操作从第一次开始到最后一次结束的时间"""
+    spans = [(record['t'] - record['dur'], record['t']) for record in records if record['op'] in ops]
+    if not spans:
+        return 0.0
+    return max(end for _, end in spans) - min(start for start, _ in spans)
+
+
+def replay(trace_path, profile=None, speed=1.0, work_dir=None):
+    """回放轨迹，返回结果摘要 dict"""
+    _, records = load_trace(trace_path)
+    work_dir = work_dir or tempfile.mkdtemp(prefix='camsync-replay-')
+    src_root = os.path.join(work_dir, 'source')
+    dest_root = os.path.join(work_dir, 'dest')
+    try:
+        files = build_source_tree(records, src_root)
+        file_operations = FileOperations()
+        file_operations.fixed_io_profile = profile
+        io_trace.simulate(SimulatedDevice(records, src_root, speed))
+        try:
+            scan_start = time.perf_counter()
+            file_table = file_operations.scan_file_table(src_root, dest_root)
+            scan_time = time.perf_counter() - scan_start
+            items = [(os.path.join(src_root, *path.split('/')), os.path.join(dest_root, *path.split('/')))
+                     for path, _ in files]
+            copy_start = time.perf_counter()
+            success, message = file_operations._execute_copy_operation(items)
+            copy_time = time.perf_counter() - copy_start
+        finally:
+            io_trace.simulate(None)
+        total_bytes = sum(size for _, size in files)
+        return {
+            'files': len(files),
+            'bytes': total_bytes,
+            'scanned': len(file_table),
+            'recorded_scan_time': recorded_span(records, ('list',)),
+            'recorded_copy_time': recorded_span(records, ('open', 'read')),
+            'scan_time': scan_time,
+            'copy_time': copy_time,
+            'success': success,
+            'message': message
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='按记录的延迟回放 CamSync I/O 轨迹')
+    parser.add_argument('trace', help='轨迹文件（.jsonl）')
+    parser.add_argument('--workers', type=int, help='复制并发数，不指定时自动试探测量')
+    parser.add_argument('--buffer-kb', type=int, help='复制缓冲区大小（KB）')
+    parser.add_argument('--read-ahead-kb', type=int, help='预读大小（KB）')
+    parser.add_argument('--speed', type=float, default=1.0, help='延迟缩短倍数，大于 1 时回放更快')
+    args = parser.parse_args(argv)
+
+    profile = None
+    if args.workers or args.buffer_kb or args.read_ahead_kb:
+        profile = dict(DEFAULT_PROFILE)
+        if args.workers:
+            profile['workers'] = args.workers
+        if args.buffer_kb:
+            profile['buffer_size'] = args.buffer_kb * 1024
+        if args.read_ahead_kb:
+            profile['read_ahead'] = args.read_ahead_kb * 1024
+
+    logging.basicConfig(level=logging.WARNING)
+    result = replay(args.trace, profile, args.speed)
+    mb = result['bytes'] / (1024 * 1024)
+    print(f"文件: {result['files']} 个，共 {mb:.1f} MB")
+    print(f"扫描: 记录 {result['recorded_scan_time']:.2f} 秒，回放 {result['scan_time'] * args.speed:.2f} 秒")
+    print(f"复制: 记录 {result['recorded_copy_time']:.2f} 秒，回放 {result['copy_time'] * args.speed:.2f} 秒"
+          f"（{mb / (result['copy_time'] * args.speed) if result['copy_time'] else 0:.1f} MB/s）")
+    if not result['success']:
+        print(result['message'])
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
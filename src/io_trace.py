@@ -0,0 +1,252 @@
+import os
+import hmac
+import json
+import time
+import logging
+import hashlib
+import threading
+from datetime import datetime
+
+# I/O 轨迹文件格式（每行一个 JSON 对象）：
+#   第一行为文件头 {'version', 'started', 'platform'}
+#   其余每行为一次操作 {'t': 相对开始时间（秒）, 'op': 操作, 'path': 匿名路径, 'size': 字节数或目录项数,
+#                       'dur': 耗时（秒）, 'thread': 线程编号}
+# 操作类型：list（列出源目录）、open（打开源文件，size 为文件大小）、read（读取源文件）、
+#           config_read / config_write（读写U盘配置）
+# 路径的每一级名称用本次记录随机生成的密钥做 HMAC 后截断，只保留小写扩展名；
+# 同一条轨迹中相同的名称得到相同的结果，但无法还原出原始名称
+TRACE_VERSION = 1
+
+
+class IOTrace:
+    """I/O 轨迹记录器：记录一次导入过程中源设备和U盘配置的文件系统操作
+
+    设置 simulator 后同一组挂钩改为向模拟设备注入延迟（回放轨迹时使用）
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('CamSync')
+        self.active = False       # 是否需要调用挂钩（正在记录或正在模拟）
+        self.simulator = None
+        self._file = None
+        self._start = 0.0
+        self._salt = b''
+        self._names = {}          # 原始名称 -> 匿名名称
+        self._threads = {}        # 线程标识 -> 线程编号
+        self._lock = threading.Lock()
+
+    def start(self, path):
+        """开始记录到指定文件"""
+        self.stop()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # 按行缓冲，程序异常退出时已记录的操作不会丢失
+            trace_file = open(path, 'w', encoding='utf-8', buffering=1)
+            header = {'version': TRACE_VERSION, 'started': datetime.now().isoformat(timespec='seconds'),
+                      'platform': os.name}
+            trace_file.write(json.dumps(header) + '\n')
+        except OSError as e:
+            self.logger.error(f"无法创建 I/O 轨迹文件: {path}, 错误: {str(e)}")
+            return
+        with self._lock:
+            self._file = trace_file
+            self._start = time.perf_counter()
+            self._salt = os.urandom(16)
+            self._names.clear()
+            self._threads.clear()
+        self.active = True
+        self.logger.info(f"开始记录 I/O 轨迹: {path}")
+
+    def stop(self):
+        """停止记录并关闭轨迹文件"""
+        with self._lock:
+            trace_file = self._file
+            self._file = None
+        self.active = self.simulator is not None
+        if trace_file is not None:
+            trace_file.close()
+
+    def simulate(self, simulator):
+        """设置模拟设备，为 None 时停止模拟"""
+        self.simulator = simulator
+        self.active = simulator is not None or self._file is not None
+
+    def anonymize(self, path):
+        """将路径的每一级名称替换为匿名名称，保留层级和小写扩展名"""
+        path = os.path.splitdrive(path)[1].replace('\\', '/')
+        parts = []
+        for name in path.split('/'):
+            if not name:
+                continue
+            anonymous = self._names.get(name)
+            if anonymous is None:
+                ext = os.path.splitext(name)[1].lower()
+                anonymous = hmac.new(self._salt, name.encode('utf-8'), hashlib.sha1).hexdigest()[:12] + ext
+                self._names[name] = anonymous
+            parts.append(anonymous)
+        return '/'.join(parts)
+
+    def record(self, op, path, size=0, dur=0.0):
+        with self._lock:
+            if self._file is None:
+                return
+            thread = self._threads.setdefault(threading.get_ident(), len(self._threads))
+            entry = {'t': round(time.perf_counter() - self._start, 6), 'op': op, 'path': self.anonymize(path),
+                     'size': size, 'dur': round(dur, 6), 'thread': thread}
+            self._file.write(json.dumps(entry) + '\n')
+
+    def listed(self, path, count, elapsed):
+        """源目录已列出"""
+        if self.simulator:
+            self.simulator.on_list(path)
+        self.record('list', path, count, elapsed)
+
+    def config_io(self, op, path, size, elapsed):
+        """U盘配置已读取或写入"""
+        if self.simulator:
+            self.simulator.on_config(op, path)
+        self.record(op, path, size, elapsed)
+
+    def wrap_source(self, src_file, path, size, open_elapsed):
+        """源文件已打开，返回记录每次读取的包装对象"""
+        if self.simulator:
+            self.simulator.on_open(path)
+        self.record('open', path, size, open_elapsed)
+        return TracedFile(self, src_file, path)
+
+
+class TracedFile:
+    """源文件包装：记录每次读取的字节数和耗时，模拟时注入设备延迟"""
+    def __init__(self, trace, raw, path):
+        self._trace = trace
+        self._raw = raw
+        self._path = path
+
+    def _read_done(self, n, started):
+        elapsed = time.perf_counter() - started
+        if self._trace.simulator:
+            self._trace.simulator.on_read(self._path, n)
+        self._trace.record('read', self._path, n, elapsed)
+
+    def readinto(self, buffer):
+        started = time.perf_counter()
+        n = self._raw.readinto(buffer)
+        self._read_done(n or 0, started)
+        return n
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self._raw.read(size)
+        self._read_done(len(data), started)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._raw.close()
+
+
+def load_trace(path):
+    """读取轨迹文件，返回 (文件头, 操作列表)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('version', 0) > TRACE_VERSION:
+            raise ValueError(f"不支持的轨迹版本: {header.get('version')}")
+        records = [json.loads(line) for line in f if line.strip()]
+    return header, records
+
+
+def _busy_time(intervals):
+    """多个线程的操作时间段的并集长度，即设备实际忙碌的时间"""
+    busy = 0.0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            busy += stop - start
+            end = stop
+        elif stop > end:
+            busy += stop - end
+            end = stop
+    return busy
+
+
+class SimulatedDevice:
+    """按轨迹中记录的延迟模拟源设备
+
+    列目录、打开文件和读写配置按记录的耗时延迟（可以并发）；读取按该文件记录的每字节耗时延迟，
+    并与其他线程的读取串行，模拟读卡器的共享带宽。记录时多个线程并发读取，单次读取的耗时包含
+    排队时间，每字节耗时按设备实际忙碌时间折算。回放路径按 root 之下的相对路径与轨迹中的匿名路径对应
+    """
+    def __init__(self, records, root, speed=1.0):
+        self.root = root
+        self.speed = speed          # 大于 1 时按比例缩短所有延迟
+        self._list = {}
+        self._open = {}
+        self._config = {}
+        self._seconds_per_byte = {}
+        self._device_lock = threading.Lock()
+        self._debt = threading.local()
+
+        read_bytes = {}
+        read_time = {}
+        intervals = []
+        for record in records:
+            op, path, dur = record['op'], record['path'], record['dur']
+            if op == 'list':
+                self._list[path] = dur
+            elif op == 'open':
+                self._open[path] = dur
+            elif op == 'read':
+                read_bytes[path] = read_bytes.get(path, 0) + record['size']
+                read_time[path] = read_time.get(path, 0.0) + dur
+                intervals.append((record['t'] - dur, record['t']))
+            elif op in ('config_read', 'config_write'):
+                self._config.setdefault(op, []).append(dur)
+        total_bytes = sum(read_bytes.values())
+        total_time = sum(read_time.values())
+        scale = _busy_time(intervals) / total_time if total_time else 1.0
+        for path, nbytes in read_bytes.items():
+            if nbytes:
+                self._seconds_per_byte[path] = read_time[path] * scale / nbytes
+        self.default_seconds_per_byte = _busy_time(intervals) / total_bytes if total_bytes else 0.0
+        self.default_list = _median(list(self._list.values()))
+        self.default_open = _median(list(self._open.values()))
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _sleep(self, seconds):
+        # time.sleep 精度有限，不足 2 毫秒的延迟累积到下一次
+        debt = getattr(self._debt, 'seconds', 0.0) + seconds / self.speed
+        if debt >= 0.002:
+            time.sleep(debt)
+            debt = 0.0
+        self._debt.seconds = debt
+
+    def on_list(self, path):
+        self._sleep(self._list.get(self._key(path), self.default_list))
+
+    def on_open(self, path):
+        self._sleep(self._open.get(self._key(path), self.default_open))
+
+    def on_read(self, path, nbytes):
+        seconds = nbytes * self._seconds_per_byte.get(self._key(path), self.default_seconds_per_byte)
+        with self._device_lock:
+            self._sleep(seconds)
+
+    def on_config(self, op, path):
+        self._sleep(_median(self._config.get(op, [])))
+
+
+def _median(values):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+# 全局 I/O 轨迹实例
+io_trace = IOTrace()
@@ -0,0 +1,116 @@
+import os
+import logging
+
+# 默认 I/O 配置，试探阶段和无法测量时使用
+DEFAULT_PROFILE = {
+    'buffer_size': 1024 * 1024,
+    'workers': 1,
+    'read_ahead': 4 * 1024 * 1024
+}
+
+# 吞吐量分档：(吞吐量上限 字节/秒, 缓冲区大小, 并发数, 预读大小)
+PROFILE_TIERS = [
+    (40 * 1024 * 1024, 1024 * 1024, 1, 4 * 1024 * 1024),             # USB 2.0 读卡器
+    (150 * 1024 * 1024, 4 * 1024 * 1024, 2, 16 * 1024 * 1024),       # USB 3.0 SD 读卡器
+    (600 * 1024 * 1024, 8 * 1024 * 1024, 4, 64 * 1024 * 1024),       # UHS-II / CFast
+    (float('inf'), 16 * 1024 * 1024, 4, 128 * 1024 * 1024)           # CFexpress
+]
+
+# 单文件访问延迟超过此值时增加并发，用于掩盖小文件的寻址开销（秒）
+HIGH_LATENCY = 0.005
+MAX_WORKERS = 8
+
+
+class IOTuner:
+    """I/O 参数自动调优器，根据任务开始阶段测得的读取吞吐量和延迟选择复制参数"""
+    def __init__(self, probe_seconds=3.0, probe_bytes=256 * 1024 * 1024, min_bytes=8 * 1024 * 1024,
+                 probe_files=512):
+        self.logger = logging.getLogger('CamSync')
+        self.probe_seconds = probe_seconds  # 试探阶段最长读取时间
+        self.probe_bytes = probe_bytes      # 试探阶段最多读取字节数
+        self.min_bytes = min_bytes          # 得出可靠结果所需的最少字节数
+        self.probe_files = probe_files      # 试探阶段最多复制的文件数
+        self.read_bytes = 0
+        self.read_time = 0.0
+        self.file_count = 0
+        self.latency_total = 0.0
+        self.items = 0                      # 试探阶段取出的文件数和总大小（含读取失败的文件）
+        self.item_bytes = 0
+
+    def record_file(self, latency):
+        """记录单个文件的访问延迟（打开到读到首个数据块）"""
+        self.file_count += 1
+        self.latency_total += latency
+
+    def record_item(self, size):
+        """记录试探阶段取出的一个文件"""
+        self.items += 1
+        self.item_bytes += size
+
+    def record_read(self, nbytes, elapsed):
+        """记录一次读取的字节数和耗时"""
+        self.read_bytes += nbytes
+        self.read_time += elapsed
+
+    def is_probe_done(self):
+        """试探阶段是否结束：读取时间、字节数或文件数任一达到上限"""
+        return (self.read_time >= self.probe_seconds or self.read_bytes >= self.probe_bytes or
+                self.items >= self.probe_files or self.item_bytes >= self.probe_bytes)
+
+    def throughput(self):
+        """测得的读取吞吐量（字节/秒）"""
+        if self.read_time <= 0:
+            return 0.0
+        return self.read_bytes / self.read_time
+
+    def average_latency(self):
+        """测得的平均单文件访问延迟（秒）"""
+        if not self.file_count:
+            return 0.0
+        return self.latency_total / self.file_count
+
+    def choose_profile(self):
+        """根据测量结果选择 I/O 配置
+
+        Returns:
+            dict: I/O 配置，样本不足时返回 None
+        """
+        if self.read_bytes < self.min_bytes:
+            return None
+
+        throughput = self.throughput()
+        latency = self.average_latency()
+        for max_throughput, buffer_size, workers, read_ahead in PROFILE_TIERS:
+            if throughput < max_throughput:
+                break
+
+        # 访问延迟高时，多个并发读取可以重叠等待时间
+        if latency > HIGH_LATENCY:
+            workers = min(workers * 2, MAX_WORKERS)
+
+        profile = {
+            'buffer_size': buffer_size,
+            'workers': workers,
+            'read_ahead': read_ahead,
+            'throughput': round(throughput),
+            'latency': round(latency, 6)
+        }
+        self.logger.info(f"I/O 调优结果: 吞吐量 {throughput / 1024 / 1024:.1f} MB/s, "
+                         f"延迟 {latency * 1000:.2f} ms, 缓冲区 {buffer_size // 1024} KB, "
+                         f"并发 {workers}, 预读 {read_ahead // 1024 // 1024} MB")
+        return profile
+
+
+def open_sequential(path, flags):
+    """以顺序读取方式打开文件（用作 open 的 opener 参数）"""
+    # Windows 上 O_SEQUENTIAL 提示系统缓存按顺序访问优化
+    return os.open(path, flags | getattr(os, 'O_SEQUENTIAL', 0))
+
+
+def advise_read_ahead(fd, offset, length):
+    """提示操作系统预读指定范围，不支持的平台上忽略"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
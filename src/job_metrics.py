@@ -0,0 +1,92 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# 超过此时间（秒）没有任何进展的进行中任务视为停滞（读卡器无响应或目标磁盘阻塞）；
+# 扫描目录、同步到磁盘和后台模式下的让出等待都算作进展，不会被误报
+STALL_SECONDS = 10.0
+
+
+class JobMetrics:
+    """一次复制任务的计数器
+
+    复制线程只累加计数，不发送信号；仪表盘按固定的低频率调用 snapshot() 读取，
+    每个数据块的额外开销只是一次加锁累加
+    """
+    def __init__(self, name='', volume_id=None):
+        self.name = name
+        self.volume_id = volume_id
+        self.started = time.monotonic()
+        self.finished = None
+        self.success = None
+        self.total_files = 0
+        self.completed_files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.eta = None             # 按历史速度校准的剩余时间（秒），未知时为 None
+        self.queue_depth = None     # 返回等待复制的文件数的函数（流式复制的扫描队列）
+        self._last_activity = self.started
+        self._waiting = 0           # 正在有意等待（同步到磁盘、后台模式让出）的线程数
+        self._lock = threading.Lock()
+
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.bytes += nbytes
+            self._last_activity = time.monotonic()
+
+    def touch(self):
+        """记录一次没有读取数据的进展（扫描目录、比较文件）"""
+        with self._lock:
+            self._last_activity = time.monotonic()
+
+    @contextmanager
+    def waiting(self):
+        """有意的等待（同步到磁盘、后台模式让出线程或限速），期间不判为停滞"""
+        with self._lock:
+            self._waiting += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                self._last_activity = time.monotonic()
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def progress(self, completed, total, eta=None):
+        with self._lock:
+            self.completed_files = completed
+            self.total_files = total
+            self.eta = eta
+            self._last_activity = time.monotonic()
+
+    def finish(self, success):
+        with self._lock:
+            self.finished = time.monotonic()
+            self.success = success
+
+    def snapshot(self):
+        """当前计数的副本"""
+        now = time.monotonic()
+        with self._lock:
+            if self.queue_depth is not None and self.finished is None:
+                queued = self.queue_depth()
+            else:
+                queued = max(0, self.total_files - self.completed_files)
+            return {
+                'name': self.name,
+                'volume_id': self.volume_id,
+                'elapsed': (self.finished or now) - self.started,
+                'running': self.finished is None,
+                'success': self.success,
+                'total_files': self.total_files,
+                'completed_files': self.completed_files,
+                'queued': queued,
+                'bytes': self.bytes,
+                'errors': self.errors,
+                'eta': self.eta,
+                'stalled': (self.finished is None and not self._waiting and
+                            now - self._last_activity > STALL_SECONDS)
+            }
@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import stat
+import errno
+import select
+import struct
+import logging
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# 备份库索引：在 Linux 上用 inotify 监视备份路径，照片管理和剪辑软件在库中重命名、移动或删除文件时
+# 增量更新索引中的文件大小/修改时间和各目录的统计，增量备份判断目标文件是否存在时直接查索引，
+# 不再逐个 stat 或重新遍历整个备份路径
+
+# inotify 事件（见 <sys/inotify.h>）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+EVENT_BUFFER_SIZE = 64 * 1024
+# 检查停止请求的间隔（秒）
+POLL_INTERVAL = 0.5
+
+
+def _load_libc():
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class WatchLimitError(OSError):
+    """inotify 监视数量达到上限（fs.inotify.max_user_watches）"""
+
+
+class LibraryIndex:
+    """备份路径的文件索引
+
+    目录路径 -> {'mtime': 目录修改时间(ns), 'files': {文件名: (大小, 修改时间)}, 'dirs': {子目录名},
+    'size': 直接文件总大小}。启动时载入上次保存的快照，只重新列出修改时间变化的目录（每个目录一次 stat），
+    之后由后台线程处理 inotify 事件；索引就绪之前或不支持 inotify 时 covers() 返回 False，调用方照常查询文件系统
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('CamSync')
+        self.root = None
+        self.ready = False
+        self._snapshot_path = None
+        self._dirs = {}
+        self._wds = {}      # 监视描述符 -> 目录路径
+        self._dir_wds = {}  # 目录路径 -> 监视描述符
+        self._scanning = set()  # 正在锁外扫描的移入子树，扫描完成前不由索引回答
+        self._fd = -1
+        self._libc = _load_libc()
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def supported(self):
+        return self._libc is not None
+
+    def start(self, root, snapshot_path):
+        """开始监视备份路径（已在监视其他路径时先停止）"""
+        self.stop()
+        if not root or not self.supported:
+            return
+        self.root = os.path.abspath(root)
+        self._snapshot_path = snapshot_path
+        # 每个监视线程使用自己的停止事件
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,), name='LibraryIndex', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止监视，处理完已到达的事件后保存快照"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, stop_event):
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            self.logger.warning(f"无法初始化 inotify，备份库索引已停用: {os.strerror(ctypes.get_errno())}")
+            return
+        self._fd = fd
+        try:
+            self._load_snapshot()
+            self._reconcile()
+            self._save_snapshot()
+            self.ready = True
+            while not stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], POLL_INTERVAL)
+                if readable:
+                    self._read_events()
+            # 退出前处理已到达的事件，保证快照中的目录修改时间与内容一致
+            self._read_events()
+            self._save_snapshot()
+        except WatchLimitError as e:
+            self.logger.warning(f"inotify 监视数量达到上限（可调大 fs.inotify.max_user_watches），"
+                                f"备份库索引已停用: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"监视备份库时发生错误，备份库索引已停用: {str(e)}")
+        finally:
+            self.ready = False
+            with self._lock:
+                self._dirs = {}
+                self._wds = {}
+                self._dir_wds = {}
+            self._fd = -1
+            os.close(fd)
+
+    def _watch(self, directory):
+        """监视目录（同一 inode 重复监视时返回同一个描述符）"""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchLimitError(error, os.strerror(error), directory)
+            # 目录已被删除或无权访问，由父目录的事件处理
+            return
+        with self._lock:
+            self._wds[wd] = directory
+            self._dir_wds[directory] = wd
+
+    def _unwatch(self, directory):
+        wd = self._dir_wds.pop(directory, None)
+        if wd is not None:
+            self._wds.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _list_dir(self, directory, dir_mtime):
+        files = {}
+        subdirs = set()
+        total = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.name)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        files[entry.name] = (st.st_size, st.st_mtime)
+                        total += st.st_size
+                except OSError:
+                    continue
+        entry = {'mtime': dir_mtime, 'files': files, 'dirs': subdirs, 'size': total}
+        with self._lock:
+            self._dirs[directory] = entry
+        return entry
+
+    def _scan_tree(self, top, known=None):
+        """监视并索引一个子树；known 为已有的索引时只重新列出修改时间变化的目录
+
+        Returns:
+            tuple: (子树中的目录集合, 重新列出的目录数)
+        """
+        seen = set()
+        rescanned = 0
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime_ns
+                # 先监视再列出，列出期间的变化会作为事件到达
+                self._watch(directory)
+                entry = known.get(directory) if known else None
+                if entry is None or entry['mtime'] != dir_mtime:
+                    entry = self._list_dir(directory, dir_mtime)
+                    rescanned += 1
+                else:
+                    with self._lock:
+                        self._dirs[directory] = entry
+            except WatchLimitError:
+                raise
+            except OSError:
+                continue
+            seen.add(directory)
+            stack.extend(os.path.join(directory, name) for name in entry['dirs'])
+        return seen, rescanned
+
+    def _reconcile(self):
+        """从根目录逐层比较目录修改时间，只重新列出变化的目录，并移除已不存在的目录"""
+        with self._lock:
+            known = dict(self._dirs)
+        seen, rescanned = self._scan_tree(self.root, known)
+        with self._lock:
+            for directory in list(self._dirs):
+                if directory not in seen:
+                    del self._dirs[directory]
+                    self._unwatch(directory)
+            file_count = sum(len(entry['files']) for entry in self._dirs.values())
+        self.logger.info(f"备份库索引已就绪: {self.root}，{len(seen)} 个目录（重新列出 {rescanned} 个），"
+                         f"{file_count} 个文件")
+
+    def _drop_tree(self, top):
+        prefix = os.path.join(top, '')
+        with self._lock:
+            for directory in list(self._dirs):
+                if directory == top or directory.startswith(prefix):
+                    del self._dirs[directory]
+                    self._unwatch(directory)
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._apply(wd, mask, name)
+
+    def _apply(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # 事件队列溢出，丢失的变化无法得知，按目录修改时间重新核对
+            self.logger.warning("备份库事件队列溢出，重新核对索引")
+            self._reconcile()
+            return
+        scan_path = self._apply_locked(wd, mask, name)
+        if scan_path is None:
+            return
+        # 移入的子树可能很大，在锁外扫描，复制线程的查询不会被阻塞
+        try:
+            self._scan_tree(scan_path)
+        finally:
+            with self._lock:
+                self._scanning.discard(scan_path)
+
+    def _apply_locked(self, wd, mask, name):
+        """在锁内更新索引，新建或移入子目录时返回需要扫描的路径"""
+        with self._lock:
+            directory = self._wds.get(wd)
+            if directory is None:
+                return
+            if mask & IN_IGNORED:
+                # 监视已被移除（目录删除或所在文件系统卸载）
+                self._wds.pop(wd, None)
+                if self._dir_wds.get(directory) == wd:
+                    del self._dir_wds[directory]
+                return
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if directory == self.root:
+                    self.logger.warning(f"备份路径已被删除或移动: {self.root}")
+                    self._drop_tree(self.root)
+                # 子目录的删除和移动由父目录的事件处理
+                return
+            entry = self._dirs.get(directory)
+            if entry is None:
+                return
+            path = os.path.join(directory, name)
+            scan_path = None
+            if mask & IN_ISDIR:
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    entry['dirs'].discard(name)
+                    self._drop_tree(path)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    entry['dirs'].add(name)
+                    self._scanning.add(path)
+                    scan_path = path
+            else:
+                old = entry['files'].pop(name, None)
+                if old:
+                    entry['size'] -= old[0]
+                if not mask & (IN_DELETE | IN_MOVED_FROM):
+                    try:
+                        st = os.stat(path, follow_symlinks=False)
+                    except OSError:
+                        st = None
+                    if st is not None and stat.S_ISREG(st.st_mode):
+                        entry['files'][name] = (st.st_size, st.st_mtime)
+                        entry['size'] += st.st_size
+            try:
+                entry['mtime'] = os.stat(directory).st_mtime_ns
+            except OSError:
+                pass
+            return scan_path
+
+    def covers(self, path):
+        """路径是否位于已就绪的索引范围内（正在扫描的移入子树除外）"""
+        if not self.ready:
+            return False
+        path = os.path.abspath(path)
+        if not (path == self.root or path.startswith(os.path.join(self.root, ''))):
+            return False
+        if self._scanning:
+            with self._lock:
+                return not any(path == top or path.startswith(os.path.join(top, '')) for top in self._scanning)
+        return True
+
+    def stat(self, path):
+        """获取文件的 (大小, 修改时间)，不存在时返回 None；只能用于 covers() 为 True 的路径"""
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            entry = self._dirs.get(directory)
+            return entry['files'].get(name) if entry else None
+
+    def files_under(self, top):
+        """子树中的所有文件 {相对路径: (大小, 修改时间)}"""
+        top = os.path.abspath(top)
+        prefix = os.path.join(top, '')
+        result = {}
+        with self._lock:
+            for directory, entry in self._dirs.items():
+                if directory == top or directory.startswith(prefix):
+                    rel_dir = os.path.relpath(directory, top)
+                    for name, value in entry['files'].items():
+                        result[os.path.normpath(os.path.join(rel_dir, name))] = value
+        return result
+
+    def folder_stats(self, top):
+        """子树的 (文件数量, 总大小)"""
+        top = os.path.abspath(top)
+        prefix = os.path.join(top, '')
+        file_count = 0
+        total_size = 0
+        with self._lock:
+            for directory, entry in self._dirs.items():
+                if directory == top or directory.startswith(prefix):
+                    file_count += len(entry['files'])
+                    total_size += entry['size']
+        return file_count, total_size
+
+    def _load_snapshot(self):
+        self._dirs = {}
+        if not self._snapshot_path or not os.path.exists(self._snapshot_path):
+            return
+        try:
+            with open(self._snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('root') != self.root:
+                return
+            for rel_dir, (dir_mtime, files, subdirs) in snapshot['dirs'].items():
+                files = {name: tuple(value) for name, value in files.items()}
+                self._dirs[os.path.normpath(os.path.join(self.root, rel_dir))] = {
+                    'mtime': dir_mtime, 'files': files, 'dirs': set(subdirs),
+                    'size': sum(size for size, _ in files.values())
+                }
+        except Exception as e:
+            self.logger.error(f"加载备份库索引快照时发生错误: {str(e)}")
+            self._dirs = {}
+
+    def _save_snapshot(self):
+        if not self._snapshot_path:
+            return
+        with self._lock:
+            dirs = {os.path.relpath(directory, self.root): [entry['mtime'], entry['files'], sorted(entry['dirs'])]
+                    for directory, entry in self._dirs.items()}
+        try:
+            with open(self._snapshot_path, 'w', encoding='utf-8') as f:
+                json.dump({'root': self.root, 'dirs': dirs}, f)
+        except Exception as e:
+            self.logger.error(f"保存备份库索引快照时发生错误: {str(e)}")
+
+
+# 全局备份库索引实例
+library_index = LibraryIndex()
@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import threading
+import psutil
+
+try:
+    import win32api
+except ImportError:
+    win32api = None
+
+# 后台模式：程序最小化到托盘时降低进程的 CPU 和 I/O 优先级，并按系统负载调整复制的并发数和带宽，
+# 避免与同一台机器上的修图、剪辑软件争抢资源；系统空闲时逐步恢复全速
+
+# 负载采样间隔（秒）
+SAMPLE_INTERVAL = 1.0
+# 其他进程的 CPU 占用超过此值（%）视为繁忙，低于 CPU_IDLE 视为空闲
+CPU_BUSY = 50.0
+CPU_IDLE = 20.0
+# 有人操作电脑（前台活动）时磁盘忙碌时间超过此值（%）视为磁盘争用
+DISK_BUSY = 60.0
+# 距上次键盘鼠标输入不足此时间（秒）视为前台活动
+FOREGROUND_IDLE = 30.0
+# 速度等级：繁忙时减半，空闲时每次采样增加 RAMP_STEP，最低 MIN_LEVEL
+MIN_LEVEL = 0.125
+RAMP_STEP = 0.25
+# 限速时允许的突发数据量（秒）和最低带宽（字节/秒）
+BURST_SECONDS = 0.5
+MIN_RATE = 1024 * 1024
+
+
+class LoadGovernor:
+    """后台模式的负载调节器
+
+    后台模式下由采样线程按 CPU、磁盘忙碌时间和前台活动计算速度等级（0~1），复制线程据此
+    限制同时工作的线程数（wait_turn）和读取带宽（throttle）；前台模式下两者都直接返回
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('CamSync')
+        self.background = False
+        self.level = 1.0           # 速度等级，1 表示全速
+        self._full_rate = 0.0      # 全速时测得的复制带宽（字节/秒），未测得时不限带宽
+        self._rate = 0.0           # 当前带宽上限，0 表示不限
+        self._allowance = 0.0      # 令牌桶中剩余的字节数，可以为负（已透支）
+        self._stamp = time.monotonic()
+        self._copied_bytes = 0     # 本采样周期内读取的字节数
+        self._saved_priority = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._process = psutil.Process()
+
+    def set_background(self, enabled):
+        """进入或退出后台模式"""
+        if enabled == self.background:
+            return
+        self.background = enabled
+        if enabled:
+            self._lower_priority()
+            # 每个采样线程使用自己的停止事件，快速切换时旧线程不会继续运行
+            self._stop_event = threading.Event()
+            # 预热 cpu_percent 和磁盘计数器，第一次调用只建立基准
+            psutil.cpu_percent(None)
+            self._process.cpu_percent(None)
+            self._thread = threading.Thread(target=self._sample_loop, args=(self._stop_event,), name='LoadGovernor',
+                                            daemon=True)
+            self._thread.start()
+            self.logger.info("已进入后台模式：降低优先级，按系统负载调整复制速度")
+        else:
+            self._stop_event.set()
+            self._thread = None
+            with self._lock:
+                self.level = 1.0
+                self._rate = 0.0
+            self._restore_priority()
+            self.logger.info("已退出后台模式，恢复全速复制")
+
+    def _lower_priority(self):
+        try:
+            self._saved_priority = (self._process.nice(), self._process.ionice())
+        except (psutil.Error, AttributeError, OSError) as e:
+            self.logger.warning(f"读取进程优先级失败: {str(e)}")
+            self._saved_priority = None
+            return
+        try:
+            if os.name == 'nt':
+                self._process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+                self._process.ionice(psutil.IOPRIO_LOW)
+            else:
+                self._process.nice(10)
+                # 尽力而为类中的最低优先级；空闲类在持续负载下可能完全停止复制
+                self._process.ionice(psutil.IOPRIO_CLASS_BE, 7)
+        except (psutil.Error, AttributeError, OSError) as e:
+            self.logger.warning(f"降低进程优先级失败: {str(e)}")
+
+    def _restore_priority(self):
+        if self._saved_priority is None:
+            return
+        nice, ionice = self._saved_priority
+        self._saved_priority = None
+        try:
+            if os.name == 'nt':
+                self._process.ionice(ionice)
+            else:
+                self._process.ionice(ionice.ioclass, ionice.value)
+            self._process.nice(nice)
+        except (psutil.Error, OSError) as e:
+            # Linux 上普通用户无法调回更高的 nice 值，保持降低后的优先级
+            self.logger.warning(f"恢复进程优先级失败: {str(e)}")
+
+    def _foreground_active(self):
+        """是否有人正在操作电脑，无法判断时返回 None"""
+        if win32api is None:
+            return None
+        try:
+            idle_ms = (win32api.GetTickCount() - win32api.GetLastInputInfo()) & 0xFFFFFFFF
+        except Exception:
+            return None
+        return idle_ms < FOREGROUND_IDLE * 1000
+
+    @staticmethod
+    def _disk_busy_ms():
+        """所有磁盘累计的忙碌时间（毫秒），Windows 上没有 busy_time，用读写耗时之和近似"""
+        counters = psutil.disk_io_counters()
+        if counters is None:
+            return None
+        busy = getattr(counters, 'busy_time', None)
+        if busy is None:
+            busy = counters.read_time + counters.write_time
+        return busy
+
+    def _sample_loop(self, stop_event):
+        cpu_count = psutil.cpu_count() or 1
+        last_busy = self._disk_busy_ms()
+        last_time = time.monotonic()
+        while not stop_event.wait(SAMPLE_INTERVAL):
+            try:
+                now = time.monotonic()
+                elapsed = now - last_time
+                last_time = now
+                # 其他进程的 CPU 占用：系统总占用减去本进程（本进程的值按单核计算）
+                other_cpu = max(0.0, psutil.cpu_percent(None) - self._process.cpu_percent(None) / cpu_count)
+                busy = self._disk_busy_ms()
+                disk_busy = 0.0
+                if busy is not None and last_busy is not None and elapsed > 0:
+                    disk_busy = min(100.0, (busy - last_busy) / (elapsed * 10))
+                last_busy = busy
+                self._update(other_cpu, disk_busy, self._foreground_active(), elapsed)
+            except Exception as e:
+                self.logger.error(f"采样系统负载时发生错误: {str(e)}")
+
+    def _update(self, other_cpu, disk_busy, foreground, elapsed):
+        # 磁盘忙碌可能完全来自本程序的复制，只有其他程序也在工作时才算争用
+        contended_disk = disk_busy >= DISK_BUSY and (foreground or (foreground is None and other_cpu >= CPU_IDLE))
+        with self._lock:
+            copied = self._copied_bytes
+            self._copied_bytes = 0
+            if self.level >= 1.0 and copied and elapsed > 0:
+                # 全速时跟踪复制带宽，作为限速的基准；缓慢衰减以适应换卡或换目标
+                self._full_rate = max(copied / elapsed, self._full_rate * 0.9)
+            level = self.level
+            if other_cpu >= CPU_BUSY or contended_disk:
+                level = max(MIN_LEVEL, level / 2)
+            elif other_cpu < CPU_IDLE and not foreground:
+                level = min(1.0, level + RAMP_STEP)
+            if level != self.level:
+                self.logger.debug(f"后台速度等级 {self.level:.3f} -> {level:.3f}（其他进程 CPU {other_cpu:.0f}%，"
+                                  f"磁盘忙碌 {disk_busy:.0f}%，前台活动 {foreground}）")
+            self.level = level
+            self._rate = 0.0 if level >= 1.0 or not self._full_rate else max(MIN_RATE, self._full_rate * level)
+
+    def allowed_workers(self, workers):
+        """当前允许同时复制的线程数"""
+        if not self.background:
+            return workers
+        return max(1, int(workers * self.level + 0.5))
+
+    def wait_turn(self, index, workers, done_event):
+        """第 index 个复制线程在超出允许的线程数时等待，直到负载下降或所有文件已取出"""
+        while index >= self.allowed_workers(workers) and not done_event.is_set():
+            done_event.wait(SAMPLE_INTERVAL / 2)
+
+    def throttle(self, nbytes):
+        """记录读取的字节数，后台限速时按令牌桶等待"""
+        if not self.background:
+            return
+        with self._lock:
+            self._copied_bytes += nbytes
+            rate = self._rate
+            now = time.monotonic()
+            if not rate:
+                self._stamp = now
+                return
+            self._allowance = min(rate * BURST_SECONDS, self._allowance + (now - self._stamp) * rate) - nbytes
+            self._stamp = now
+            delay = -self._allowance / rate if self._allowance < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+
+
+# 全局负载调节器实例
+load_governor = LoadGovernor()
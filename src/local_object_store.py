@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import hmac
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from object_store import sign_v4
+
+# 本地对象存储替身：实现 CamSync 用到的 S3 接口子集（PUT/HEAD/GET 对象、分块上传、ListObjectsV2），
+# 对象按键保存为本地文件，用于在没有外部服务的情况下测试对象存储目标；指定访问密钥时按 AWS 签名 V4 校验请求
+#   python local_object_store.py <数据目录> [端口] [access_key secret_key]
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+AUTHORIZATION_PATTERN = re.compile(r'AWS4-HMAC-SHA256 Credential=(?P<access_key>[^/]+)/\d{8}/(?P<region>[^/]+)/s3/aws4_request, '
+                                   r'SignedHeaders=(?P<signed>[^,]+), Signature=(?P<signature>[0-9a-f]+)$')
+
+
+class LocalObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.getLogger('CamSync').debug("对象存储替身: " + format % args)
+
+    def _parse(self):
+        parsed = urlparse(self.path)
+        bucket, _, key = unquote(parsed.path).lstrip('/').partition('/')
+        params = {name: values[0] for name, values in parse_qs(parsed.query, keep_blank_values=True).items()}
+        return bucket, key, params
+
+    def _object_path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.server.root, bucket, key))
+        if not path.startswith(os.path.join(self.server.root, bucket)):
+            raise ValueError("非法的对象键")
+        return path
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _authorized(self, body=b''):
+        """服务器配置了访问密钥时校验请求的签名和内容哈希，未配置时不校验"""
+        if not self.server.access_key:
+            return True
+        match = AUTHORIZATION_PATTERN.match(self.headers.get('Authorization', ''))
+        if not match or match.group('access_key') != self.server.access_key:
+            return False
+        payload_hash = self.headers.get('x-amz-content-sha256', '')
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        signed = match.group('signed')
+        canonical_headers = ''.join(f"{name}:{self.headers.get(name, '').strip()}\n" for name in signed.split(';'))
+        path, _, query = self.path.partition('?')
+        canonical_request = '\n'.join([self.command, path, query, canonical_headers, signed, payload_hash])
+        _, signature = sign_v4(self.server.secret_key, match.group('region'), self.headers.get('x-amz-date', ''),
+                               canonical_request)
+        return hmac.compare_digest(signature, match.group('signature'))
+
+    def _send_denied(self):
+        root = ET.Element('Error')
+        ET.SubElement(root, 'Code').text = 'SignatureDoesNotMatch'
+        self._send(403, ET.tostring(root, encoding='utf-8'), {'Content-Type': 'application/xml'})
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_xml(self, root):
+        self._send(200, ET.tostring(root, encoding='utf-8'), {'Content-Type': 'application/xml'})
+
+    def _write_object(self, path, chunks, metadata):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        digest = hashlib.md5()
+        with open(temp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(temp_path, path)
+        with self.server.lock:
+            self.server.metadata[path] = metadata
+        return digest.hexdigest()
+
+    def _metadata_headers(self):
+        return {name: value for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-')}
+
+    def do_PUT(self):
+        bucket, key, params = self._parse()
+        body = self._read_body()
+        if not self._authorized(body):
+            return self._send_denied()
+        if 'uploadId' in params:
+            upload_dir = os.path.join(self.server.uploads, params['uploadId'])
+            if not os.path.isdir(upload_dir):
+                return self._send(404)
+            with open(os.path.join(upload_dir, f"{int(params['partNumber']):05d}"), 'wb') as f:
+                f.write(body)
+            return self._send(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+        etag = self._write_object(self._object_path(bucket, key), [body], self._metadata_headers())
+        self._send(200, headers={'ETag': f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, params = self._parse()
+        if not self._authorized(self._read_body()):
+            return self._send_denied()
+        if 'uploads' in params:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(os.path.join(self.server.uploads, upload_id))
+            with self.server.lock:
+                self.server.pending[upload_id] = self._metadata_headers()
+            root = ET.Element('InitiateMultipartUploadResult', xmlns=S3_NAMESPACE)
+            ET.SubElement(root, 'Bucket').text = bucket
+            ET.SubElement(root, 'Key').text = key
+            ET.SubElement(root, 'UploadId').text = upload_id
+            return self._send_xml(root)
+        if 'uploadId' in params:
+            upload_dir = os.path.join(self.server.uploads, params['uploadId'])
+            if not os.path.isdir(upload_dir):
+                return self._send(404)
+
+            def chunks():
+                for name in sorted(os.listdir(upload_dir)):
+                    with open(os.path.join(upload_dir, name), 'rb') as f:
+                        yield f.read()
+
+            with self.server.lock:
+                metadata = self.server.pending.pop(params['uploadId'], {})
+            etag = self._write_object(self._object_path(bucket, key), chunks(), metadata)
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            root = ET.Element('CompleteMultipartUploadResult', xmlns=S3_NAMESPACE)
+            ET.SubElement(root, 'Key').text = key
+            ET.SubElement(root, 'ETag').text = f'"{etag}"'
+            return self._send_xml(root)
+        self._send(400)
+
+    def do_DELETE(self):
+        bucket, key, params = self._parse()
+        if not self._authorized():
+            return self._send_denied()
+        if 'uploadId' in params:
+            shutil.rmtree(os.path.join(self.server.uploads, params['uploadId']), ignore_errors=True)
+            with self.server.lock:
+                self.server.pending.pop(params['uploadId'], None)
+            return self._send(204)
+        path = self._object_path(bucket, key)
+        if os.path.isfile(path):
+            os.remove(path)
+        self._send(204)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        bucket, key, params = self._parse()
+        if not self._authorized():
+            return self._send_denied()
+        if not key and params.get('list-type') == '2':
+            return self._list(bucket, params.get('prefix', ''), params.get('delimiter', ''))
+        path = self._object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self._send(404)
+        with open(path, 'rb') as f:
+            body = f.read()
+        with self.server.lock:
+            headers = dict(self.server.metadata.get(path, {}))
+        self._send(200, body, headers)
+
+    def _list(self, bucket, prefix, delimiter):
+        root = ET.Element('ListBucketResult', xmlns=S3_NAMESPACE)
+        ET.SubElement(root, 'Name').text = bucket
+        ET.SubElement(root, 'Prefix').text = prefix
+        ET.SubElement(root, 'IsTruncated').text = 'false'
+        bucket_dir = os.path.join(self.server.root, bucket)
+        directory = os.path.join(bucket_dir, *prefix.rstrip('/').split('/')) if prefix.rstrip('/') else bucket_dir
+        if delimiter == '/' and (not prefix or prefix.endswith('/')) and os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    if entry.is_dir():
+                        prefix_element = ET.SubElement(root, 'CommonPrefixes')
+                        ET.SubElement(prefix_element, 'Prefix').text = prefix + entry.name + '/'
+                        continue
+                    st = entry.stat()
+                    content = ET.SubElement(root, 'Contents')
+                    ET.SubElement(content, 'Key').text = prefix + entry.name
+                    ET.SubElement(content, 'Size').text = str(st.st_size)
+                    modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+                    ET.SubElement(content, 'LastModified').text = modified.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        self._send_xml(root)
+
+
+class LocalObjectStoreServer(ThreadingHTTPServer):
+    """本地对象存储替身服务器"""
+    daemon_threads = True
+
+    def __init__(self, root, host='127.0.0.1', port=0, access_key='', secret_key=''):
+        super().__init__((host, port), LocalObjectStoreHandler)
+        self.root = os.path.abspath(root)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.uploads = os.path.join(self.root, '.uploads')
+        os.makedirs(self.uploads, exist_ok=True)
+        self.metadata = {}  # 对象路径 -> x-amz-meta-* 头
+        self.pending = {}   # 分块上传 ID -> x-amz-meta-* 头
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        """在后台线程中运行服务器"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python local_object_store.py <数据目录> [端口] [access_key secret_key]")
+        sys.exit(1)
+    server = LocalObjectStoreServer(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 9000,
+                                    access_key=sys.argv[3] if len(sys.argv) > 4 else '',
+                                    secret_key=sys.argv[4] if len(sys.argv) > 4 else '')
+    print(f"本地对象存储替身已启动: {server.endpoint}")
+    server.serve_forever()
@@ -2,13 +2,16 @@ import sys
 import os
 import logging
 import sys
+import multiprocessing
+from collections import deque
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, 
                             QFileDialog, QMessageBox, QCheckBox, QGroupBox, 
                             QGridLayout, QTabWidget, QSystemTrayIcon, QMenu,
-                            QDialog, QScrollArea, QListWidget, QListWidgetItem, QStyle)
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QTimer, QUrl
-from PyQt6.QtGui import QIcon, QFont, QAction
+                            QDialog, QScrollArea, QListWidget, QListWidgetItem, QStyle,
+                            QInputDialog, QLineEdit)
+from PyQt6.QtCore import QThread, pyqtSignal, Qt, QTimer, QUrl, QSize
+from PyQt6.QtGui import QIcon, QFont, QAction, QPixmap
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 
 # 导入其他模块
@@ -16,16 +19,44 @@ from device_monitor import DeviceMonitor
 from config_manager import ConfigManager
 from file_operations import FileOperations
 from logger import setup_logger
+from manifest import file_key, is_known, build_entries, refresh_entries
+from file_filter import FileMatcher
+from media_metadata import MetadataCache, DestinationLayout, LAYOUT_MIRROR
+from thumbnails import ThumbnailCache, ThumbnailLoader, THUMBNAIL_SIZE
+from dir_index import DirectoryIndex
+from scan_jobs import ScanJobs
+from file_table import FLAG_NEW, FLAG_SELECTED
+from card_image import image_root, source_stat
+from load_governor import load_governor
+from capacity import check_capacity
+from throughput_history import format_duration
+from library_index import library_index
+from dashboard import DashboardView
+from destinations import destination_backends
 
 class FileConfirmationDialog(QDialog):
-    def __init__(self, parent=None, files_to_copy=None):
+    def __init__(self, parent=None, file_table=None, rows=None, thumbnail_loader=None, volume_id=None, folder_path=None,
+                 estimated_time=None):
         super().__init__(parent)
         self.setWindowTitle('文件确认')
         self.resize(800, 600)
         
-        # 设置文件列表
-        self.files_to_copy = files_to_copy if files_to_copy else []
-        self.selected_files = self.files_to_copy.copy()  # 默认选中所有文件
+        # 设置文件列表：文件表及待确认文件的行号，列表项中只保存行号
+        self.file_table = file_table
+        self.rows = rows if rows is not None else []
+        # 按历史复制速度预计的复制时间（秒）
+        self.estimated_time = estimated_time
+        
+        # 缩略图：只为可见的行加载
+        self.thumbnail_loader = thumbnail_loader
+        self.volume_id = volume_id
+        self.folder_path = folder_path
+        self._items_by_path = {}
+        self._thumbnail_requested = set()
+        self._thumbnail_timer = QTimer(self)
+        self._thumbnail_timer.setSingleShot(True)
+        self._thumbnail_timer.setInterval(50)
+        self._thumbnail_timer.timeout.connect(self.request_visible_thumbnails)
         
         # 创建UI
         self.init_ui()
@@ -39,13 +70,13 @@ class FileConfirmationDialog(QDialog):
         scroll_content = QWidget()
         scroll_layout = QVBoxLayout(scroll_content)
         
-        # 显示文件数量和总大小
-        total_size = 0
-        for src_path, _ in self.files_to_copy:
-            if os.path.exists(src_path):
-                total_size += os.path.getsize(src_path)
+        # 显示文件数量和总大小（取自扫描时的 stat 结果）
+        total_size = self.file_table.total_size(self.rows) if self.rows else 0
         
-        info_label = QLabel(f'找到 {len(self.files_to_copy)} 个文件，总大小: {self.format_size(total_size)}')
+        info_text = f'找到 {len(self.rows)} 个文件，总大小: {self.format_size(total_size)}'
+        if self.estimated_time is not None:
+            info_text += f'，预计复制时间约 {format_duration(self.estimated_time)}'
+        info_label = QLabel(info_text)
         info_label.setStyleSheet("font-weight: bold;")
         scroll_layout.addWidget(info_label)
         
@@ -57,20 +88,31 @@ class FileConfirmationDialog(QDialog):
         
         # 创建文件列表
         self.file_list = QListWidget()
+        if self.thumbnail_loader:
+            self.file_list.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            self.file_list.setUniformItemSizes(True)
+            placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+            placeholder.fill(Qt.GlobalColor.transparent)
+            self._placeholder_icon = QIcon(placeholder)
         
         # 添加文件项
-        for src_path, dest_path in self.files_to_copy:
-            if os.path.exists(src_path):
-                size = os.path.getsize(src_path)
-                size_str = self.format_size(size)
-                item = QListWidgetItem(f'{os.path.basename(src_path)} ({size_str})')
-                item.setCheckState(Qt.Checked)
-                # 存储完整路径信息
-                item.setData(Qt.UserRole, (src_path, dest_path))
-                self.file_list.addItem(item)
+        for row in self.rows:
+            size_str = self.format_size(self.file_table.sizes[row])
+            item = QListWidgetItem(f'{self.file_table.names[row]} ({size_str})')
+            item.setCheckState(Qt.Checked)
+            # 只存储行号，完整路径在需要时由文件表拼接
+            item.setData(Qt.UserRole, row)
+            if self.thumbnail_loader:
+                # 占位图标保证行高一致，缩略图加载完成后替换
+                item.setIcon(self._placeholder_icon)
+            self.file_list.addItem(item)
         
         # 连接信号
         self.file_list.itemChanged.connect(self.on_item_changed)
+        if self.thumbnail_loader:
+            self.thumbnail_loader.thumbnail_ready.connect(self.on_thumbnail_ready)
+            self.file_list.verticalScrollBar().valueChanged.connect(self._thumbnail_timer.start)
+            self.finished.connect(self.stop_thumbnails)
         
         # 添加到滚动区域
         scroll_layout.addWidget(self.file_list)
@@ -93,6 +135,48 @@ class FileConfirmationDialog(QDialog):
         main_layout.addWidget(scroll_area)
         main_layout.addLayout(button_layout)
     
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.thumbnail_loader:
+            self._thumbnail_timer.start()
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.thumbnail_loader:
+            self._thumbnail_timer.start()
+    
+    def request_visible_thumbnails(self):
+        # 只为当前可见的行请求缩略图，滚动停止后再加载新出现的行
+        if self.file_list.count() == 0:
+            return
+        viewport = self.file_list.viewport().rect()
+        first_index = self.file_list.indexAt(viewport.topLeft())
+        last_index = self.file_list.indexAt(viewport.bottomLeft())
+        first = first_index.row() if first_index.isValid() else 0
+        last = last_index.row() if last_index.isValid() else self.file_list.count() - 1
+        for index in range(first, last + 1):
+            item = self.file_list.item(index)
+            row = item.data(Qt.UserRole)
+            if row not in self._thumbnail_requested:
+                self._thumbnail_requested.add(row)
+                src_path = self.file_table.src_path(row)
+                self._items_by_path[src_path] = item
+                self.thumbnail_loader.request(src_path, self.volume_id, self.folder_path)
+    
+    def on_thumbnail_ready(self, src_path, image):
+        item = self._items_by_path.get(src_path)
+        if item is not None and not image.isNull():
+            item.setIcon(QIcon(QPixmap.fromImage(image)))
+    
+    def stop_thumbnails(self):
+        # 对话框关闭后不再接收缩略图，并取消尚未开始的提取任务
+        self._thumbnail_timer.stop()
+        try:
+            self.thumbnail_loader.thumbnail_ready.disconnect(self.on_thumbnail_ready)
+        except TypeError:
+            pass
+        self.thumbnail_loader.cancel_pending()
+    
     def toggle_select_all(self, state):
         # 全选/取消全选
         for i in range(self.file_list.count()):
@@ -110,15 +194,12 @@ class FileConfirmationDialog(QDialog):
         # 更新全选复选框状态
         self.select_all_check.setChecked(all_checked)
     
-    def get_selected_files(self):
-        # 获取选中的文件
-        selected_files = []
-        for i in range(self.file_list.count()):
-            item = self.file_list.item(i)
-            if item.checkState() == Qt.Checked:
-                selected_files.append(item.data(Qt.UserRole))
-        
-        return selected_files
+    def apply_selection(self):
+        # 将选中状态写入文件表，返回选中文件的行号
+        self.file_table.clear_flag(FLAG_SELECTED)
+        self.file_table.set_flag((self.file_list.item(i).data(Qt.UserRole) for i in range(self.file_list.count())
+                                  if self.file_list.item(i).checkState() == Qt.Checked), FLAG_SELECTED)
+        return self.file_table.rows(FLAG_SELECTED)
     
     def format_size(self, size_bytes):
         # 格式化文件大小
@@ -137,13 +218,39 @@ class CamSyncApp(QMainWindow):
         # 初始化配置管理器
         self.config_manager = ConfigManager()
         
+        # 初始化元数据缓存（按拍摄日期整理目标目录时使用）
+        self.metadata_cache = MetadataCache(os.path.join(self.config_manager.local_config_dir, 'metadata_cache.json'))
+        # 源文件夹路径 -> 目录索引，复制完成后保存目录指纹
+        self._dir_indexes = {}
+        # 源文件夹路径 -> 不预览复制时按时区偏移判定为已知文件的当前指纹，复制完成后写回清单
+        self._refreshed_fingerprints = {}
+        
+        # 初始化缩略图加载器（文件确认对话框中使用）
+        self.thumbnail_loader = ThumbnailLoader(
+            ThumbnailCache(os.path.join(self.config_manager.local_config_dir, 'thumbnails')), self
+        )
+        
         # 初始化设备监控器
         self.device_monitor = DeviceMonitor(self)
         self.device_monitor.device_detected.connect(self.on_device_detected)
+        self.device_monitor.device_removed.connect(self.on_device_removed)
         
         # 初始化文件操作管理器
-        self.file_operations = FileOperations(self)
+        self.file_operations = FileOperations(self, self.config_manager)
         self.file_operations.operation_completed.connect(self.on_operation_completed)
+        self.file_operations.files_copied.connect(self.on_files_copied)
+        self.file_operations.progress_updated.connect(self.on_progress_updated)
+        
+        # 初始化设备扫描任务（检查目标文件夹、读取U盘配置和扫描文件都在后台线程中进行）
+        self.scan_jobs = ScanJobs(self.device_monitor, self.config_manager, self.file_operations, self)
+        self.scan_jobs.device_scanned.connect(self.on_device_scanned)
+        self.scan_jobs.folder_scanned.connect(self.on_folder_scanned)
+        self._pending_scans = {}     # 设备路径 -> 尚未确认的文件夹扫描数
+        self._scan_results = deque() # 等待用户确认的扫描结果
+        self._confirming = False
+        
+        # 监视备份路径，增量维护备份库索引
+        self.start_library_index()
         
         # 设置UI
         self.init_ui()
@@ -183,7 +290,11 @@ class CamSyncApp(QMainWindow):
         self.start_stop_button = QPushButton("开始监控")
         self.start_stop_button.clicked.connect(self.toggle_monitoring)
         
+        # 复制进度和预计剩余时间
+        self.progress_label = QLabel("")
+        
         status_layout.addWidget(self.status_label)
+        status_layout.addWidget(self.progress_label)
         status_layout.addWidget(self.start_stop_button)
         status_group.setLayout(status_layout)
         
@@ -196,13 +307,40 @@ class CamSyncApp(QMainWindow):
         self.backup_path_button = QPushButton("浏览...")
         self.backup_path_button.clicked.connect(self.select_backup_path)
         
+        self.extra_backup_path_label = QLabel("附加备份路径:")
+        self.extra_backup_path_edit = QLabel(self.format_extra_backup_paths())
+        self.extra_backup_path_add_button = QPushButton("添加...")
+        self.extra_backup_path_add_button.clicked.connect(self.add_extra_backup_path)
+        self.extra_backup_path_clear_button = QPushButton("清除")
+        self.extra_backup_path_clear_button.clicked.connect(self.clear_extra_backup_paths)
+        self.spillover_path_label = QLabel("溢出备份路径:")
+        self.spillover_path_edit = QLabel(self.format_spillover_paths())
+        self.spillover_path_add_button = QPushButton("添加...")
+        self.spillover_path_add_button.clicked.connect(self.add_spillover_path)
+        self.spillover_path_clear_button = QPushButton("清除")
+        self.spillover_path_clear_button.clicked.connect(self.clear_spillover_paths)
+        self.object_store_path_button = QPushButton("添加对象存储...")
+        self.object_store_path_button.clicked.connect(self.add_object_store_path)
+        self.import_image_button = QPushButton("从镜像导入...")
+        self.import_image_button.clicked.connect(self.import_card_image)
+        
         self.auto_start_check = QCheckBox("开机自启动")
         self.auto_start_check.stateChanged.connect(self.toggle_auto_start)
         
         config_layout.addWidget(self.backup_path_label, 0, 0)
         config_layout.addWidget(self.backup_path_edit, 0, 1)
         config_layout.addWidget(self.backup_path_button, 0, 2)
-        config_layout.addWidget(self.auto_start_check, 1, 0, 1, 3)
+        config_layout.addWidget(self.extra_backup_path_label, 1, 0)
+        config_layout.addWidget(self.extra_backup_path_edit, 1, 1)
+        config_layout.addWidget(self.extra_backup_path_add_button, 1, 2)
+        config_layout.addWidget(self.extra_backup_path_clear_button, 1, 3)
+        config_layout.addWidget(self.object_store_path_button, 0, 3)
+        config_layout.addWidget(self.spillover_path_label, 2, 0)
+        config_layout.addWidget(self.spillover_path_edit, 2, 1)
+        config_layout.addWidget(self.spillover_path_add_button, 2, 2)
+        config_layout.addWidget(self.spillover_path_clear_button, 2, 3)
+        config_layout.addWidget(self.auto_start_check, 3, 0, 1, 3)
+        config_layout.addWidget(self.import_image_button, 3, 3)
         config_group.setLayout(config_layout)
         
         # 创建日志和信息区域
@@ -227,6 +365,11 @@ class CamSyncApp(QMainWindow):
         </style></head><body><div id='preview'></div></body></html>""")
         tab_widget.addTab(self.file_preview_view, "文件预览")
         
+        # 导入仪表盘标签页 - 按固定频率读取复制任务的计数
+        self.dashboard_view = DashboardView(self._css)
+        self.file_operations.job_started.connect(self.dashboard_view.add_job)
+        tab_widget.addTab(self.dashboard_view, "导入仪表盘")
+        
         # 添加所有组件到主布局
         main_layout.addWidget(status_group)
         main_layout.addWidget(config_group)
@@ -257,6 +400,80 @@ class CamSyncApp(QMainWindow):
             self.config_manager.set_backup_path(path)
             self.backup_path_edit.setText(path)
             self.update_log(f"备份路径已设置为: {path}\n")
+            self.start_library_index()
+    
+    def format_extra_backup_paths(self):
+        # 格式化附加备份路径的显示文本
+        paths = self.config_manager.get_extra_backup_paths()
+        return '; '.join(paths) if paths else '无'
+    
+    def add_extra_backup_path(self):
+        path = QFileDialog.getExistingDirectory(self, "添加附加备份路径", self.config_manager.get_backup_path())
+        if path:
+            paths = self.config_manager.get_extra_backup_paths()
+            if path not in paths and path != self.config_manager.get_backup_path():
+                paths.append(path)
+                self.config_manager.set_extra_backup_paths(paths)
+                self.extra_backup_path_edit.setText(self.format_extra_backup_paths())
+                self.update_log(f"已添加附加备份路径: {path}\n")
+    
+    def format_spillover_paths(self):
+        # 格式化溢出备份路径的显示文本
+        paths = self.config_manager.get_spillover_paths()
+        return ' -> '.join(paths) if paths else '无'
+    
+    def add_spillover_path(self):
+        # 溢出路径应位于其他卷上，主备份路径所在卷写满后按添加顺序依次使用
+        path = QFileDialog.getExistingDirectory(self, "添加溢出备份路径", self.config_manager.get_backup_path())
+        if path:
+            paths = self.config_manager.get_spillover_paths()
+            if path not in paths and path != self.config_manager.get_backup_path():
+                paths.append(path)
+                self.config_manager.set_spillover_paths(paths)
+                self.spillover_path_edit.setText(self.format_spillover_paths())
+                self.update_log(f"已添加溢出备份路径: {path}\n")
+    
+    def clear_spillover_paths(self):
+        self.config_manager.set_spillover_paths([])
+        self.spillover_path_edit.setText(self.format_spillover_paths())
+        self.update_log("已清除溢出备份路径\n")
+    
+    def add_object_store_path(self):
+        # 添加 S3 兼容对象存储作为附加备份路径，首次添加时填写连接信息
+        path, ok = QInputDialog.getText(self, "添加对象存储", "对象存储路径（s3://存储桶/前缀）:", text="s3://")
+        path = path.strip().rstrip('/')
+        if not ok or not path.lower().startswith('s3://') or len(path) <= len('s3://'):
+            return
+        options = self.config_manager.get_object_store_options()
+        if not options.get('endpoint'):
+            endpoint, ok = QInputDialog.getText(self, "对象存储地址", "服务地址:", text="http://127.0.0.1:9000")
+            if not ok or not endpoint.strip():
+                return
+            access_key, ok = QInputDialog.getText(self, "对象存储密钥", "Access Key:")
+            if not ok:
+                return
+            secret_key, ok = QInputDialog.getText(self, "对象存储密钥", "Secret Key:", QLineEdit.EchoMode.Password)
+            if not ok:
+                return
+            options.update({'endpoint': endpoint.strip(), 'access_key': access_key.strip(), 'secret_key': secret_key})
+            self.config_manager.set_object_store_options(options)
+        paths = self.config_manager.get_extra_backup_paths()
+        if path not in paths:
+            paths.append(path)
+            self.config_manager.set_extra_backup_paths(paths)
+            self.extra_backup_path_edit.setText(self.format_extra_backup_paths())
+            self.update_log(f"已添加对象存储备份路径: {path}\n")
+    
+    def clear_extra_backup_paths(self):
+        self.config_manager.set_extra_backup_paths([])
+        self.extra_backup_path_edit.setText(self.format_extra_backup_paths())
+        self.update_log("已清除附加备份路径\n")
+    
+    def import_card_image(self):
+        # 选择存储卡镜像文件（dd 等工具得到的整卡或分区镜像），不挂载直接按插入的设备处理
+        path, _ = QFileDialog.getOpenFileName(self, "选择存储卡镜像", "", "存储卡镜像 (*.img *.bin *.dd);;所有文件 (*)")
+        if path:
+            self.on_device_detected((image_root(path), os.path.basename(path)))
     
     def toggle_auto_start(self, state):
         enabled = state == Qt.Checked
@@ -285,21 +502,50 @@ class CamSyncApp(QMainWindow):
             self.default_close_action = 'minimize'
     
     def on_device_detected(self, device_info):
-        # 设备检测到后的处理逻辑
+        # 设备检测到后的处理逻辑：检查目标文件夹和读取U盘配置在后台线程中进行，界面不会卡住
         device_path, device_name = device_info
         self.update_log(f"检测到新设备: {device_name} ({device_path})\n")
-        
+        if device_path in self._pending_scans or self.config_manager.in_session(device_path):
+            # 没有收到移除事件就再次插入：旧的扫描会被取消，不会再返回结果，清除该设备的扫描计数和会话，
+            # 否则会话永远不会结束；旧会话可能属于另一张卡，不写回
+            self.logger.warning(f"设备 {device_path} 未移除即再次插入，放弃上一次未完成的扫描")
+            self._forget_device(device_path)
+        self.scan_jobs.submit_device(device_path, device_name)
+    
+    def on_device_scanned(self, result):
+        device_path = result['device_path']
         # 检查是否存在DCIM、PRIVATE、MISC文件夹
-        target_folders = self.device_monitor.check_target_folders(device_path)
+        target_folders = result['folders']
         if target_folders:
             self.update_log(f"在设备上找到目标文件夹: {', '.join(target_folders)}\n")
             # 显示配置对话框并处理文件操作
-            self.process_detected_folders(device_path, target_folders)
+            self.process_detected_folders(device_path, target_folders, result['volume_id'], result['config_data'])
         else:
             self.update_log(f"在设备上未找到目标文件夹\n")
     
-    def process_detected_folders(self, device_path, folders):
-        # 处理检测到的文件夹
+    def on_device_removed(self, device_path):
+        self._forget_device(device_path)
+        self.update_log(f"设备已移除: {device_path}\n")
+    
+    def _forget_device(self, device_path):
+        # 取消该设备尚未完成的扫描，丢弃尚未确认的扫描结果
+        self.scan_jobs.cancel(device_path)
+        self._pending_scans.pop(device_path, None)
+        self._scan_results = deque(request for request in self._scan_results if request['device_path'] != device_path)
+        # 设备移除后无法再写回U盘配置，丢弃该设备的会话缓存
+        self.config_manager.discard_session(device_path)
+    
+    def process_detected_folders(self, device_path, folders, volume_id=None, config_data=None):
+        # 处理检测到的文件夹，整个过程作为一个配置会话，所有文件夹处理完（含后台扫描和用户确认）后一次性写回U盘
+        self.config_manager.begin_session(device_path, config_data)
+        try:
+            self._process_folders(device_path, folders, volume_id)
+        finally:
+            if not self._pending_scans.get(device_path):
+                self._pending_scans.pop(device_path, None)
+                self.config_manager.end_session(device_path)
+    
+    def _process_folders(self, device_path, folders, volume_id=None):
         for folder in folders:
             # 获取或创建配置
             config = self.config_manager.get_folder_config(device_path, folder)
@@ -310,84 +556,230 @@ class CamSyncApp(QMainWindow):
             
             # 根据配置决定操作
             if config['backup_strategy'] != 'none':
-                # 获取所有文件列表
-                all_files = self.file_operations.get_files_to_copy(
-                    os.path.join(device_path, folder), 
-                    os.path.join(self.config_manager.get_backup_path(), folder),
-                    False  # 获取所有文件，不进行增量过滤
-                )
+                folder_path = os.path.join(device_path, folder)
+                # 多个备份路径时每个文件只读取一次，同时写入所有目标
+                dest_dirs = [os.path.join(backup_path, folder) for backup_path in self.config_manager.get_backup_paths(config)]
+                dest_dir = dest_dirs[0] if len(dest_dirs) == 1 else dest_dirs
                 
                 # 从配置中获取已保存和未保存的文件列表
-                saved_files = config.get('saved_files', [])
-                unsaved_files = config.get('unsaved_files', [])
+                saved_files = config.get('saved_files', {})
+                unsaved_files = config.get('unsaved_files', {})
+                # 上次未能写入全部目标的文件需要重新复制
+                missing_destinations = config.get('missing_destinations', {})
                 
-                # 提取所有文件的源路径
-                all_file_paths = [src_path for src_path, _ in all_files]
+                # 按目录指纹跳过上次插入后没有变化的子目录
+                dir_index = DirectoryIndex.from_config(folder_path, config)
                 
-                # 过滤掉已保存和未保存的文件，只保留新文件
-                new_files = []
-                for src_path, dest_path in all_files:
-                    if src_path not in saved_files and src_path not in unsaved_files:
-                        new_files.append((src_path, dest_path))
+                # 按配置中的包含/排除模式过滤文件，被排除的子目录不再扫描
+                matcher = FileMatcher.from_config(config)
                 
-                self.update_log(f"在 {folder} 文件夹中找到 {len(all_files)} 个文件，其中 {len(new_files)} 个是新文件\n")
+                # 按拍摄日期（和相机）整理目标目录时，根据文件头部的元数据重新规划目标路径
+                layout = None
+                if config.get('destination_layout', LAYOUT_MIRROR) != LAYOUT_MIRROR:
+                    layout = DestinationLayout(config['destination_layout'], dest_dirs, self.metadata_cache)
                 
-                if new_files:
-                    # 预览文件
-                    if config['preview_before_copy']:
-                        # 使用文件确认对话框
-                        try:
-                            dialog = FileConfirmationDialog(self, new_files)
-                            # 显示对话框并等待用户选择
-                            result = dialog.exec()
-                            
-                            # 如果用户点击确认按钮
-                            if result == QDialog.DialogCode.Accepted:
-                                # 获取用户选中的文件
-                                selected_files = dialog.get_selected_files()
-                                
-                                # 更新已保存和未保存的文件列表
-                                # 已保存的文件是用户选择复制的文件
-                                new_saved_files = saved_files + [src_path for src_path, _ in selected_files]
-                                # 未保存的文件是用户未选择复制的新文件
-                                new_unsaved_files = unsaved_files + [src_path for src_path, _ in new_files if src_path not in [s for s, _ in selected_files]]
-                                
-                                # 将所有文件信息写入配置文件
-                                self.config_manager.update_folder_file_info(device_path, folder, new_saved_files, new_unsaved_files)
-                                self.update_log(f"已将文件状态信息保存到U盘配置文件\n")
-                                
-                                if selected_files:
-                                    # 显示文件预览
-                                    self.show_file_preview(selected_files)
-                                    self.update_log(f"用户选择了 {len(selected_files)} 个文件进行复制\n")
-                                    # 开始复制文件
-                                    self.file_operations.start_copy_operation(selected_files)
-                                    # 更新上次备份时间
-                                    self.config_manager.update_last_backup_time(device_path, folder)
-                                else:
-                                    self.update_log(f"用户未选择任何文件进行复制\n")
-                            else:
-                                # 如果用户取消，将所有新文件标记为未保存
-                                new_unsaved_files = unsaved_files + [src_path for src_path, _ in new_files]
-                                self.config_manager.update_folder_file_info(device_path, folder, saved_files, new_unsaved_files)
-                                self.update_log(f"用户取消了文件复制操作，所有新文件已标记为未保存\n")
-                        except Exception as e:
-                            self.update_log(f"显示文件确认对话框时发生错误: {str(e)}\n")
-                            self.logger.error(f"显示文件确认对话框错误: {str(e)}")
+                if not config['preview_before_copy']:
+                    refreshed = {'saved_files': {}, 'unsaved_files': {}}
+                    
+                    # 过滤掉已保存和未保存的文件，只保留新文件（按相对路径和指纹匹配，与盘符无关）
+                    def is_new_file(src_path, folder_path=folder_path, saved_files=saved_files, unsaved_files=unsaved_files,
+                                    missing_destinations=missing_destinations, dir_index=dir_index, copy_root=dest_dirs[0],
+                                    refreshed=refreshed):
+                        key = file_key(folder_path, src_path)
+                        if key in missing_destinations:
+                            is_new = True
+                        else:
+                            # 已保存的文件与镜像目标中的副本比较内容（修改时间相差整时区偏移时）
+                            copy_path = os.path.join(copy_root, *key.split('/'))
+                            is_new = (not is_known(saved_files, key, src_path, copy_path,
+                                                   refreshed=refreshed['saved_files']) and
+                                      not is_known(unsaved_files, key, src_path, refreshed=refreshed['unsaved_files']))
+                        if is_new:
+                            # 新文件记入清单前不保存其所在目录的指纹
+                            dir_index.mark_pending(src_path)
+                        return is_new
+                    
+                    # 不预览，边扫描边复制新文件，复制完成后再更新配置；每个文件夹是一个复制任务，
+                    # 复制线程正在执行其他文件夹（或其他卡）时排队依次执行
+                    self._dir_indexes[folder_path] = dir_index
+                    self._refreshed_fingerprints[folder_path] = refreshed
+                    queued = self.file_operations.isRunning()
+                    self.file_operations.start_copy_operation_without_preview(
+                        folder_path, dest_dir,
+                        False,  # 不进行增量过滤，由文件清单判断新文件
+                        volume_id, is_new_file, matcher, layout, dir_index
+                    )
+                    if queued:
+                        self.update_log(f"{folder} 文件夹已加入复制队列\n")
                     else:
-                        # 不预览，直接复制所有新文件
-                        self.file_operations.start_copy_operation(new_files)
+                        self.update_log(f"开始自动复制 {folder} 文件夹中的新文件\n")
+                    continue
+                
+                # 在后台线程中扫描所有文件并与清单比较，扫描完成后再显示确认对话框
+                self._pending_scans[device_path] = self._pending_scans.get(device_path, 0) + 1
+                self.scan_jobs.submit_folder({
+                    'device_path': device_path,
+                    'folder': folder,
+                    'folder_path': folder_path,
+                    'dest_dir': dest_dir,
+                    'volume_id': volume_id,
+                    'matcher': matcher,
+                    'dir_index': dir_index,
+                    'saved_files': saved_files,
+                    'unsaved_files': unsaved_files,
+                    'missing_destinations': missing_destinations,
+                    'layout': layout
+                })
+                self.update_log(f"正在扫描 {folder} 文件夹\n")
+            else:
+                self.update_log(f"文件夹 {folder} 配置为不备份\n")
+    
+    def on_folder_scanned(self, request):
+        # 扫描结果排队，确认对话框一次只显示一个
+        self._scan_results.append(request)
+        if self._confirming:
+            return
+        self._confirming = True
+        try:
+            while self._scan_results:
+                request = self._scan_results.popleft()
+                device_path = request['device_path']
+                if request['cancel_event'].is_set():
+                    # 设备已移除或重新插入，扫描计数和会话已由 _forget_device 清除
+                    continue
+                self.config_manager.begin_session(device_path)
+                try:
+                    self._confirm_folder(request)
+                finally:
+                    # 该设备的所有文件夹都处理完后一次性写回U盘；对话框打开期间设备被移除或重新插入时，
+                    # 计数和会话可能已属于新的一次扫描，不再改动
+                    remaining = None if request['cancel_event'].is_set() else self._pending_scans.get(device_path)
+                    if remaining is not None:
+                        remaining -= 1
+                        if remaining > 0:
+                            self._pending_scans[device_path] = remaining
+                        else:
+                            del self._pending_scans[device_path]
+                            self.config_manager.end_session(device_path)
+        finally:
+            self._confirming = False
+    
+    def _confirm_folder(self, request):
+        device_path = request['device_path']
+        folder = request['folder']
+        folder_path = request['folder_path']
+        dir_index = request['dir_index']
+        saved_files = request['saved_files']
+        unsaved_files = request['unsaved_files']
+        file_table = request['file_table']
+        new_rows = request['new_rows']
+        if file_table is None:
+            self.update_log(f"扫描 {folder} 文件夹时发生错误\n")
+            return
+        
+        if dir_index.skipped:
+            self.update_log(f"{folder} 文件夹中有 {dir_index.skipped} 个目录自上次插入后未变化，已跳过\n")
+        self.update_log(f"在 {folder} 文件夹中找到 {len(file_table)} 个文件，其中 {len(new_rows)} 个是新文件\n")
+        self.logger.debug(f"文件表占用内存: {self.format_size(file_table.memory_usage())}")
+        
+        if new_rows:
+            # 使用文件确认对话框预览文件
+            try:
+                dialog = FileConfirmationDialog(self, file_table, new_rows, self.thumbnail_loader, request['volume_id'],
+                                                folder_path, self._estimate_copy_time(file_table, new_rows,
+                                                                                      request['volume_id']))
+                # 显示对话框并等待用户选择
+                result = dialog.exec()
+                if request['cancel_event'].is_set():
+                    # 对话框打开期间设备已被移除
+                    self.update_log(f"设备已移除，{folder} 文件夹的复制已取消\n")
+                    return
+                    
+                # 如果用户点击确认按钮
+                if result == QDialog.DialogCode.Accepted:
+                    # 获取用户选中的文件
+                    selected_rows = dialog.apply_selection()
+                    if selected_rows and not self._confirm_capacity(file_table, selected_rows):
+                        # 用户放弃复制，文件清单保持不变，下次插入时仍作为新文件
+                        self.update_log(f"备份空间不足，已取消 {folder} 文件夹的复制\n")
+                        return
+                    unselected_rows = file_table.rows(FLAG_NEW, without=FLAG_SELECTED)
+                        
+                    # 更新未保存的文件列表；用户选择复制的文件在复制成功后（on_files_copied）才记入已保存清单，
+                    # 复制失败或程序在复制前退出时，下次插入仍作为新文件
+                    # 按时区偏移判定为已知的文件同时更新指纹，之后插入时不再比较内容
+                    new_saved_files = refresh_entries(saved_files, file_table.refreshed['saved_files'])
+                    # 未保存的文件是用户未选择复制的新文件
+                    new_unsaved_files = refresh_entries(unsaved_files, file_table.refreshed['unsaved_files'])
+                    new_unsaved_files.update(file_table.manifest_entries(unselected_rows))
                         
-                        # 将所有新文件标记为已保存
-                        new_saved_files = saved_files + [src_path for src_path, _ in new_files]
-                        self.config_manager.update_folder_file_info(device_path, folder, new_saved_files, unsaved_files)
-                        self.update_log(f"已自动复制 {len(new_files)} 个新文件并更新配置\n")
+                    # 将所有文件信息写入配置文件
+                    self.config_manager.update_folder_file_info(device_path, folder, new_saved_files, new_unsaved_files)
+                    self.update_log(f"已将文件状态信息保存到U盘配置文件\n")
+                    # 未选择的文件已记入未保存清单
+                    dir_index.resolve(file_table.src_path(row) for row in unselected_rows)
+                        
+                    if selected_rows:
+                        selected_files = file_table.select(selected_rows)
+                        # 显示文件预览
+                        self.show_file_preview(selected_files)
+                        self.update_log(f"用户选择了 {len(selected_files)} 个文件进行复制\n")
+                        # 开始复制文件，复制完成后保存目录指纹
+                        self._dir_indexes[folder_path] = dir_index
+                        self.file_operations.start_copy_operation(selected_files, request['volume_id'], folder_path)
                         # 更新上次备份时间
                         self.config_manager.update_last_backup_time(device_path, folder)
+                    else:
+                        self.update_log(f"用户未选择任何文件进行复制\n")
+                        self._save_dir_fingerprints(device_path, folder, dir_index)
                 else:
-                    self.update_log(f"没有新文件需要复制到 {folder}\n")
-            else:
-                self.update_log(f"文件夹 {folder} 配置为不备份\n")
+                    # 如果用户取消，将所有新文件标记为未保存
+                    new_unsaved_files = refresh_entries(unsaved_files, file_table.refreshed['unsaved_files'])
+                    new_unsaved_files.update(file_table.manifest_entries(new_rows))
+                    self.config_manager.update_folder_file_info(
+                        device_path, folder, refresh_entries(saved_files, file_table.refreshed['saved_files']),
+                        new_unsaved_files)
+                    self.update_log(f"用户取消了文件复制操作，所有新文件已标记为未保存\n")
+                    dir_index.resolve(file_table.src_path(row) for row in new_rows)
+                    self._save_dir_fingerprints(device_path, folder, dir_index)
+            except Exception as e:
+                self.update_log(f"显示文件确认对话框时发生错误: {str(e)}\n")
+                self.logger.error(f"显示文件确认对话框错误: {str(e)}")
+        else:
+            self.update_log(f"没有新文件需要复制到 {folder}\n")
+            if any(file_table.refreshed.values()):
+                # 时区偏移（如夏令时切换）后所有文件都按偏移判定为已知，更新指纹
+                self.config_manager.update_folder_file_info(
+                    device_path, folder, refresh_entries(saved_files, file_table.refreshed['saved_files']),
+                    refresh_entries(unsaved_files, file_table.refreshed['unsaved_files']))
+            self._save_dir_fingerprints(device_path, folder, dir_index)
+    
+    def _estimate_copy_time(self, file_table, rows, volume_id):
+        """按历史复制速度预计复制这些文件所需的时间（秒），无法预计时返回 None"""
+        try:
+            selection = file_table.select(rows)
+            src_path, dest_path = next(iter(selection))
+            return self.file_operations.estimate_copy_time(selection.sizes(), src_path, dest_path, volume_id)
+        except Exception as e:
+            self.logger.error(f"预计复制时间时发生错误: {str(e)}")
+            return None
+    
+    def _confirm_capacity(self, file_table, rows):
+        """复制前按扫描得到的总大小检查备份空间，不足时询问是否仍然复制（能放下多少复制多少）"""
+        total_size = file_table.total_size(rows)
+        spill = self.config_manager.get_spill_over()
+        shortfalls = check_capacity(file_table.dest_dirs, total_size, spill)
+        if not shortfalls:
+            return True
+        details = '\n'.join(f"{dest_dir}: 需要 {self.format_size(needed)}，可用 {self.format_size(available)}"
+                            for dest_dir, needed, available in shortfalls)
+        self.update_log(f"备份空间不足:\n{details}\n")
+        reply = QMessageBox.question(self, '备份空间不足',
+                                     f"以下备份路径（含溢出路径）的可用空间不足以容纳所选文件：\n\n{details}\n\n"
+                                     f"是否仍然开始复制？空间写满后其余文件将复制失败，下次插入时重新复制。",
+                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                     QMessageBox.StandardButton.No)
+        return reply == QMessageBox.StandardButton.Yes
     
     def show_file_preview(self, files_to_copy):
         # 使用 HTML 渲染文件预览
@@ -396,11 +788,15 @@ class CamSyncApp(QMainWindow):
         total_size = 0
 
         for src_path, dest_path in files_to_copy:
-            size = os.path.getsize(src_path) if os.path.exists(src_path) else 0
+            try:
+                size = source_stat(src_path).st_size
+            except OSError:
+                size = 0
             total_size += size
             size_str = self.format_size(size)
             preview += f"<span class='path'>{html_mod.escape(src_path)}</span><br>"
-            preview += f"  <span class='arrow'>-&gt;</span> {html_mod.escape(dest_path)}<br>"
+            dest_text = ', '.join(dest_path) if isinstance(dest_path, tuple) else dest_path
+            preview += f"  <span class='arrow'>-&gt;</span> {html_mod.escape(dest_text)}<br>"
             preview += f"  <span class='size'>大小: {size_str}</span><br><br>"
 
         preview += f"<span class='total'>总计: {len(files_to_copy)} 个文件，总大小: {self.format_size(total_size)}</span>"
@@ -413,16 +809,79 @@ class CamSyncApp(QMainWindow):
         self.file_preview_view.setHtml(html)
         self.update_log(f"显示 {len(files_to_copy)} 个文件的预览\n")
     
+    def on_progress_updated(self, progress):
+        # 显示复制进度，状态中带有预计剩余时间
+        completed, total, status = progress
+        self.progress_label.setText(f"{completed}/{total} {status}")
+    
     def on_operation_completed(self, result):
         # 处理操作完成事件
+        self.progress_label.setText("")
         success, message = result
         if success:
             self.update_log(f"文件复制成功: {message}\n")
-            QMessageBox.information(self, "操作成功", message)
+            # 一张卡的多个文件夹依次复制，成功时只在队列中的最后一个任务完成后提示，失败时立即提示
+            if not self.file_operations.pending_jobs():
+                QMessageBox.information(self, "操作成功", message)
         else:
             self.update_log(f"文件复制失败: {message}\n")
             QMessageBox.critical(self, "操作失败", message)
     
+    def on_files_copied(self, result):
+        # 复制完成后，将复制成功的文件记入U盘文件清单，并记录未能写入全部目标的文件
+        src_dir, copied_paths, partial_files, placements = result
+        dir_index = self._dir_indexes.pop(src_dir, None)
+        refreshed = self._refreshed_fingerprints.pop(src_dir, None) or {}
+        if not copied_paths and dir_index is None:
+            return
+        device_path, folder = os.path.split(os.path.normpath(src_dir))
+        self.config_manager.begin_session(device_path)
+        try:
+            config = self.config_manager.get_folder_config(device_path, folder)
+            if config:
+                # 扫描时按时区偏移判定为已知的文件更新指纹
+                new_saved_files = refresh_entries(config.get('saved_files', {}), refreshed.get('saved_files'))
+                new_saved_files.update(build_entries(src_dir, copied_paths))
+                if refreshed.get('unsaved_files'):
+                    config['unsaved_files'] = refresh_entries(config.get('unsaved_files', {}), refreshed['unsaved_files'])
+                missing_destinations = dict(config.get('missing_destinations', {}))
+                for src_path in copied_paths:
+                    key = file_key(src_dir, src_path)
+                    if src_path in partial_files:
+                        missing_destinations[key] = partial_files[src_path]
+                    else:
+                        missing_destinations.pop(key, None)
+                config['saved_files'] = new_saved_files
+                config['missing_destinations'] = missing_destinations
+                # 溢出的文件在增量比较时按溢出链的相同相对位置查找，不再单独记录所在的卷
+                config.pop('placements', None)
+                if dir_index:
+                    # 未能写入全部目标的文件下次仍需复制，其所在目录不保存指纹
+                    dir_index.resolve(src_path for src_path in copied_paths if src_path not in partial_files)
+                    dir_index.save_to(config)
+                self.config_manager.save_folder_config(device_path, folder, config)
+                if not copied_paths:
+                    return
+                # 更新上次备份时间
+                self.config_manager.update_last_backup_time(device_path, folder)
+                self.update_log(f"已复制 {len(copied_paths)} 个文件并更新配置\n")
+                if partial_files:
+                    self.update_log(f"{len(partial_files)} 个文件未能写入全部备份路径，下次插入时将重新复制\n")
+                if placements:
+                    self.update_log(f"{len(placements)} 个文件因空间不足写入了溢出路径\n")
+        finally:
+            self.config_manager.end_session(device_path)
+    
+    def _save_dir_fingerprints(self, device_path, folder, dir_index):
+        # 所有新文件都已记入清单时直接保存目录指纹
+        try:
+            config = self.config_manager.get_folder_config(device_path, folder)
+            if config:
+                dir_index.save_to(config)
+                self.config_manager.save_folder_config(device_path, folder, config)
+        except Exception as e:
+            self.logger.error(f"保存目录指纹失败: {str(e)}")
+    
     def update_log(self, message):
         # 缓存日志并通过 setHtml 渲染到 WebEngine 视图（深色主题）
         import html as html_mod
@@ -501,11 +960,28 @@ class CamSyncApp(QMainWindow):
         self.show()
         self.raise_()  # 提升窗口到前台
         self.activateWindow()  # 激活窗口
+        self.set_background_mode(False)
+    
+    def start_library_index(self):
+        """监视本地备份路径（网络驱动器上其他机器的修改不会产生 inotify 事件，不使用索引）"""
+        backup_path = self.config_manager.get_backup_path()
+        if not library_index.supported or not os.path.isdir(backup_path) or \
+                destination_backends.is_network_path(backup_path):
+            library_index.stop()
+            return
+        library_index.start(backup_path, os.path.join(self.config_manager.local_config_dir, 'library_index.json'))
+    
+    def set_background_mode(self, hidden):
+        """最小化到托盘时进入后台模式：降低优先级并按系统负载调整复制速度（可在配置中关闭）"""
+        load_governor.set_background(hidden and self.config_manager.main_config.get('background_mode', True))
     
     def exit_application(self):
         """完全退出应用程序"""
         if self.device_monitor.is_monitoring:
             self.device_monitor.stop_monitoring()
+        self.thumbnail_loader.shutdown()
+        self.scan_jobs.shutdown()
+        library_index.stop()
         self.logger.info("CamSync application closed")
         self.tray_icon.hide()
         QApplication.quit()
@@ -555,33 +1031,46 @@ class CamSyncApp(QMainWindow):
                 if selected_action == 'minimize':
                     # 最小化到托盘
                     self.hide()
+                    self.set_background_mode(True)
                     self.logger.info("应用程序最小化到系统托盘")
                     event.ignore()
                 else:
                     # 直接关闭程序
                     if self.device_monitor.is_monitoring:
                         self.device_monitor.stop_monitoring()
+                    self.thumbnail_loader.shutdown()
+                    self.scan_jobs.shutdown()
+                    library_index.stop()
                     self.logger.info("CamSync application closed")
                     event.accept()
             else:
                 # 如果用户选择不再询问，使用保存的默认关闭行为
                 if self.default_close_action == 'minimize':
                     self.hide()
+                    self.set_background_mode(True)
                     self.logger.info("应用程序最小化到系统托盘")
                     event.ignore()
                 else:
                     if self.device_monitor.is_monitoring:
                         self.device_monitor.stop_monitoring()
+                    self.thumbnail_loader.shutdown()
+                    self.scan_jobs.shutdown()
+                    library_index.stop()
                     self.logger.info("CamSync application closed")
                     event.accept()
         else:
             # 如果系统托盘不可见，则正常退出
             if self.device_monitor.is_monitoring:
                 self.device_monitor.stop_monitoring()
+            self.thumbnail_loader.shutdown()
+            self.scan_jobs.shutdown()
+            library_index.stop()
             self.logger.info("CamSync application closed")
             event.accept()
 
 if __name__ == '__main__':
+    # 缩略图进程池在打包后的 Windows 程序中需要
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     # 设置应用程序样式
     app.setStyle('Fusion')
@@ -0,0 +1,220 @@
+import os
+import re
+import zlib
+from card_image import source_stat
+from change_detection import match_fingerprint, REFRESH_RULES
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+# U盘配置中的文件清单（saved_files / unsaved_files）格式：
+#   {相对于目标文件夹的路径（以 / 分隔）: [文件大小, 修改时间（整数秒）]}
+# 相对路径与盘符和挂载点无关，同一张卡换盘符插入时不会被当作新文件；
+# 指纹用于区分格式化后重新编号产生的同名新文件
+
+
+def file_key(folder_path, src_path):
+    """获取文件在清单中的键（相对于文件夹的路径）"""
+    return os.path.relpath(src_path, folder_path).replace(os.sep, '/')
+
+
+def file_fingerprint(src_path):
+    """获取文件指纹 [大小, 修改时间]，无法访问时返回 None"""
+    try:
+        st = source_stat(src_path)
+    except OSError:
+        return None
+    return [st.st_size, int(st.st_mtime)]
+
+
+def is_known(manifest, key, src_path, copy_path=None, rules=None, refreshed=None):
+    """判断文件是否已记录在清单中，键相同且指纹一致才算同一个文件
+
+    指纹按 change_detection.match_fingerprint 比较，允许时间精度和时区偏移的差异
+
+    Args:
+        copy_path: 该文件的备份副本路径，相差整时区偏移时比较部分内容
+        rules: 可选的 Counter，累计各判断规则的次数
+        refreshed: 可选的 dict，按时区偏移判定为同一文件时记录 {键: 当前指纹}，由 refresh_entries 写回清单
+    """
+    if key not in manifest:
+        return False
+    # 从旧版配置迁移的条目没有指纹，仅按路径匹配
+    fingerprint = manifest[key]
+    if fingerprint is None:
+        known, rule = match_fingerprint(src_path, None, None)
+    else:
+        try:
+            st = source_stat(src_path)
+            known, rule = match_fingerprint(src_path, st, fingerprint, copy_path)
+        except OSError:
+            return False
+        if known and rule in REFRESH_RULES and refreshed is not None:
+            refreshed[key] = [st.st_size, int(st.st_mtime)]
+    if rules is not None:
+        rules[rule] += 1
+    return known
+
+
+def refresh_entries(manifest, refreshed):
+    """用按时区偏移判定为同一文件时记录的当前指纹更新清单，返回新的清单（不修改原清单）"""
+    manifest = dict(manifest)
+    for key, fingerprint in (refreshed or {}).items():
+        if key in manifest:
+            manifest[key] = fingerprint
+    return manifest
+
+
+def build_entries(folder_path, src_paths):
+    """为一组源文件生成清单条目"""
+    return {file_key(folder_path, src_path): file_fingerprint(src_path) for src_path in src_paths}
+
+
+def migrate_file_list(entries, folder_name):
+    """将旧版绝对路径列表迁移为清单格式
+
+    旧版记录形如 E:\\DCIM\\100CANON\\IMG_0001.JPG，取文件夹名之后的部分作为键
+    """
+    if isinstance(entries, dict):
+        return entries
+    manifest = {}
+    for path in entries or []:
+        parts = [part for part in re.split(r'[\\/]+', path) if part]
+        lowered = [part.lower() for part in parts]
+        if folder_name.lower() in lowered:
+            index = lowered.index(folder_name.lower())
+            key = '/'.join(parts[index + 1:])
+            if key:
+                manifest[key] = None
+    return manifest
+
+
+# 紧凑清单文件格式：
+#   魔数 b'CSMF' | 版本(1字节) | 压缩算法(1字节) | 压缩后的数据
+# 数据部分按文件夹依次记录 saved_files 和 unsaved_files，条目按键排序后做前缀压缩：
+#   与上一个键的公共前缀长度 | 剩余部分 | 大小+1（0 表示无指纹） | 修改时间
+MANIFEST_MAGIC = b'CSMF'
+MANIFEST_VERSION = 1
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+MANIFEST_LISTS = ('saved_files', 'unsaved_files')
+
+
+def _write_varint(out, value):
+    """写入无符号变长整数"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    """读取无符号变长整数，返回 (值, 新位置)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_str(out, text):
+    raw = text.encode('utf-8')
+    _write_varint(out, len(raw))
+    out.extend(raw)
+
+
+def _read_str(data, pos):
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode('utf-8'), pos + length
+
+
+def encode_manifests(folders, codec=CODEC_ZLIB):
+    """将各文件夹的文件清单编码为紧凑格式
+
+    Args:
+        folders: {文件夹名: {'saved_files': 清单, 'unsaved_files': 清单}}
+        codec: 压缩算法
+
+    Returns:
+        bytes: 编码后的数据
+    """
+    out = bytearray()
+    _write_varint(out, len(folders))
+    for folder_name, lists in folders.items():
+        _write_str(out, folder_name)
+        for list_name in MANIFEST_LISTS:
+            manifest = lists.get(list_name) or {}
+            _write_varint(out, len(manifest))
+            previous = ''
+            for key in sorted(manifest):
+                # 同一目录下的文件共享长前缀，只记录差异部分
+                common = os.path.commonprefix([previous, key])
+                _write_varint(out, len(common))
+                _write_str(out, key[len(common):])
+                previous = key
+                fingerprint = manifest[key]
+                if fingerprint is None:
+                    _write_varint(out, 0)
+                else:
+                    size, mtime = fingerprint
+                    _write_varint(out, size + 1)
+                    # 修改时间按 zigzag 编码，兼容负值
+                    _write_varint(out, (mtime << 1) ^ (mtime >> 63))
+
+    if codec == CODEC_ZSTD and zstd is not None:
+        payload = zstd.ZstdCompressor(level=10).compress(bytes(out))
+    else:
+        codec = CODEC_ZLIB
+        payload = zlib.compress(bytes(out), 6)
+    return MANIFEST_MAGIC + bytes([MANIFEST_VERSION, codec]) + payload
+
+
+def decode_manifests(data):
+    """解码紧凑格式的文件清单
+
+    Returns:
+        dict: {文件夹名: {'saved_files': 清单, 'unsaved_files': 清单}}
+    """
+    if data[:4] != MANIFEST_MAGIC:
+        raise ValueError("不是有效的清单文件")
+    version, codec = data[4], data[5]
+    if version > MANIFEST_VERSION:
+        raise ValueError(f"不支持的清单版本: {version}")
+    if codec == CODEC_ZSTD:
+        if zstd is None:
+            raise ValueError("清单使用 zstd 压缩，但未安装 zstandard 模块")
+        raw = zstd.ZstdDecompressor().decompress(data[6:])
+    elif codec == CODEC_ZLIB:
+        raw = zlib.decompress(data[6:])
+    else:
+        raise ValueError(f"不支持的压缩算法: {codec}")
+
+    folders = {}
+    folder_count, pos = _read_varint(raw, 0)
+    for _ in range(folder_count):
+        folder_name, pos = _read_str(raw, pos)
+        lists = {}
+        for list_name in MANIFEST_LISTS:
+            count, pos = _read_varint(raw, pos)
+            manifest = {}
+            previous = ''
+            for _ in range(count):
+                common, pos = _read_varint(raw, pos)
+                suffix, pos = _read_str(raw, pos)
+                key = previous[:common] + suffix
+                previous = key
+                size, pos = _read_varint(raw, pos)
+                if size == 0:
+                    manifest[key] = None
+                else:
+                    mtime, pos = _read_varint(raw, pos)
+                    manifest[key] = [size - 1, (mtime >> 1) ^ -(mtime & 1)]
+            lists[list_name] = manifest
+        folders[folder_name] = lists
+    return folders
@@ -0,0 +1,421 @@
+import os
+import re
+import json
+import struct
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from destinations import destination_backends
+from card_image import open_source, source_stat
+
+# 目标目录布局
+LAYOUT_MIRROR = 'mirror'            # 与存储卡目录结构一致
+LAYOUT_DATE = 'date'                # 拍摄日期：YYYY/YYYY-MM-DD/文件名
+LAYOUT_DATE_CAMERA = 'date_camera'  # 拍摄日期和相机：YYYY/YYYY-MM-DD/相机型号/文件名
+
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+TIFF_EXTENSIONS = {'.cr2', '.nef', '.nrw', '.arw', '.srf', '.sr2', '.dng', '.tif', '.tiff',
+                   '.orf', '.rw2', '.pef', '.srw', '.erf', '.3fr', '.iiq'}
+BMFF_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.3gp', '.cr3', '.heic', '.heif'}
+
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_MODEL = 0x0110
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_DATETIME_DIGITIZED = 0x9004
+
+# 解析时的读取上限，防止损坏的文件导致大量读取
+MAX_IFD_ENTRIES = 512
+MAX_JPEG_MARKERS = 32
+MAX_BOXES = 64
+MAX_IFDS = 16
+MAX_PREVIEW_BYTES = 8 * 1024 * 1024
+MIN_PREVIEW_BYTES = 1024
+
+# MP4/MOV 的 mvhd 创建时间为自 1904 年起的 UTC 秒数
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# 元数据缓存格式版本，解析结果的含义变化时递增，旧缓存整体丢弃
+METADATA_CACHE_VERSION = 2
+
+
+def _read_ifd(f, base, offset, order):
+    """读取一个 TIFF IFD，返回 {标签: (类型, 数量, 值字段)}"""
+    f.seek(base + offset)
+    raw = f.read(2)
+    if len(raw) < 2:
+        return {}
+    count = min(struct.unpack(order + 'H', raw)[0], MAX_IFD_ENTRIES)
+    data = f.read(count * 12)
+    entries = {}
+    for i in range(len(data) // 12):
+        tag, value_type, value_count = struct.unpack(order + 'HHI', data[i * 12:i * 12 + 8])
+        entries[tag] = (value_type, value_count, data[i * 12 + 8:i * 12 + 12])
+    return entries
+
+
+def _read_next_ifd(f, base, offset, order):
+    """读取 IFD 链中下一个 IFD 的偏移，没有时返回 0"""
+    f.seek(base + offset)
+    raw = f.read(2)
+    if len(raw) < 2:
+        return 0
+    count = min(struct.unpack(order + 'H', raw)[0], MAX_IFD_ENTRIES)
+    f.seek(base + offset + 2 + count * 12)
+    raw = f.read(4)
+    return struct.unpack(order + 'I', raw)[0] if len(raw) == 4 else 0
+
+
+def _read_uints(f, base, entry, order):
+    """读取 SHORT/LONG 类型的标签值列表"""
+    if not entry or entry[0] not in (3, 4):
+        return []
+    value_type, count, value = entry
+    fmt = 'H' if value_type == 3 else 'I'
+    width = struct.calcsize(fmt)
+    count = min(count, MAX_IFD_ENTRIES)
+    if count * width <= 4:
+        raw = value[:count * width]
+    else:
+        f.seek(base + struct.unpack(order + 'I', value)[0])
+        raw = f.read(count * width)
+    return list(struct.unpack(order + fmt * (len(raw) // width), raw[:len(raw) // width * width]))
+
+
+def _read_ascii(f, base, entry, order):
+    """读取 ASCII 类型的标签值"""
+    if not entry or entry[0] != 2:
+        return None
+    _, count, value = entry
+    if count <= 4:
+        raw = value[:count]
+    else:
+        f.seek(base + struct.unpack(order + 'I', value)[0])
+        raw = f.read(min(count, 256))
+    text = raw.split(b'\0', 1)[0].decode('ascii', 'ignore').strip()
+    return text or None
+
+
+def _parse_exif_datetime(text):
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def _parse_tiff(f, base):
+    """从 TIFF 结构（EXIF 或 TIFF 格式的 RAW）中读取拍摄时间和相机型号"""
+    f.seek(base)
+    header = f.read(8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return None, None
+    order = '<' if header[:2] == b'II' else '>'
+    ifd0 = _read_ifd(f, base, struct.unpack(order + 'I', header[4:8])[0], order)
+
+    model = _read_ascii(f, base, ifd0.get(TAG_MODEL), order)
+    captured = None
+    exif_entry = ifd0.get(TAG_EXIF_IFD)
+    if exif_entry:
+        exif = _read_ifd(f, base, struct.unpack(order + 'I', exif_entry[2])[0], order)
+        captured = (_parse_exif_datetime(_read_ascii(f, base, exif.get(TAG_DATETIME_ORIGINAL), order)) or
+                    _parse_exif_datetime(_read_ascii(f, base, exif.get(TAG_DATETIME_DIGITIZED), order)))
+    if captured is None:
+        captured = _parse_exif_datetime(_read_ascii(f, base, ifd0.get(TAG_DATETIME), order))
+    return captured, model
+
+
+def _find_tiff_previews(f, base):
+    """在 TIFF 结构的 IFD 链和子 IFD 中查找内嵌的 JPEG 预览图，返回 [(偏移, 长度), ...]"""
+    f.seek(base)
+    header = f.read(8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return []
+    order = '<' if header[:2] == b'II' else '>'
+    previews = []
+    pending = [struct.unpack(order + 'I', header[4:8])[0]]
+    visited = set()
+    while pending and len(visited) < MAX_IFDS:
+        offset = pending.pop(0)
+        if not offset or offset in visited:
+            continue
+        visited.add(offset)
+        ifd = _read_ifd(f, base, offset, order)
+        # EXIF 缩略图、NEF/DNG 等格式的预览图
+        offsets = _read_uints(f, base, ifd.get(TAG_JPEG_OFFSET), order)
+        lengths = _read_uints(f, base, ifd.get(TAG_JPEG_LENGTH), order)
+        if offsets and lengths:
+            previews.append((offsets[0], lengths[0]))
+        # CR2 等格式的预览图以 JPEG 压缩的单条带存储
+        compression = _read_uints(f, base, ifd.get(TAG_COMPRESSION), order)
+        strips = _read_uints(f, base, ifd.get(TAG_STRIP_OFFSETS), order)
+        strip_lengths = _read_uints(f, base, ifd.get(TAG_STRIP_BYTE_COUNTS), order)
+        if compression in ([6], [7]) and len(strips) == 1 and len(strip_lengths) == 1:
+            previews.append((strips[0], strip_lengths[0]))
+        pending.extend(_read_uints(f, base, ifd.get(TAG_SUB_IFDS), order))
+        pending.append(_read_next_ifd(f, base, offset, order))
+    return [(base + offset, length) for offset, length in previews
+            if MIN_PREVIEW_BYTES <= length <= MAX_PREVIEW_BYTES]
+
+
+def _find_jpeg_exif(f):
+    """查找 JPEG 中 EXIF（APP1）的 TIFF 结构起始位置，没有时返回 None"""
+    if f.read(2) != b'\xff\xd8':
+        return None
+    position = 2
+    for _ in range(MAX_JPEG_MARKERS):
+        f.seek(position)
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            break
+        length = struct.unpack('>H', marker[2:4])[0]
+        if marker[1] == 0xE1 and f.read(6) == b'Exif\0\0':
+            return position + 10
+        # 图像数据开始，之后不会再有 EXIF
+        if marker[1] == 0xDA:
+            break
+        position += 2 + length
+    return None
+
+
+def _parse_jpeg(f):
+    """逐个跳过 JPEG 标记段，找到 APP1 中的 EXIF 后按 TIFF 结构解析"""
+    base = _find_jpeg_exif(f)
+    if base is None:
+        return None, None
+    return _parse_tiff(f, base)
+
+
+def _iter_boxes(f, start, end):
+    """遍历 ISO BMFF（MP4/MOV）的盒子，返回 (类型, 内容起始位置, 盒子结束位置)"""
+    position = start
+    for _ in range(MAX_BOXES):
+        if end is not None and position + 8 > end:
+            return
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        content = position + 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            content += 8
+        elif size == 0:
+            # 盒子一直延伸到文件结尾
+            yield box_type, content, end
+            return
+        if size < 8:
+            return
+        yield box_type, content, position + size
+        position += size
+
+
+def _parse_bmff(f):
+    """从 moov/mvhd 中读取创建时间，只读取各盒子的头部"""
+    for box_type, content, box_end in _iter_boxes(f, 0, None):
+        if box_type != b'moov':
+            continue
+        for child_type, child_content, _ in _iter_boxes(f, content, box_end):
+            if child_type != b'mvhd':
+                continue
+            f.seek(child_content)
+            data = f.read(12)
+            if len(data) < 12:
+                return None, None
+            if data[0] == 1:
+                seconds = struct.unpack('>Q', data[4:12])[0]
+            else:
+                seconds = struct.unpack('>I', data[4:8])[0]
+            if not seconds:
+                return None, None
+            # 与 EXIF 的拍摄时间一致，换算为本地时间（按该日期的时区偏移，含夏令时）
+            try:
+                return (MP4_EPOCH + timedelta(seconds=seconds)).astimezone().replace(tzinfo=None), None
+            except (OverflowError, OSError, ValueError):
+                return None, None
+        break
+    return None, None
+
+
+def read_capture_info(path):
+    """读取文件的拍摄时间和相机型号，只读取文件头部的少量数据
+
+    Returns:
+        tuple: (拍摄时间 datetime 或 None, 相机型号或 None)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open_source(path, buffering=-1) as f:
+            if ext in JPEG_EXTENSIONS:
+                return _parse_jpeg(f)
+            if ext in TIFF_EXTENSIONS:
+                return _parse_tiff(f, 0)
+            if ext in BMFF_EXTENSIONS:
+                return _parse_bmff(f)
+    except (OSError, struct.error, ValueError, OverflowError):
+        pass
+    return None, None
+
+
+def read_embedded_preview(path):
+    """读取 JPEG 的 EXIF 缩略图或 RAW 文件中内嵌的预览图，只读取文件头部和预览图本身
+
+    选择其中最小的一张，足够生成列表中的缩略图；在进程池中调用，不依赖 Qt
+
+    Returns:
+        bytes: JPEG 数据，没有内嵌预览图时返回 b''
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open_source(path, buffering=-1) as f:
+            if ext in JPEG_EXTENSIONS:
+                base = _find_jpeg_exif(f)
+                previews = _find_tiff_previews(f, base) if base is not None else []
+            elif ext in TIFF_EXTENSIONS:
+                previews = _find_tiff_previews(f, 0)
+            else:
+                previews = []
+            for offset, length in sorted(previews, key=lambda preview: preview[1]):
+                f.seek(offset)
+                data = f.read(length)
+                if data[:2] == b'\xff\xd8':
+                    return data
+    except (OSError, struct.error, ValueError, OverflowError):
+        pass
+    return b''
+
+
+class MetadataCache:
+    """元数据缓存，按文件名和指纹（大小、修改时间）缓存拍摄时间和相机型号，保存在本地配置目录"""
+    def __init__(self, cache_path, max_entries=200000):
+        self.logger = logging.getLogger('CamSync')
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                # 旧版缓存中视频的拍摄时间是未换算的 UTC 时间
+                if entries.pop('__version__', 1) == METADATA_CACHE_VERSION:
+                    self._entries = entries
+            except Exception as e:
+                self.logger.error(f"加载元数据缓存时发生错误: {str(e)}")
+
+    def get_capture_info(self, src_path):
+        """获取文件的拍摄时间和相机型号，缓存未命中时读取文件头部"""
+        st = source_stat(src_path)
+        key = f"{os.path.basename(src_path)}|{st.st_size}|{int(st.st_mtime)}"
+        with self._lock:
+            self._load()
+            cached = self._entries.get(key)
+        if cached is not None:
+            captured = datetime.fromisoformat(cached[0]) if cached[0] else None
+            return captured, cached[1], st
+
+        captured, model = read_capture_info(src_path)
+        with self._lock:
+            self._entries[key] = [captured.isoformat() if captured else None, model]
+            self._dirty = True
+        return captured, model, st
+
+    def save(self):
+        """保存缓存，超过上限时丢弃最早的条目"""
+        with self._lock:
+            if not self._dirty:
+                return
+            if len(self._entries) > self.max_entries:
+                keys = list(self._entries)
+                for key in keys[:len(keys) - self.max_entries]:
+                    del self._entries[key]
+            try:
+                with open(self.cache_path, 'w', encoding='utf-8') as f:
+                    json.dump(dict(self._entries, __version__=METADATA_CACHE_VERSION), f, ensure_ascii=False)
+                self._dirty = False
+            except Exception as e:
+                self.logger.error(f"保存元数据缓存时发生错误: {str(e)}")
+
+
+class DestinationLayout:
+    """按拍摄日期（和相机型号）重新规划目标路径"""
+    def __init__(self, layout, dest_dirs, cache, max_workers=8):
+        self.logger = logging.getLogger('CamSync')
+        self.layout = layout
+        self.dest_dirs = dest_dirs if isinstance(dest_dirs, (list, tuple)) else [dest_dirs]
+        self.cache = cache
+        self.max_workers = max_workers
+        self._planned = set()  # 本次已规划的目标路径，用于避免同名文件互相覆盖
+        self._lock = threading.Lock()
+
+    def _sub_dir(self, captured, model):
+        parts = [captured.strftime('%Y'), captured.strftime('%Y-%m-%d')]
+        if self.layout == LAYOUT_DATE_CAMERA:
+            # 相机型号中可能含有文件名中不允许的字符
+            parts.append(re.sub(r'[<>:"/\\|?*]', '_', model).strip() if model else 'Unknown')
+        return os.path.join(*parts)
+
+    def _exists_with_other_size(self, path, size):
+        existing = destination_backends.for_path(path).stat(path)
+        return existing is not None and existing[0] != size
+
+    def _resolve_conflict(self, dest_path, size):
+        """不同存储卡上的同名文件放在同一天时，为后来者添加序号"""
+        stem, ext = os.path.splitext(dest_path)
+        candidate = dest_path
+        index = 1
+        with self._lock:
+            while candidate in self._planned or self._exists_with_other_size(candidate, size):
+                candidate = f"{stem}_{index}{ext}"
+                index += 1
+            self._planned.add(candidate)
+        return candidate
+
+    def _plan_one(self, src_path):
+        try:
+            captured, model, st = self.cache.get_capture_info(src_path)
+        except OSError as e:
+            self.logger.warning(f"读取文件元数据失败: {src_path}, 错误: {str(e)}")
+            return None
+        if captured is None:
+            # 没有拍摄时间时使用文件修改时间
+            captured = datetime.fromtimestamp(st.st_mtime)
+        sub_dir = self._sub_dir(captured, model)
+        name = os.path.basename(src_path)
+        dest_paths = [self._resolve_conflict(os.path.join(dest_dir, sub_dir, name), st.st_size)
+                      for dest_dir in self.dest_dirs]
+        return dest_paths[0] if len(dest_paths) == 1 else tuple(dest_paths)
+
+    def plan(self, items, save_cache=True):
+        """批量规划目标路径，文件头部读取在线程池中并发进行
+
+        Args:
+            items: [(src_path, dest_path), ...]
+            save_cache: 是否在规划后保存元数据缓存（分批规划时可在最后统一保存）
+
+        Returns:
+            list: 目标路径重新规划后的 [(src_path, dest_path), ...]
+        """
+        if self.layout == LAYOUT_MIRROR or not items:
+            return list(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            planned = list(executor.map(self._plan_one, [src_path for src_path, _ in items]))
+        if save_cache:
+            self.cache.save()
+        # 无法读取的文件保留原目标路径
+        return [(src_path, new_dest or dest_path) for (src_path, dest_path), new_dest in zip(items, planned)]
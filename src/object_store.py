@@ -0,0 +1,145 @@
+import hmac
+import hashlib
+import threading
+import http.client
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import urlparse, quote
+
+# 对象存储路径格式：s3://存储桶/前缀
+OBJECT_URL_PREFIX = 's3://'
+
+
+class ObjectStoreError(OSError):
+    """对象存储请求失败，继承 OSError，复制流程按普通写入错误处理"""
+
+
+def is_object_url(path):
+    """判断路径是否为对象存储路径"""
+    return isinstance(path, str) and path.lower().startswith(OBJECT_URL_PREFIX)
+
+
+def split_object_url(path):
+    """将对象存储路径拆分为 (存储桶, 对象键)，Windows 上 os.path.join 产生的 \\ 统一为 /"""
+    rest = path[len(OBJECT_URL_PREFIX):].replace('\\', '/')
+    bucket, _, key = rest.partition('/')
+    return bucket, key.strip('/')
+
+
+def sign_v4(secret_key, region, amz_date, canonical_request):
+    """按 AWS 签名 V4 计算规范请求的签名，返回 (凭证范围, 签名)"""
+    date = amz_date[:8]
+    scope = f"{date}/{region}/s3/aws4_request"
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+    key = ('AWS4' + secret_key).encode('utf-8')
+    for part in (date, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    return scope, hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _strip_namespace(element):
+    for node in element.iter():
+        if '}' in node.tag:
+            node.tag = node.tag.split('}', 1)[1]
+    return element
+
+
+class ObjectStoreClient:
+    """S3 兼容对象存储的最小客户端（路径风格请求、AWS 签名 V4），每个线程复用一个长连接"""
+    def __init__(self, endpoint, access_key='', secret_key='', region='us-east-1', timeout=60):
+        parsed = urlparse(endpoint)
+        self.secure = parsed.scheme == 'https'
+        self.host = parsed.netloc
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self, renew=False):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or renew:
+            if connection is not None:
+                connection.close()
+            connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            connection = connection_class(self.host, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _sign(self, method, path, query, headers, payload_hash):
+        """按 AWS 签名 V4 计算 Authorization 头"""
+        amz_date = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        if not self.access_key:
+            return
+        signed = sorted(name.lower() for name in headers)
+        canonical_headers = ''.join(f"{name}:{str(headers[name]).strip()}\n" for name in signed)
+        canonical_request = '\n'.join([method, path, query, canonical_headers, ';'.join(signed), payload_hash])
+        scope, signature = sign_v4(self.secret_key, self.region, amz_date, canonical_request)
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+
+    def _request(self, method, bucket, key='', params=None, body=b'', headers=None):
+        """发送请求，返回 (状态码, 响应头, 响应内容)；连接断开时重连重试一次"""
+        path = '/' + quote(bucket, safe='') + ('/' + quote(key, safe='/~') if key else '')
+        query = '&'.join(f"{quote(name, safe='~')}={quote(str(value), safe='~')}"
+                         for name, value in sorted((params or {}).items()))
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        headers['host'] = self.host
+        self._sign(method, path, query, headers, hashlib.sha256(body).hexdigest())
+        url = path + ('?' + query if query else '')
+        for attempt in range(2):
+            try:
+                connection = self._connection(renew=attempt > 0)
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                if attempt:
+                    raise ObjectStoreError(f"对象存储请求失败: {method} {path}: {str(e)}")
+        if response.status >= 300:
+            raise ObjectStoreError(f"对象存储返回错误 {response.status}: {method} {path}: {data[:200]!r}")
+        return response.status, response.headers, data
+
+    def put_object(self, bucket, key, data, metadata=None):
+        headers = {f"x-amz-meta-{name}": value for name, value in (metadata or {}).items()}
+        self._request('PUT', bucket, key, body=bytes(data), headers=headers)
+
+    def create_multipart_upload(self, bucket, key, metadata=None):
+        headers = {f"x-amz-meta-{name}": value for name, value in (metadata or {}).items()}
+        _, _, data = self._request('POST', bucket, key, {'uploads': ''}, headers=headers)
+        return _strip_namespace(ET.fromstring(data)).findtext('UploadId')
+
+    def upload_part(self, bucket, key, upload_id, part_number, data):
+        _, headers, _ = self._request('PUT', bucket, key, {'partNumber': part_number, 'uploadId': upload_id},
+                                      body=bytes(data))
+        return headers.get('ETag', '')
+
+    def complete_multipart_upload(self, bucket, key, upload_id, etags):
+        parts = ''.join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                        for number, etag in enumerate(etags, 1))
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode('utf-8')
+        self._request('POST', bucket, key, {'uploadId': upload_id}, body=body)
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        self._request('DELETE', bucket, key, {'uploadId': upload_id})
+
+    def list_objects(self, bucket, prefix):
+        """列出前缀下一层的对象，返回 {名称: (大小, 修改时间)}，一次请求最多返回 1000 个对象"""
+        objects = {}
+        params = {'list-type': 2, 'prefix': prefix, 'delimiter': '/'}
+        while True:
+            _, _, data = self._request('GET', bucket, params=params)
+            root = _strip_namespace(ET.fromstring(data))
+            for content in root.findall('Contents'):
+                name = content.findtext('Key')[len(prefix):]
+                modified = datetime.strptime(content.findtext('LastModified')[:19], '%Y-%m-%dT%H:%M:%S')
+                # LastModified 为上传时间且只精确到秒，向上取整，避免同一秒内修改的源文件被当作更新
+                objects[name] = (int(content.findtext('Size')), modified.replace(tzinfo=timezone.utc).timestamp() + 1)
+            token = root.findtext('NextContinuationToken')
+            if root.findtext('IsTruncated') != 'true' or not token:
+                return objects
+            params['continuation-token'] = token
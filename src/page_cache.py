@@ -0,0 +1,106 @@
+import os
+import sys
+import mmap
+import psutil
+
+# 大文件复制模式
+LARGE_FILE_BUFFERED = 'buffered'  # 普通缓冲读写
+LARGE_FILE_NOCACHE = 'nocache'    # 顺序读取提示，读写过的数据及时从页面缓存中释放
+LARGE_FILE_DIRECT = 'direct'      # O_DIRECT 绕过页面缓存，不支持时退回 nocache
+LARGE_FILE_MODES = (LARGE_FILE_BUFFERED, LARGE_FILE_NOCACHE, LARGE_FILE_DIRECT)
+
+# O_DIRECT 要求缓冲区地址、读写长度和文件偏移按此对齐
+DIRECT_ALIGNMENT = 4096
+# 每读写这么多数据释放一次页面缓存
+CACHE_DROP_WINDOW = 64 * 1024 * 1024
+
+
+def align_up(value, alignment=DIRECT_ALIGNMENT):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def supports_direct_io():
+    return hasattr(os, 'O_DIRECT')
+
+
+def open_direct(path, flags):
+    """以 O_DIRECT 方式打开文件（用作 open 的 opener 参数），文件系统不支持时抛出 OSError"""
+    return os.open(path, flags | os.O_DIRECT)
+
+
+def aligned_buffer(size):
+    """分配按页对齐的缓冲区（匿名内存映射），供 O_DIRECT 读写使用"""
+    return mmap.mmap(-1, align_up(size))
+
+
+def advise_sequential(fd):
+    """提示操作系统按顺序读取整个文件，不支持的平台上忽略"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def drop_cache(fd, offset, length):
+    """提示操作系统释放指定范围的页面缓存，脏页会先开始回写，不支持的平台上忽略"""
+    if hasattr(os, 'posix_fadvise') and length > 0:
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+class CacheDropper:
+    """按窗口释放已读写数据的页面缓存
+
+    写入的数据是脏页，第一次 DONTNEED 只会触发回写；落后两个窗口时再次释放，
+    此时数据通常已写回磁盘，可以真正从缓存中移除
+    """
+    def __init__(self, fd, window=CACHE_DROP_WINDOW, lag=1):
+        self.fd = fd
+        self.window = window
+        self.lag = lag          # 释放时落后的窗口数（读取时为 0，写入时为 1）
+        self._next = window     # 下一次释放的位置
+        self._dropped = 0       # 已释放的位置
+
+    def advance(self, offset):
+        """已读写到 offset，跨过窗口边界时释放落后的部分"""
+        if offset < self._next:
+            return
+        self._next = offset + self.window
+        end = max(0, offset - self.lag * self.window)
+        # 最近一个窗口先触发回写，再释放更早的、已回写的部分
+        drop_cache(self.fd, end, offset - end)
+        drop_cache(self.fd, self._dropped, end - self._dropped)
+        self._dropped = end
+
+    def finish(self):
+        """文件读写完成（同步到磁盘之后）时释放整个文件的缓存"""
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                # 长度为 0 表示到文件结尾
+                os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+
+
+def memory_footprint():
+    """获取进程峰值内存和系统页面缓存大小（字节），无法获取的项为 None"""
+    peak_rss = None
+    cached = None
+    try:
+        memory = psutil.Process().memory_info()
+        # Windows 提供峰值工作集；其他平台使用 getrusage
+        peak_rss = getattr(memory, 'peak_wset', None)
+        if peak_rss is None:
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS 以字节为单位，Linux 以 KB 为单位
+            if sys.platform != 'darwin':
+                peak_rss *= 1024
+        # 页面缓存大小只在 Linux 等平台上提供
+        cached = getattr(psutil.virtual_memory(), 'cached', None)
+    except Exception:
+        pass
+    return peak_rss, cached
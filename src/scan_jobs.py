@@ -0,0 +1,137 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, pyqtSignal
+from change_detection import RULE_NAMES, RULE_EXACT, RULE_LEGACY
+
+# 扫描线程数：多张卡同时插入时并行扫描
+SCAN_WORKERS = 4
+
+
+class ScanJobs(QObject):
+    """设备扫描任务：在线程池中检查目标文件夹、读取U盘配置、扫描文件并与清单比较，
+    结果通过信号回到界面线程；设备移除时取消该设备尚未完成的扫描
+
+    扫描请求为 dict，至少包含 device_path、folder_path、dest_dir、matcher、dir_index、
+    saved_files、unsaved_files、missing_destinations 和 layout，扫描完成后加入 file_table 和 new_rows
+    """
+    device_scanned = pyqtSignal(object)  # {'device_path', 'device_name', 'volume_id', 'folders', 'config_data'}
+    folder_scanned = pyqtSignal(object)  # 扫描请求加上 file_table、new_rows
+    _device_done = pyqtSignal(object)
+    _folder_done = pyqtSignal(object)
+
+    def __init__(self, device_monitor, config_manager, file_operations, parent=None, max_workers=SCAN_WORKERS):
+        super().__init__(parent)
+        self.logger = logging.getLogger('CamSync')
+        self.device_monitor = device_monitor
+        self.config_manager = config_manager
+        self.file_operations = file_operations
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._cancel_events = {}  # 设备路径 -> 取消事件，设备重新插入时替换
+        self._futures = {}        # 设备路径 -> 尚未完成的 Future
+        self._lock = threading.Lock()
+        # 工作线程中发出的信号按队列方式投递到界面线程，在那里再检查一次是否已取消
+        self._device_done.connect(self._on_device_done)
+        self._folder_done.connect(self._on_folder_done)
+
+    def submit_device(self, device_path, device_name):
+        """检查新插入设备上的目标文件夹并读取U盘配置，结果通过 device_scanned 信号返回"""
+        cancel_event = threading.Event()
+        with self._lock:
+            previous = self._cancel_events.get(device_path)
+            if previous is not None:
+                previous.set()
+            self._cancel_events[device_path] = cancel_event
+        self._submit(device_path, self._scan_device, device_path, device_name, cancel_event)
+
+    def submit_folder(self, request):
+        """扫描文件夹并找出新文件，结果通过 folder_scanned 信号返回"""
+        device_path = request['device_path']
+        with self._lock:
+            cancel_event = self._cancel_events.setdefault(device_path, threading.Event())
+        request['cancel_event'] = cancel_event
+        self._submit(device_path, self._scan_folder, request)
+
+    def _submit(self, device_path, fn, *args):
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError as e:
+            # 线程池已关闭（程序正在退出）
+            self.logger.warning(f"提交扫描任务失败: {str(e)}")
+            return
+        with self._lock:
+            self._futures.setdefault(device_path, set()).add(future)
+        future.add_done_callback(lambda f, device_path=device_path: self._forget(device_path, f))
+
+    def _forget(self, device_path, future):
+        with self._lock:
+            futures = self._futures.get(device_path)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._futures[device_path]
+
+    def cancel(self, device_path):
+        """取消设备的扫描任务：未开始的任务不再执行，正在进行的扫描在下一个目录处停止，已完成的结果被丢弃"""
+        with self._lock:
+            cancel_event = self._cancel_events.pop(device_path, None)
+            futures = list(self._futures.get(device_path, ()))
+        if cancel_event is not None:
+            cancel_event.set()
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self):
+        """取消所有扫描并关闭线程池（程序退出时调用）"""
+        with self._lock:
+            devices = list(self._cancel_events)
+        for device_path in devices:
+            self.cancel(device_path)
+        self._executor.shutdown(wait=False)
+
+    def _scan_device(self, device_path, device_name, cancel_event):
+        result = {'device_path': device_path, 'device_name': device_name, 'cancel_event': cancel_event,
+                  'volume_id': None, 'folders': [], 'config_data': None}
+        try:
+            result['folders'] = self.device_monitor.check_target_folders(device_path)
+            if result['folders'] and not cancel_event.is_set():
+                result['volume_id'] = self.device_monitor.get_volume_id(device_path)
+                result['config_data'] = self.config_manager.read_usb_config(device_path)
+        except Exception as e:
+            self.logger.error(f"扫描设备 {device_path} 时发生错误: {str(e)}")
+        if not cancel_event.is_set():
+            self._device_done.emit(result)
+
+    def _scan_folder(self, request):
+        cancel_event = request['cancel_event']
+        try:
+            file_table = self.file_operations.scan_file_table(request['folder_path'], request['dest_dir'],
+                                                              request['matcher'], request['dir_index'], cancel_event)
+            if cancel_event.is_set():
+                return
+            new_rows = file_table.mark_new(request['saved_files'], request['unsaved_files'],
+                                           request['missing_destinations'])
+            if any(rule not in (RULE_EXACT, RULE_LEGACY) for rule in file_table.match_rules):
+                self.logger.info(f"{request['folder_path']} 文件清单比较: " + "，".join(
+                    f"{RULE_NAMES[rule]} {count}" for rule, count in file_table.match_rules.most_common()))
+            for row in new_rows:
+                # 新文件记入清单前不保存其所在目录的指纹
+                request['dir_index'].mark_pending(file_table.src_path(row))
+            if request['layout']:
+                file_table.plan_destinations(request['layout'], new_rows)
+        except Exception as e:
+            self.logger.error(f"扫描文件夹 {request['folder_path']} 时发生错误: {str(e)}")
+            file_table = None
+            new_rows = []
+        if not cancel_event.is_set():
+            request['file_table'] = file_table
+            request['new_rows'] = new_rows
+            self._folder_done.emit(request)
+
+    def _on_device_done(self, result):
+        if not result['cancel_event'].is_set():
+            self.device_scanned.emit(result)
+
+    def _on_folder_done(self, request):
+        if not request['cancel_event'].is_set():
+            self.folder_scanned.emit(request)
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from object_store import OBJECT_URL_PREFIX, is_object_url, split_object_url
+from card_image import is_image_path, split_image_path
+
+# 文件大小分档（字节上限），第一档与小文件批量复制的阈值一致
+SIZE_BANDS = [
+    (256 * 1024, '<256K'),
+    (8 * 1024 * 1024, '256K-8M'),
+    (64 * 1024 * 1024, '8M-64M'),
+    (float('inf'), '>=64M')
+]
+# 每次提交新会话时旧样本的权重，使模型跟随读卡器、存储卡和目标磁盘的变化
+DECAY = 0.7
+# 某一档的加权样本数不少于此值时才使用该档的模型
+MIN_SAMPLES = 3
+# 没有历史记录时的默认速度（字节/秒）和单文件开销（秒）
+DEFAULT_RATE = 30 * 1024 * 1024
+DEFAULT_OVERHEAD = 0.02
+# ETA 校准系数的范围，避免开头几个文件的偶然快慢使预计时间大幅跳动
+MIN_SCALE = 0.25
+MAX_SCALE = 4.0
+
+
+def size_band(size):
+    for index, (limit, _) in enumerate(SIZE_BANDS):
+        if size < limit:
+            return index
+    return len(SIZE_BANDS) - 1
+
+
+def volume_key(path):
+    """路径所在的卷：盘符、挂载点、存储卡镜像文件或对象存储桶，用作读卡器和目标磁盘的标识"""
+    if is_object_url(path):
+        return OBJECT_URL_PREFIX + split_object_url(path)[0]
+    if is_image_path(path):
+        return split_image_path(path)[0]
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    if drive:
+        return drive.upper()
+    probe = os.path.abspath(path)
+    while not os.path.ismount(probe):
+        parent = os.path.dirname(probe)
+        if parent == probe:
+            break
+        probe = parent
+    return probe
+
+
+def format_duration(seconds):
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600} 小时 {seconds % 3600 // 60} 分"
+    if seconds >= 60:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds} 秒"
+
+
+def _new_bands():
+    # 每档的加权最小二乘累加量 [样本数, Σ大小, Σ耗时, Σ大小², Σ大小×耗时]
+    return [[0.0] * 5 for _ in SIZE_BANDS]
+
+
+def _fit(band):
+    """按单文件耗时 = 开销 + 大小 / 速度拟合，返回 (开销 秒, 每字节耗时 秒)，样本不足时返回 None"""
+    n, sx, sy, sxx, sxy = band
+    if n < MIN_SAMPLES or sx <= 0:
+        return None
+    denominator = n * sxx - sx * sx
+    if denominator > 1e-9 * n * sxx:
+        per_byte = (n * sxy - sx * sy) / denominator
+        overhead = (sy - per_byte * sx) / n
+        if per_byte > 0 and overhead >= 0:
+            return overhead, per_byte
+    # 文件大小相近无法分离开销时，全部按速度计算
+    return 0.0, sy / sx
+
+
+class ThroughputSession:
+    """一次复制任务的吞吐量样本，复制线程并发记录
+
+    每个样本的耗时按记录时同时进行的复制数折算为占用的墙钟时间，多线程复制时各文件的预计耗时之和
+    即为任务的预计总时间
+    """
+    def __init__(self, volume_id=None):
+        self.volume_id = volume_id
+        self.keys = None           # 第一次记录时按源路径和目标路径确定
+        self.bands = _new_bands()
+        self.files = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """开始复制一个文件（或一批小文件），返回同时进行的复制数"""
+        with self._lock:
+            self._active += 1
+            return self._active
+
+    def record(self, src_path, dest_path, sizes, elapsed, concurrency):
+        """记录复制完成的文件，sizes 为这些文件的大小，elapsed 为复制它们的总耗时"""
+        if isinstance(dest_path, (list, tuple)):
+            dest_path = dest_path[0]
+        share = elapsed / max(1, concurrency) / max(1, len(sizes))
+        with self._lock:
+            self._active -= 1
+            if self.keys is None:
+                self.keys = ['all', f"reader:{volume_key(src_path)}", f"destination:{volume_key(dest_path)}"]
+                if self.volume_id:
+                    self.keys.append(f"device:{self.volume_id}")
+            for size in sizes:
+                band = self.bands[size_band(size)]
+                band[0] += 1
+                band[1] += size
+                band[2] += share
+                band[3] += size * size
+                band[4] += size * share
+            self.files += len(sizes)
+            self.bytes += sum(sizes)
+
+    def cancel(self):
+        """复制失败时不记录样本"""
+        with self._lock:
+            self._active -= 1
+
+
+class ThroughputHistory:
+    """按存储卡（卷标识）、读卡器（源所在的卷）和目标磁盘记录的历史复制速度，保存在本地配置目录
+
+    每个标识按文件大小分档拟合单文件开销和速度，用于复制前和复制中预计剩余时间
+    """
+    def __init__(self, history_path):
+        self.logger = logging.getLogger('CamSync')
+        self.history_path = history_path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if os.path.exists(self.history_path):
+            try:
+                with open(self.history_path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception as e:
+                self.logger.error(f"加载吞吐量历史时发生错误: {str(e)}")
+
+    def commit(self, session):
+        """将一次复制任务的样本并入各标识的历史（旧样本按 DECAY 衰减）并保存"""
+        if not session.files or not session.keys:
+            return
+        with self._lock:
+            self._load()
+            for key in session.keys:
+                entry = self._entries.setdefault(key, {'bands': _new_bands(), 'sessions': 0})
+                for old, new in zip(entry['bands'], session.bands):
+                    for i in range(5):
+                        old[i] = old[i] * DECAY + new[i]
+                entry['sessions'] += 1
+                entry['updated'] = datetime.now().isoformat(timespec='seconds')
+            try:
+                with open(self.history_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f)
+            except Exception as e:
+                self.logger.error(f"保存吞吐量历史时发生错误: {str(e)}")
+        elapsed = time.perf_counter() - session.started
+        if elapsed > 0:
+            self.logger.info(f"本次复制 {session.files} 个文件，平均 {session.bytes / elapsed / (1024 * 1024):.1f} MB/s，"
+                             f"已记入吞吐量历史: {', '.join(session.keys[1:])}")
+
+    def models(self, keys):
+        """获取各档的模型 [(开销, 每字节耗时), ...]
+
+        同一档有多个标识的历史时取预计最慢的一个（读卡器、存储卡和目标磁盘中最慢的决定速度），
+        都没有时使用全部历史，仍没有时使用默认值
+        """
+        with self._lock:
+            self._load()
+            entries = [self._entries[key] for key in keys if key in self._entries]
+            overall = self._entries.get('all')
+        models = []
+        for index, (limit, _) in enumerate(SIZE_BANDS):
+            # 比较时使用该档的典型大小
+            typical = min(limit, 256 * 1024 * 1024) / 2
+            fits = [fit for fit in (_fit(entry['bands'][index]) for entry in entries) if fit]
+            if not fits and overall:
+                fit = _fit(overall['bands'][index])
+                fits = [fit] if fit else []
+            if fits:
+                models.append(max(fits, key=lambda fit: fit[0] + fit[1] * typical))
+            else:
+                models.append((DEFAULT_OVERHEAD, 1.0 / DEFAULT_RATE))
+        return models
+
+    def summary(self, key):
+        """某个标识各档的速度（MB/s）和单文件开销（秒），样本不足的档为 None"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+        if not entry:
+            return {}
+        result = {}
+        for (_, name), band in zip(SIZE_BANDS, entry['bands']):
+            fit = _fit(band)
+            result[name] = (1.0 / fit[1] / (1024 * 1024), fit[0]) if fit else None
+        return result
+
+    def keys_for(self, volume_id, src_path, dest_path):
+        """复制任务对应的历史标识"""
+        if isinstance(dest_path, (list, tuple)):
+            dest_path = dest_path[0]
+        keys = [f"reader:{volume_key(src_path)}", f"destination:{volume_key(dest_path)}"]
+        if volume_id:
+            keys.append(f"device:{volume_id}")
+        return keys
+
+    def estimate(self, sizes, keys):
+        """预计复制一组文件所需的时间（秒）"""
+        return estimate_with(self.models(keys), sizes)
+
+
+def estimate_with(models, sizes):
+    total = 0.0
+    for size in sizes:
+        overhead, per_byte = models[size_band(size)]
+        total += overhead + size * per_byte
+    return total
+
+
+class EtaEstimator:
+    """复制中的剩余时间：按历史模型预计剩余文件的耗时，并用已完成部分的实际耗时与预计耗时之比校准"""
+    def __init__(self, models, sizes):
+        self.models = models
+        self.total = estimate_with(models, sizes)
+        self.done = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def advance(self, sizes):
+        predicted = estimate_with(self.models, sizes)
+        with self._lock:
+            self.done += predicted
+
+    def remaining(self):
+        with self._lock:
+            done = self.done
+        elapsed = time.perf_counter() - self.started
+        scale = min(MAX_SCALE, max(MIN_SCALE, elapsed / done)) if done > 0 else 1.0
+        return max(0.0, (self.total - done) * scale)
@@ -0,0 +1,200 @@
+import os
+import time
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PyQt6.QtCore import QObject, pyqtSignal, QBuffer, QByteArray, QIODevice, QSize, Qt
+from PyQt6.QtGui import QImage, QImageReader
+
+from manifest import file_key
+from card_image import source_stat
+from media_metadata import read_embedded_preview
+
+THUMBNAIL_SIZE = 160
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存，按卷序列号、文件路径和指纹命名，超过容量上限时淘汰最久未使用的缩略图
+
+    缓存命中时更新文件的修改时间，淘汰时按修改时间从旧到新删除；
+    空文件表示该文件没有内嵌预览图，避免重复解析
+    """
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.logger = logging.getLogger('CamSync')
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index = None  # 文件名 -> [大小, 最后使用时间]
+        self._total_bytes = 0
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with os.scandir(self.cache_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith('.jpg'):
+                        st = entry.stat()
+                        self._index[entry.name] = [st.st_size, st.st_mtime]
+                        self._total_bytes += st.st_size
+        except OSError as e:
+            self.logger.error(f"加载缩略图缓存时发生错误: {str(e)}")
+
+    @staticmethod
+    def make_key(volume_id, key, st):
+        """生成缓存键：卷序列号 + 相对路径 + 指纹（大小、修改时间）"""
+        raw = f"{volume_id or ''}|{key}|{st.st_size}|{int(st.st_mtime)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest() + '.jpg'
+
+    def get(self, cache_key):
+        """读取缓存的缩略图，未命中时返回 None，没有预览图时返回 b''"""
+        self._load_index()
+        if cache_key not in self._index:
+            return None
+        path = os.path.join(self.cache_dir, cache_key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self._forget(cache_key)
+            return None
+        self._index[cache_key][1] = time.time()
+        return data
+
+    def put(self, cache_key, data):
+        """写入缩略图，并在超过容量上限时淘汰最久未使用的缩略图"""
+        self._load_index()
+        path = os.path.join(self.cache_dir, cache_key)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.logger.error(f"写入缩略图缓存时发生错误: {str(e)}")
+            return
+        self._forget(cache_key)
+        self._index[cache_key] = [len(data), os.path.getmtime(path)]
+        self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _forget(self, cache_key):
+        entry = self._index.pop(cache_key, None)
+        if entry:
+            self._total_bytes -= entry[0]
+
+    def _evict(self):
+        # 淘汰到容量上限的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        for cache_key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, cache_key))
+            except OSError:
+                pass
+            self._forget(cache_key)
+
+
+class ThumbnailLoader(QObject):
+    """缩略图加载器：先查磁盘缓存，未命中时在进程池中提取内嵌预览图，再在界面线程中缩放并写入缓存"""
+    thumbnail_ready = pyqtSignal(str, QImage)
+    _preview_extracted = pyqtSignal(str, str, bytes)
+
+    def __init__(self, cache, parent=None, max_workers=None):
+        super().__init__(parent)
+        self.logger = logging.getLogger('CamSync')
+        self.cache = cache
+        self.max_workers = max_workers or min(4, multiprocessing.cpu_count())
+        self._executor = None
+        self._pending = {}  # 源文件路径 -> Future
+        self._preview_extracted.connect(self._on_preview_extracted)
+
+    def _get_executor(self):
+        # 进程池在第一次需要提取预览图时才创建
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def request(self, src_path, volume_id, folder_path):
+        """请求文件的缩略图，结果通过 thumbnail_ready 信号返回"""
+        if src_path in self._pending:
+            return
+        try:
+            st = source_stat(src_path)
+        except OSError:
+            return
+        cache_key = ThumbnailCache.make_key(volume_id, file_key(folder_path, src_path), st)
+        data = self.cache.get(cache_key)
+        if data is not None:
+            # 缓存命中：直接显示，空数据表示没有预览图
+            if data:
+                self.thumbnail_ready.emit(src_path, QImage.fromData(data))
+            return
+        try:
+            future = self._get_executor().submit(read_embedded_preview, src_path)
+        except Exception as e:
+            self.logger.error(f"提交缩略图任务时发生错误: {str(e)}")
+            return
+        self._pending[src_path] = future
+        # 回调在进程池的管理线程中执行，通过信号回到界面线程
+        future.add_done_callback(lambda f, src_path=src_path, cache_key=cache_key:
+                                 self._emit_extracted(src_path, cache_key, f))
+
+    def _emit_extracted(self, src_path, cache_key, future):
+        if future.cancelled():
+            return
+        try:
+            data = future.result()
+        except Exception as e:
+            self.logger.warning(f"提取预览图失败: {src_path}, 错误: {str(e)}")
+            data = b''
+        self._preview_extracted.emit(src_path, cache_key, data)
+
+    def _on_preview_extracted(self, src_path, cache_key, data):
+        self._pending.pop(src_path, None)
+        if not data:
+            self.cache.put(cache_key, b'')
+            return
+        image = self._scale(data)
+        if image.isNull():
+            self.cache.put(cache_key, b'')
+            return
+        # 缓存缩放后的缩略图，再次打开同一张卡时无需重新提取
+        byte_array = QByteArray()
+        buffer = QBuffer(byte_array)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        image.save(buffer, 'JPG', 85)
+        buffer.close()
+        self.cache.put(cache_key, bytes(byte_array))
+        self.thumbnail_ready.emit(src_path, image)
+
+    def _scale(self, data):
+        """解码时直接缩小，JPEG 解码器可以跳过不需要的细节"""
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        reader = QImageReader(buffer)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid():
+            reader.setScaledSize(size.scaled(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE), Qt.AspectRatioMode.KeepAspectRatio))
+        return reader.read()
+
+    def cancel_pending(self):
+        """取消尚未开始的提取任务（对话框关闭时调用）"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def shutdown(self):
+        """关闭进程池（程序退出时调用）"""
+        self.cancel_pending()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
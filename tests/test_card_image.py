@@ -0,0 +1,438 @@
+import os
+import time
+import struct
+import calendar
+
+import pytest
+
+from card_image import (CardImage, FS_FAT16, FS_FAT32, FS_EXFAT, ATTR_DIRECTORY, EXFAT_FILE, EXFAT_STREAM, EXFAT_NAME,
+                        image_root, open_source, source_stat)
+
+SECTOR = 512
+# 整卡镜像中分区的起始扇区（与常见读卡器格式化结果相同，1 MB 对齐）
+PARTITION_START = 2048
+
+
+def _fat_date_time(fields):
+    year, month, day, hour, minute, second = fields
+    return ((year - 1980) << 9) | (month << 5) | day, (hour << 11) | (minute << 5) | (second // 2)
+
+
+def _local_timestamp(fields):
+    return time.mktime(tuple(fields) + (0, 0, -1))
+
+
+def _write_image(path, volume, mbr_offset):
+    """写出镜像文件，mbr_offset 非 0 时在前面加上只有一个分区的 MBR"""
+    with open(path, 'wb') as image:
+        if mbr_offset:
+            mbr = bytearray(SECTOR)
+            struct.pack_into('<BBBBBBBBII', mbr, 446, 0x00, 0, 0, 0, 0x0C, 0, 0, 0, mbr_offset,
+                             len(volume) // SECTOR)
+            mbr[510:512] = b'\x55\xaa'
+            image.write(mbr)
+            image.seek(mbr_offset * SECTOR)
+        image.write(volume)
+
+
+class _Allocator:
+    """按顺序分配簇，fragmented 时每两簇留一个空隙并把前后两半对调，得到向后跳转的簇链"""
+    def __init__(self, first=2):
+        self.next_free = first
+
+    def allocate(self, count, fragmented=False):
+        if not fragmented:
+            chain = list(range(self.next_free, self.next_free + count))
+            self.next_free += count
+            return chain
+        block = [self.next_free + i for i in range(count * 3) if i % 3 != 2][:count]
+        self.next_free = block[-1] + 2
+        half = len(block) // 2
+        return block[half:] + block[:half]
+
+
+class FatImageBuilder:
+    """构造 FAT16/FAT32 卷：每簇一个扇区，两份 FAT，FAT16 根目录位于固定区域"""
+    def __init__(self, fs_type, cluster_count=None, serial=0x1234ABCD):
+        self.fs_type = fs_type
+        self.cluster_size = SECTOR
+        self.cluster_count = cluster_count or (4200 if fs_type == FS_FAT16 else 65600)
+        self.serial = serial
+        self.reserved = 1 if fs_type == FS_FAT16 else 32
+        self.root_entries = 512 if fs_type == FS_FAT16 else 0
+        entry_bytes = 2 if fs_type == FS_FAT16 else 4
+        self.fat_sectors = -(-(self.cluster_count + 2) * entry_bytes // SECTOR)
+        self.first_data = self.reserved + 2 * self.fat_sectors + self.root_entries * 32 // SECTOR
+        self.end_of_chain = 0xFFFF if fs_type == FS_FAT16 else 0x0FFFFFFF
+        self.fat = [0] * (self.cluster_count + 2)
+        self.fat[0] = self.end_of_chain & ~0x07 | 0x08
+        self.fat[1] = self.end_of_chain
+        self.clusters = {}     # 簇号 -> 数据
+        self.dirs = {'': []}   # 目录路径 -> 32 字节目录项列表
+        self.dir_chains = {}   # 目录路径 -> 簇链（FAT16 根目录没有）
+        self._allocator = _Allocator()
+        self._short_index = 0
+        if fs_type == FS_FAT32:
+            self.dir_chains[''] = self._chain(4)
+
+    def _chain(self, count, fragmented=False):
+        chain = self._allocator.allocate(count, fragmented)
+        for cluster, next_cluster in zip(chain, chain[1:] + [self.end_of_chain]):
+            self.fat[cluster] = next_cluster
+        return chain
+
+    @staticmethod
+    def _checksum(short_name):
+        checksum = 0
+        for byte in short_name:
+            checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+        return checksum
+
+    def _records(self, name, short_name, attributes, cluster, size, mtime, case_flags, lfn, bad_checksum):
+        records = []
+        if lfn:
+            checksum = self._checksum(short_name) ^ (0xFF if bad_checksum else 0)
+            encoded = name.encode('utf-16-le') + b'\x00\x00'
+            encoded += b'\xff' * (-len(encoded) % 26)
+            parts = [encoded[i:i + 26] for i in range(0, len(encoded), 26)]
+            for sequence in range(len(parts), 0, -1):
+                part = parts[sequence - 1]
+                record = bytearray(32)
+                record[0] = sequence | (0x40 if sequence == len(parts) else 0)
+                record[1:11] = part[0:10]
+                record[11] = 0x0F
+                record[13] = checksum
+                record[14:26] = part[10:22]
+                record[28:32] = part[22:26]
+                records.append(bytes(record))
+        date, time_value = _fat_date_time(mtime)
+        record = bytearray(32)
+        record[0:11] = short_name
+        record[11] = attributes
+        record[12] = case_flags
+        struct.pack_into('<HHHHI', record, 20, cluster >> 16, time_value, date, cluster & 0xFFFF, size)
+        records.append(bytes(record))
+        return records
+
+    def _next_short_name(self, name):
+        self._short_index += 1
+        ext = os.path.splitext(name)[1][1:4].upper().encode('ascii')
+        return f"F{self._short_index:04d}~1".encode('ascii').ljust(8, b' ') + ext.ljust(3, b' ')
+
+    def mkdir(self, path, mtime=(2024, 5, 1, 12, 0, 0)):
+        parent, _, name = path.rpartition('/')
+        chain = self._chain(4)
+        self.dir_chains[path] = chain
+        short_name = name.upper().encode('ascii')[:8].ljust(11, b' ')
+        dot = self._records('.', b'.' + b' ' * 10, ATTR_DIRECTORY, chain[0], 0, mtime, 0, False, False)
+        parent_cluster = self.dir_chains[parent][0] if parent in self.dir_chains and parent else 0
+        dotdot = self._records('..', b'..' + b' ' * 9, ATTR_DIRECTORY, parent_cluster, 0, mtime, 0, False, False)
+        self.dirs[path] = dot + dotdot
+        self.dirs[parent] += self._records(name, short_name, ATTR_DIRECTORY, chain[0], 0, mtime, 0, False, False)
+
+    def add_file(self, path, data, mtime, short_name=None, case_flags=0, lfn=True, bad_checksum=False,
+                 fragmented=False):
+        parent, _, name = path.rpartition('/')
+        count = -(-len(data) // self.cluster_size)
+        chain = self._chain(count, fragmented) if count else [0]
+        for index, cluster in enumerate(chain if count else []):
+            self.clusters[cluster] = data[index * self.cluster_size:(index + 1) * self.cluster_size]
+        short_name = short_name or self._next_short_name(name)
+        self.dirs[parent] += self._records(name, short_name, 0x20, chain[0], len(data), mtime, case_flags,
+                                           lfn, bad_checksum)
+        return chain
+
+    def build(self, path, mbr_offset=0):
+        volume = bytearray((self.first_data + self.cluster_count) * SECTOR)
+        boot = bytearray(SECTOR)
+        boot[0:3] = b'\xeb\x3c\x90'
+        boot[3:11] = b'MSDOS5.0'
+        total = self.first_data + self.cluster_count
+        struct.pack_into('<HBHBHHBH', boot, 11, SECTOR, 1, self.reserved, 2, self.root_entries,
+                         total if total < 0x10000 else 0, 0xF8, self.fat_sectors if self.fs_type == FS_FAT16 else 0)
+        struct.pack_into('<I', boot, 32, total if total >= 0x10000 else 0)
+        if self.fs_type == FS_FAT32:
+            struct.pack_into('<II', boot, 36, self.fat_sectors, 0)
+            struct.pack_into('<I', boot, 44, self.dir_chains[''][0])
+            struct.pack_into('<I', boot, 67, self.serial)
+        else:
+            struct.pack_into('<I', boot, 39, self.serial)
+        boot[510:512] = b'\x55\xaa'
+        volume[0:SECTOR] = boot
+        fat = struct.pack(f"<{len(self.fat)}{'H' if self.fs_type == FS_FAT16 else 'I'}", *self.fat)
+        for copy in range(2):
+            start = (self.reserved + copy * self.fat_sectors) * SECTOR
+            volume[start:start + len(fat)] = fat
+
+        def cluster_offset(cluster):
+            return (self.first_data + cluster - 2) * SECTOR
+
+        for dir_path, records in self.dirs.items():
+            data = b''.join(records)
+            chain = self.dir_chains.get(dir_path)
+            if chain is None:
+                start = (self.reserved + 2 * self.fat_sectors) * SECTOR
+                assert len(data) <= self.root_entries * 32
+                volume[start:start + len(data)] = data
+                continue
+            assert len(data) <= len(chain) * self.cluster_size
+            for index, cluster in enumerate(chain):
+                self.clusters[cluster] = data[index * self.cluster_size:(index + 1) * self.cluster_size]
+        for cluster, data in self.clusters.items():
+            volume[cluster_offset(cluster):cluster_offset(cluster) + len(data)] = data
+        _write_image(path, volume, mbr_offset)
+
+
+class ExfatImageBuilder:
+    """构造 exFAT 卷：4 KB 簇，根目录使用 FAT 链，子目录连续存放（NoFatChain）"""
+    CLUSTER_SHIFT = 3
+
+    def __init__(self, cluster_count=256, serial=0x5EED0001):
+        self.cluster_size = SECTOR << self.CLUSTER_SHIFT
+        self.cluster_count = cluster_count
+        self.serial = serial
+        self.fat_offset = 24
+        self.fat_length = -(-(cluster_count + 2) * 4 // SECTOR)
+        self.heap_offset = -(-(self.fat_offset + self.fat_length) // 8) * 8
+        self.fat = [0] * (cluster_count + 2)
+        self.fat[0] = 0xFFFFFFF8
+        self.fat[1] = 0xFFFFFFFF
+        self.clusters = {}
+        self._allocator = _Allocator()
+        root_chain = self._chain(2, fat_chain=True)
+        # 根目录中的分配位图和卷标目录项，解析时应当跳过
+        bitmap = bytearray(32)
+        bitmap[0] = 0x81
+        label = bytearray(32)
+        label[0] = 0x83
+        self.dirs = {'': [bytes(bitmap), bytes(label)]}
+        self.dir_chains = {'': (root_chain, False)}
+
+    def _chain(self, count, fat_chain, fragmented=False):
+        chain = self._allocator.allocate(count, fragmented)
+        if fat_chain:
+            for cluster, next_cluster in zip(chain, chain[1:] + [0xFFFFFFFF]):
+                self.fat[cluster] = next_cluster
+        return chain
+
+    def _entry_set(self, name, attributes, first_cluster, size, valid_size, mtime, centiseconds, utc_offset,
+                   no_fat_chain):
+        name_parts = [name[i:i + 15] for i in range(0, len(name), 15)]
+        date, time_value = _fat_date_time(mtime)
+        timestamp = (date << 16) | time_value
+        file_entry = bytearray(32)
+        file_entry[0] = EXFAT_FILE
+        file_entry[1] = 1 + len(name_parts)
+        struct.pack_into('<HHIII', file_entry, 4, attributes, 0, timestamp, timestamp, timestamp)
+        file_entry[21] = centiseconds
+        file_entry[23] = 0 if utc_offset is None else 0x80 | (utc_offset & 0x7F)
+        stream = bytearray(32)
+        stream[0] = EXFAT_STREAM
+        stream[1] = 0x01 | (0x02 if no_fat_chain else 0)
+        stream[3] = len(name)
+        struct.pack_into('<Q', stream, 8, valid_size)
+        struct.pack_into('<IQ', stream, 20, first_cluster, size)
+        records = [bytes(file_entry), bytes(stream)]
+        for part in name_parts:
+            name_entry = bytearray(32)
+            name_entry[0] = EXFAT_NAME
+            encoded = part.encode('utf-16-le')
+            name_entry[2:2 + len(encoded)] = encoded
+            records.append(bytes(name_entry))
+        return records
+
+    def mkdir(self, path, mtime=(2024, 5, 1, 12, 0, 0)):
+        parent, _, name = path.rpartition('/')
+        chain = self._chain(2, fat_chain=False)
+        self.dirs[path] = []
+        self.dir_chains[path] = (chain, True)
+        size = len(chain) * self.cluster_size
+        self.dirs[parent] += self._entry_set(name, ATTR_DIRECTORY, chain[0], size, size, mtime, 0, None, True)
+
+    def add_file(self, path, data, mtime, centiseconds=0, utc_offset=None, fragmented=False, valid_size=None):
+        """valid_size 小于文件大小时，有效数据长度之后的簇中写入非零的残留数据"""
+        parent, _, name = path.rpartition('/')
+        valid_size = len(data) if valid_size is None else valid_size
+        count = -(-len(data) // self.cluster_size)
+        chain = self._chain(count, fat_chain=fragmented, fragmented=fragmented) if count else [0]
+        stale = bytes([0xA5]) * self.cluster_size
+        for index, cluster in enumerate(chain if count else []):
+            start = index * self.cluster_size
+            chunk = data[start:min(start + self.cluster_size, valid_size)]
+            self.clusters[cluster] = chunk + stale[len(chunk):]
+        self.dirs[parent] += self._entry_set(name, 0x20, chain[0], len(data), valid_size, mtime, centiseconds,
+                                             utc_offset, not fragmented)
+        return chain
+
+    def build(self, path, mbr_offset=0):
+        total_sectors = self.heap_offset + self.cluster_count * (1 << self.CLUSTER_SHIFT)
+        volume = bytearray(total_sectors * SECTOR)
+        boot = bytearray(SECTOR)
+        boot[0:3] = b'\xeb\x76\x90'
+        boot[3:11] = b'EXFAT   '
+        struct.pack_into('<QQIIIIII', boot, 64, mbr_offset, total_sectors, self.fat_offset, self.fat_length,
+                         self.heap_offset, self.cluster_count, self.dir_chains[''][0][0], self.serial)
+        boot[108] = 9
+        boot[109] = self.CLUSTER_SHIFT
+        boot[110] = 1
+        boot[510:512] = b'\x55\xaa'
+        volume[0:SECTOR] = boot
+        fat = struct.pack(f"<{len(self.fat)}I", *self.fat)
+        volume[self.fat_offset * SECTOR:self.fat_offset * SECTOR + len(fat)] = fat
+        for dir_path, records in self.dirs.items():
+            data = b''.join(records)
+            chain, _ = self.dir_chains[dir_path]
+            assert len(data) <= len(chain) * self.cluster_size
+            for index, cluster in enumerate(chain):
+                self.clusters[cluster] = data[index * self.cluster_size:(index + 1) * self.cluster_size]
+        for cluster, data in self.clusters.items():
+            offset = self.heap_offset * SECTOR + (cluster - 2) * self.cluster_size
+            volume[offset:offset + len(data)] = data
+        _write_image(path, volume, mbr_offset)
+
+
+def _payload(size, seed):
+    """不重复的测试数据，簇顺序错误时内容一定不同"""
+    return b''.join(struct.pack('<II', seed, i) for i in range(-(-size // 8)))[:size]
+
+
+MTIME = (2024, 5, 17, 9, 41, 36)
+
+
+def _build_fat_card(tmp_path, fs_type, mbr_offset=0):
+    """DCIM/100TEST 下放入各种目录项，返回 (镜像路径, {镜像内路径: (内容, 修改时间)})"""
+    builder = FatImageBuilder(fs_type)
+    builder.mkdir('DCIM')
+    builder.mkdir('DCIM/100TEST')
+    expected = {}
+
+    def add(name, data, mtime=MTIME, **kwargs):
+        chain = builder.add_file('DCIM/100TEST/' + kwargs.pop('stored_name', name), data, mtime, **kwargs)
+        expected['DCIM/100TEST/' + name] = (data, _local_timestamp(mtime))
+        return chain
+
+    add('IMG_0001.JPG', _payload(5000, 1), short_name=b'IMG_0001JPG', lfn=False)
+    chain = add('Long name with spaces.jpeg', _payload(12 * SECTOR + 100, 2), fragmented=True)
+    # Windows NT 的大小写标志：主名和扩展名都是小写
+    add('readme.txt', _payload(700, 3), short_name=b'README  TXT', lfn=False, case_flags=0x18)
+    # 长文件名的校验和与短文件名不符时（长文件名是其他系统留下的残留），只使用短文件名
+    add('STALE~1.MOV', _payload(900, 4), stored_name='Orphaned long name.mov', short_name=b'STALE~1 MOV',
+        bad_checksum=True)
+    add('EMPTY.BIN', b'', short_name=b'EMPTY   BIN', lfn=False)
+    add('IMG_0002.CR3', _payload(3 * SECTOR, 5), mtime=(2023, 12, 31, 23, 59, 58))
+    image_path = str(tmp_path / f"{fs_type}.img")
+    builder.build(image_path, mbr_offset)
+    return image_path, expected, chain
+
+
+def _build_exfat_card(tmp_path, mbr_offset=0):
+    builder = ExfatImageBuilder()
+    builder.mkdir('DCIM')
+    builder.mkdir('DCIM/100TEST')
+    expected = {}
+    contiguous = _payload(3 * builder.cluster_size + 10, 11)
+    builder.add_file('DCIM/100TEST/IMG_0001.JPG', contiguous, MTIME, centiseconds=150)
+    expected['DCIM/100TEST/IMG_0001.JPG'] = (contiguous, _local_timestamp(MTIME) + 1.5)
+    fragmented = _payload(6 * builder.cluster_size - 1, 12)
+    chain = builder.add_file('DCIM/100TEST/Clip with a long name.mp4', fragmented, MTIME, fragmented=True)
+    expected['DCIM/100TEST/Clip with a long name.mp4'] = (fragmented, _local_timestamp(MTIME))
+    # 记录了 UTC+8 时区偏移的时间戳按 UTC 换算
+    builder.add_file('DCIM/100TEST/IMG_0002.ARW', _payload(2000, 13), MTIME, utc_offset=32)
+    expected['DCIM/100TEST/IMG_0002.ARW'] = (_payload(2000, 13), calendar.timegm(MTIME) - 8 * 3600)
+    # 有效数据长度之后读作 0（预分配后相机只写入了一部分）
+    data = _payload(2 * builder.cluster_size + 300, 14)
+    builder.add_file('DCIM/100TEST/PREALLOC.MOV', data, MTIME, valid_size=builder.cluster_size + 100)
+    expected['DCIM/100TEST/PREALLOC.MOV'] = (data[:builder.cluster_size + 100] +
+                                             bytes(builder.cluster_size + 200), _local_timestamp(MTIME))
+    builder.add_file('DCIM/100TEST/EMPTY.BIN', b'', MTIME)
+    expected['DCIM/100TEST/EMPTY.BIN'] = (b'', _local_timestamp(MTIME))
+    image_path = str(tmp_path / 'exfat.img')
+    builder.build(image_path, mbr_offset)
+    return image_path, expected, chain
+
+
+def _build_card(tmp_path, fs_type, mbr_offset=0):
+    if fs_type == FS_EXFAT:
+        return _build_exfat_card(tmp_path, mbr_offset)
+    return _build_fat_card(tmp_path, fs_type, mbr_offset)
+
+
+def _read_all(path):
+    with open_source(path) as source:
+        return source.read()
+
+
+@pytest.mark.parametrize('mbr_offset', [0, PARTITION_START])
+@pytest.mark.parametrize('fs_type', [FS_FAT16, FS_FAT32, FS_EXFAT])
+def test_image_listing_contents_and_times(tmp_path, fs_type, mbr_offset):
+    image_path, expected, _ = _build_card(tmp_path, fs_type, mbr_offset)
+    image = CardImage(image_path)
+    try:
+        assert image.fs_type == fs_type
+        assert set(image.listdir('')) == {'DCIM'}
+        names = set(image.listdir('DCIM/100TEST'))
+        assert names == {inner_path.rpartition('/')[2] for inner_path in expected}
+    finally:
+        image.close()
+    root = image_root(image_path)
+    for inner_path, (data, mtime) in expected.items():
+        path = os.path.join(root, *inner_path.split('/'))
+        st = source_stat(path)
+        assert st.st_size == len(data)
+        assert st.st_mtime == pytest.approx(mtime, abs=1e-6)
+        assert _read_all(path) == data
+
+
+@pytest.mark.parametrize('fs_type', [FS_FAT16, FS_FAT32, FS_EXFAT])
+def test_fragmented_chain_is_read_in_chain_order(tmp_path, fs_type):
+    image_path, expected, chain = _build_card(tmp_path, fs_type)
+    image = CardImage(image_path)
+    try:
+        name = next(inner_path for inner_path in expected if 'long name' in inner_path.lower())
+        entry = image.lookup(name)
+        runs = image.cluster_runs(entry.first_cluster, entry.size, entry.contiguous)
+        # 两簇一段，前后两半对调：区段数与不连续的位置一致，且按簇链顺序而不是磁盘顺序排列
+        breaks = sum(1 for a, b in zip(chain, chain[1:]) if b != a + 1)
+        assert len(runs) == breaks + 1
+        assert runs[0][0] > runs[-1][0]
+        assert sum(length for _, length in runs) == entry.size
+        with image.open(name) as source:
+            # 跨越区段边界的随机读取
+            source.seek(image.cluster_size * 2 - 7)
+            data = expected[name][0]
+            assert source.read(image.cluster_size + 20) == data[image.cluster_size * 2 - 7:image.cluster_size * 3 + 13]
+    finally:
+        image.close()
+
+
+def test_short_name_case_flags_and_lfn_checksum(tmp_path):
+    image_path, _, _ = _build_card(tmp_path, FS_FAT16)
+    image = CardImage(image_path)
+    try:
+        names = set(image.listdir('DCIM/100TEST'))
+    finally:
+        image.close()
+    assert 'readme.txt' in names and 'README.TXT' not in names
+    assert 'STALE~1.MOV' in names and 'Orphaned long name.mov' not in names
+    assert 'Long name with spaces.jpeg' in names
+
+
+@pytest.mark.parametrize('fs_type', [FS_FAT16, FS_FAT32, FS_EXFAT])
+def test_copy_from_image(tmp_path, fs_type):
+    pytest.importorskip('PyQt6.QtCore')
+    from file_operations import FileOperations
+
+    image_path, expected, _ = _build_card(tmp_path, fs_type, PARTITION_START)
+    src_dir = os.path.join(image_root(image_path), 'DCIM')
+    dest_dir = str(tmp_path / 'backup' / 'DCIM')
+    operations = FileOperations()
+    table = operations.scan_file_table(src_dir, dest_dir)
+    assert len(table) == len(expected)
+    items = [(table.src_path(row), table.dest_path(row)) for row in range(len(table))]
+    success, message = operations._execute_copy_operation(items)
+    assert success, message
+    for inner_path, (data, mtime) in expected.items():
+        dest_path = os.path.join(str(tmp_path / 'backup'), *inner_path.split('/'))
+        with open(dest_path, 'rb') as dest_file:
+            assert dest_file.read() == data
+        assert os.stat(dest_path).st_mtime == pytest.approx(mtime, abs=1e-6)
@@ -0,0 +1,66 @@
+import os
+
+from dir_index import DirectoryIndex
+
+
+def _scan(folder, config):
+    """模拟一次插入：列出根目录下的子目录，返回被列出的子目录和新的目录索引"""
+    index = DirectoryIndex.from_config(folder, config)
+    listed = []
+    with os.scandir(folder) as entries:
+        subdirs = [entry for entry in entries if entry.is_dir()]
+    index.record('', os.stat(folder), [], len(subdirs))
+    for entry in sorted(subdirs, key=lambda entry: entry.name):
+        if index.should_scan(entry.name, entry.stat()):
+            listed.append(entry.name)
+            with os.scandir(entry.path) as files:
+                index.record(entry.name, entry.stat(), list(files), 0)
+    index.save_to(config)
+    return listed
+
+
+def _make_dirs(folder):
+    for name, mtime in (('100CANON', 1700000000), ('101CANON', 1700001000)):
+        os.makedirs(folder / name)
+        (folder / name / 'IMG_0001.JPG').write_bytes(b'x')
+        (folder / name / 'IMG_0001.CR3').write_bytes(b'y')
+        os.utime(folder / name / 'IMG_0001.JPG', (mtime, mtime))
+        os.utime(folder / name / 'IMG_0001.CR3', (mtime, mtime))
+        os.utime(folder / name, (mtime, mtime))
+
+
+def test_changed_patterns_discard_fingerprints(tmp_path):
+    _make_dirs(tmp_path)
+    config = {'file_patterns': ['*.JPG'], 'dir_mtime_reliable': True}
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
+    # 101CANON 是相机正在写入的目录，总是重新列出
+    assert _scan(tmp_path, config) == ['101CANON']
+    config['file_patterns'] = ['*']
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
+    assert _scan(tmp_path, config) == ['101CANON']
+
+
+def test_skipping_waits_for_verified_directory_mtimes(tmp_path):
+    _make_dirs(tmp_path)
+    config = {}
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
+    # 尚未验证目录修改时间是否可靠，所有目录都重新列出
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
+    assert config['dir_mtime_reliable'] is None
+    (tmp_path / '100CANON' / 'IMG_0002.JPG').write_bytes(b'z')
+    os.utime(tmp_path / '100CANON', (1700002000, 1700002000))
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
+    assert config['dir_mtime_reliable'] is True
+    assert _scan(tmp_path, config) == ['100CANON']
+
+
+def test_unchanged_mtime_with_new_content_stops_skipping(tmp_path):
+    _make_dirs(tmp_path)
+    config = {'dir_mtime_reliable': None}
+    _scan(tmp_path, config)
+    # 101CANON 总是列出：内容变化而修改时间未变
+    (tmp_path / '101CANON' / 'IMG_0002.JPG').write_bytes(b'z')
+    os.utime(tmp_path / '101CANON', (1700001000, 1700001000))
+    _scan(tmp_path, config)
+    assert config['dir_mtime_reliable'] is False
+    assert _scan(tmp_path, config) == ['100CANON', '101CANON']
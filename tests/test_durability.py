@@ -0,0 +1,41 @@
+import os
+import stat
+
+import pytest
+
+from durability import SyncBatcher, preallocate
+
+
+def test_batch_sync_read_only_file(tmp_path):
+    path = tmp_path / 'IMG_0001.JPG'
+    path.write_bytes(b'x' * 1000)
+    # 相机写保护的文件复制后目标也是只读的
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    batcher = SyncBatcher('batch', 1)
+    batcher.file_written(str(path), 1000)
+    assert batcher.failed == []
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o444
+
+
+def test_sync_failures_are_reported(tmp_path):
+    batcher = SyncBatcher('batch', 1024 * 1024)
+    batcher.file_written(str(tmp_path / 'missing.JPG'), 1000)
+    assert batcher.failed == []
+    batcher.flush()
+    assert [path for path, _ in batcher.failed] == [str(tmp_path / 'missing.JPG')]
+
+
+def test_preallocate_extends_file(tmp_path):
+    with open(tmp_path / 'CLIP0001.MP4', 'wb') as f:
+        if not preallocate(f, 1024 * 1024):
+            pytest.skip('文件系统不支持预分配')
+        assert os.fstat(f.fileno()).st_size == 1024 * 1024
+
+
+def test_preallocate_unsupported_returns_false():
+    read_fd, write_fd = os.pipe()
+    try:
+        with os.fdopen(write_fd, 'wb') as f:
+            assert preallocate(f, 1024 * 1024) is False
+    finally:
+        os.close(read_fd)
@@ -0,0 +1,47 @@
+import os
+
+from file_table import FileTable
+from manifest import is_known, refresh_entries
+
+MTIME = 1711846800  # 夏令时切换前后同一文件的修改时间相差 3600 秒
+
+
+def _card_file(folder, name, data=b'x' * 4096):
+    path = folder / name
+    path.write_bytes(data)
+    os.utime(path, (MTIME, MTIME))
+    return str(path)
+
+
+def test_offset_match_records_refreshed_fingerprint(tmp_path):
+    src_path = _card_file(tmp_path, 'IMG_0001.JPG')
+    manifest = {'IMG_0001.JPG': [4096, MTIME - 3600], 'IMG_0002.JPG': [10, 0]}
+    refreshed = {}
+    assert is_known(manifest, 'IMG_0001.JPG', src_path, refreshed=refreshed)
+    assert refreshed == {'IMG_0001.JPG': [4096, MTIME]}
+    updated = refresh_entries(manifest, refreshed)
+    assert updated['IMG_0001.JPG'] == [4096, MTIME]
+    assert manifest['IMG_0001.JPG'] == [4096, MTIME - 3600]
+    # 更新后按修改时间一致判定，不再比较内容
+    refreshed = {}
+    assert is_known(updated, 'IMG_0001.JPG', src_path, refreshed=refreshed)
+    assert refreshed == {}
+
+
+def test_file_table_collects_refreshed_fingerprints(tmp_path):
+    card = tmp_path / 'card'
+    backup = tmp_path / 'backup'
+    card.mkdir()
+    backup.mkdir()
+    _card_file(card, 'IMG_0001.JPG')
+    _card_file(backup, 'IMG_0001.JPG')
+    _card_file(card, 'IMG_0002.JPG')
+    table = FileTable(str(card), str(backup))
+    dir_id = table.add_dir('')
+    for name in ('IMG_0001.JPG', 'IMG_0002.JPG'):
+        table.append(dir_id, name, 4096, MTIME * 1000000000)
+    saved = {'IMG_0001.JPG': [4096, MTIME + 3600]}
+    unsaved = {'IMG_0002.JPG': [4096, MTIME + 3600]}
+    assert len(table.mark_new(saved, unsaved)) == 0
+    assert table.refreshed == {'saved_files': {'IMG_0001.JPG': [4096, MTIME]},
+                               'unsaved_files': {'IMG_0002.JPG': [4096, MTIME]}}
@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from destinations import ObjectStoreBackend
+from local_object_store import LocalObjectStoreServer
+from object_store import ObjectStoreClient, ObjectStoreError
+
+ACCESS_KEY = 'CAMSYNCTEST'
+SECRET_KEY = 'camsync-test-secret'
+BUCKET = 'backup'
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = LocalObjectStoreServer(str(tmp_path / 'store'), port=0, access_key=ACCESS_KEY, secret_key=SECRET_KEY)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def _backend(server, executor, secret_key=SECRET_KEY):
+    client = ObjectStoreClient(server.endpoint, ACCESS_KEY, secret_key)
+    return ObjectStoreBackend(BUCKET, client, PART_SIZE, max_parallel_parts=2, executor=executor)
+
+
+def _stored_path(server, key):
+    return os.path.join(server.root, BUCKET, *key.split('/'))
+
+
+def _payload(size):
+    return bytes(range(256)) * (size // 256) + bytes(size % 256)
+
+
+def test_multipart_upload_above_part_size(server, executor):
+    backend = _backend(server, executor)
+    data = _payload(PART_SIZE * 2 + 12345)
+    writer = backend.open_writer(f"s3://{BUCKET}/DCIM/100TEST/CLIP0001.MP4", SimpleNamespace(st_mtime=1716000000.25))
+    for start in range(0, len(data), 1024 * 1024):
+        writer.write(data[start:start + 1024 * 1024])
+    assert writer._upload_id is not None
+    writer.close()
+    with open(_stored_path(server, 'DCIM/100TEST/CLIP0001.MP4'), 'rb') as stored:
+        assert stored.read() == data
+    metadata = server.metadata[_stored_path(server, 'DCIM/100TEST/CLIP0001.MP4')]
+    assert {name.lower(): value for name, value in metadata.items()}['x-amz-meta-mtime'] == '1716000000.250'
+    # 完成后不留下分块
+    assert os.listdir(server.uploads) == []
+
+
+def test_abort_leaves_no_object(server, executor):
+    backend = _backend(server, executor)
+    path = f"s3://{BUCKET}/DCIM/100TEST/CLIP0002.MP4"
+    writer = backend.open_writer(path, SimpleNamespace(st_mtime=1716000000.0))
+    writer.write(_payload(PART_SIZE + 1000))
+    assert writer._upload_id is not None
+    backend.abort_writer(writer, path)
+    assert not os.path.exists(_stored_path(server, 'DCIM/100TEST/CLIP0002.MP4'))
+    assert os.listdir(server.uploads) == []
+    assert backend.stat(path) is None
+
+
+def test_stat_and_list_dir(server, executor):
+    backend = _backend(server, executor)
+    st = SimpleNamespace(st_mtime=1716000000.0)
+    backend.write_file(f"s3://{BUCKET}/DCIM/100TEST/IMG_0001.JPG", b'x' * 1000, st)
+    backend.write_file(f"s3://{BUCKET}/DCIM/100TEST/IMG_0002.JPG", b'y' * 2000, st)
+    backend.write_file(f"s3://{BUCKET}/DCIM/101TEST/IMG_0003.JPG", b'z' * 3000, st)
+    backend.reset()
+    listing = backend.list_dir(f"s3://{BUCKET}/DCIM/100TEST")
+    assert sorted(listing) == ['IMG_0001.JPG', 'IMG_0002.JPG']
+    size, mtime = backend.stat(f"s3://{BUCKET}/DCIM/100TEST/IMG_0002.JPG")
+    assert size == 2000
+    # LastModified 为上传时间，向上取整到秒
+    assert mtime >= os.stat(_stored_path(server, 'DCIM/100TEST/IMG_0002.JPG')).st_mtime
+    assert backend.stat(f"s3://{BUCKET}/DCIM/100TEST/IMG_9999.JPG") is None
+    assert backend.stat(f"s3://{BUCKET}/DCIM/101TEST/IMG_0003.JPG")[0] == 3000
+
+
+def test_bad_secret_key_is_rejected(server, executor):
+    backend = _backend(server, executor, secret_key='wrong-secret')
+    with pytest.raises(ObjectStoreError, match='403'):
+        backend.write_file(f"s3://{BUCKET}/DCIM/100TEST/IMG_0001.JPG", b'x' * 1000, SimpleNamespace(st_mtime=0.0))
+    writer = backend.open_writer(f"s3://{BUCKET}/DCIM/100TEST/CLIP0003.MP4", SimpleNamespace(st_mtime=0.0))
+    with pytest.raises(ObjectStoreError, match='403'):
+        writer.write(_payload(PART_SIZE))
+    assert not os.path.exists(_stored_path(server, 'DCIM/100TEST/IMG_0001.JPG'))
+    # 列出失败按空目录处理，复制流程会重新上传
+    assert backend.list_dir(f"s3://{BUCKET}/DCIM/100TEST") == {}